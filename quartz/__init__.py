@@ -1,12 +1,19 @@
 
 import io
-from fnmatch import fnmatch
+import math
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
+from functools import lru_cache
 
 import numpy
 import scipy.signal as sig
 
 class DataChannel(numpy.ndarray):
     """Data set which is augmented with UFF meta-data, accessible as attributes
+
+    The abscissa runs along the last axis.  eg. (nchan, N) from Quartz.matrix()
     """
     _info = _abscissa = None
     def __getattr__(self, k):
@@ -20,43 +27,243 @@ class DataChannel(numpy.ndarray):
         '''Return abscissa (usually timebase) array'''
         R = self._abscissa
         if R is None:
-            assert self.ndim==1
-            start, step = self._info['abscissa_min'], self._info['abscissa_inc']
-            self._abscissa = R = numpy.arange(self.shape[0], dtype='f8')*step + start
+            assert self.ndim>=1
+            self._abscissa = R = _abscissa(self._info, self.shape[-1])
         return R
 
     # aka. in the most common case...
     time = abscissa
 
     def slice(self, start=None, end=None) -> 'DataChannel':
-        '''Return DataChannel sliced along abscissa
+        '''Return DataChannel sliced along abscissa, without copying samples
         '''
-        absc = self.abscissa
-        mask = numpy.logical_and(
-            absc >= start,
-            absc < end,
-        )
-        absc = absc[mask]
-
-        info = self._info.copy()
-        info['abscissa_min'] = absc[0]
-
-        R = self[mask].view(self.__class__)
-        R._info = info
-        R._abscissa = absc
+        i0, i1 = _sample_range(self._info, start, end)
+        i1 = self.shape[-1] if i1 is None else min(i1, self.shape[-1])
+        i0 = min(i0, i1)
+
+        R = self[..., i0:i1].view(self.__class__)
+        R._info = _range_info(self._info, i0, i1)
+        if self._abscissa is not None:
+            R._abscissa = self._abscissa[i0:i1]
         return R
 
     def decimate(self, n, **kws) -> 'DataChannel':
         '''Apply scipy.signal.decimate
         '''
         R = sig.decimate(self, n, **kws).view(self.__class__)
-        R._info = self._info.copy()
-        R._info['abscissa_inc'] *= n
+        R._info = _decimate_info(self._info, n)
         R._abscissa = None
         return R
 
     # TODO: add __round__()
 
+class RawChannel(DataChannel):
+    """Integer counts with calibration meta-data 'slope' and 'intercept'.
+
+    Calibration is applied on request by calibrate(),
+    or implicitly as float64 by arithmetic and other numpy ufuncs.
+    max(), min(), argmax(), and argmin() are found from counts, as calibrated.
+    Indexing a single element also gives a calibrated float64, so that eg. D[D.argmax()]==D.max().
+    numpy.asarray(), .counts, and item() give uncalibrated counts.
+    Placeholders marked by info 'gap_mask', or equal to info 'gap_fill', calibrate to NaN.
+
+    Views made by indexing keep calibration meta-data, but not the abscissa.
+    Use slice() to keep the abscissa.
+    """
+    def __array_finalize__(self, obj):
+        info = getattr(obj, '_info', None)
+        if info is not None:
+            info = {K:V for K, V in info.items() if not K.startswith('abscissa') and K!='gap_mask'}
+            if 'gap_mask' in obj._info: # placeholders no longer aligned with mask
+                info['gap_fill'] = numpy.iinfo(self.dtype).min
+        self._info = info
+
+    @property
+    def counts(self) -> numpy.ndarray:
+        '''Uncalibrated counts'''
+        return self.view(numpy.ndarray)
+
+    def _gapped(self) -> bool:
+        return 'gap_mask' in self._info or 'gap_fill' in self._info
+
+    def __getitem__(self, key):
+        R = super().__getitem__(key)
+        if isinstance(R, numpy.ndarray):
+            return R
+        # single element, calibrated as by calibrate()
+        if self._gapped() and R==self._info.get('gap_fill', numpy.iinfo(self.dtype).min):
+            return numpy.float64(numpy.nan)
+        return numpy.float64(R)*self._info['slope'] + self._info['intercept']
+
+    # printed as counts, since elements are calibrated
+    def __repr__(self):
+        prefix = f'{self.__class__.__name__}('
+        return f'{prefix}{numpy.array2string(self.counts, separator=", ", prefix=prefix)}, dtype={self.dtype})'
+
+    def __str__(self):
+        return str(self.counts)
+
+    def calibrate(self, dtype='f8') -> DataChannel:
+        '''Return calibrated DataChannel.  eg. dtype='f4' for bulk processing
+        '''
+        R = self.counts.astype(dtype)
+        R *= self._info['slope']
+        R += self._info['intercept']
+        mask = self._info.get('gap_mask')
+        if mask is None and 'gap_fill' in self._info:
+            mask = self.counts==self._info['gap_fill']
+        if mask is not None:
+            R[mask] = numpy.nan
+        R = R.view(DataChannel)
+        R._info = self._info
+        R._abscissa = self._abscissa
+        return R
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kws):
+        if method=='reduce' and ufunc in (numpy.maximum, numpy.minimum) \
+                and len(inputs)==1 and set(kws) <= {'axis', 'keepdims'} \
+                and not self._gapped():
+            # calibration is monotonic, so extrema of counts are calibrated extrema
+            slope = self._info['slope']
+            if slope < 0:
+                ufunc = numpy.minimum if ufunc is numpy.maximum else numpy.maximum
+            return ufunc.reduce(self.counts, **kws) * slope + self._info['intercept']
+
+        if any(isinstance(O, RawChannel) for O in kws.get('out', ())):
+            raise TypeError('RawChannel can not be output.  calibrate() first')
+        inputs = [I.calibrate() if isinstance(I, RawChannel) else I for I in inputs]
+        return getattr(ufunc, method)(*inputs, **kws)
+
+    def argmax(self, *args, **kws):
+        if self._gapped():
+            return self.calibrate().view(numpy.ndarray).argmax(*args, **kws)
+        C = self.counts
+        return (C.argmin if self._info['slope'] < 0 else C.argmax)(*args, **kws)
+
+    def argmin(self, *args, **kws):
+        if self._gapped():
+            return self.calibrate().view(numpy.ndarray).argmin(*args, **kws)
+        C = self.counts
+        return (C.argmax if self._info['slope'] < 0 else C.argmin)(*args, **kws)
+
+    def decimate(self, n, **kws) -> DataChannel:
+        return self.calibrate().decimate(n, **kws)
+
+# Meta-data 'abscissa_runs', when present, is a piecewise linear abscissa.
+# Array of runs with fields 'sample', 'time', and 'inc', where the abscissa of
+# sample n in [sample[j], sample[j+1]) is time[j] + (n - sample[j])*inc[j].
+# The first run starts at sample 0 with abscissa_min and abscissa_inc.
+_runs_dtype = numpy.dtype([('sample', 'i8'), ('time', 'f8'), ('inc', 'f8')])
+
+def _abscissa(info: dict, n: int) -> numpy.ndarray:
+    """Abscissa of the first n samples
+    """
+    runs = info.get('abscissa_runs')
+    if runs is None:
+        return numpy.arange(n, dtype='f8')*info['abscissa_inc'] + info['abscissa_min']
+    R = numpy.empty(n, dtype='f8')
+    edges = list(runs['sample'][1:]) + [n]
+    for (s, t0, inc), s1 in zip(runs.tolist(), edges):
+        s1 = min(s1, n)
+        if s < s1:
+            R[s:s1] = numpy.arange(s1-s, dtype='f8')*inc + t0
+    return R
+
+def _grid_ceil(t: float, t0: float, inc: float) -> int:
+    """ceil((t - t0)/inc), where t within rounding error of a sample time maps to that sample
+    """
+    x = (t - t0)/inc
+    n = round(x)
+    # error of t0 + n*inc, in samples
+    tol = 1e-6 + 4*math.ulp(max(abs(t), abs(t0)))/abs(inc)
+    return n if abs(x - n) <= tol else math.ceil(x)
+
+def _time_index(info: dict, t: float) -> int:
+    """Index of first sample with abscissa >= t.  Where abscissa_runs overlap,
+    eg. after the clock jumps backwards, the earliest matching run is used.
+    """
+    runs = info.get('abscissa_runs')
+    if runs is None:
+        return _grid_ceil(t, info['abscissa_min'], info['abscissa_inc'])
+    runs = runs.tolist()
+    for j, (s, t0, inc) in enumerate(runs):
+        i = s + _grid_ceil(t, t0, inc)
+        if j+1==len(runs) or i < runs[j+1][0]:
+            return max(i, s) if j else i
+
+def _sample_range(info: dict, start=None, end=None) -> (int, int):
+    """Map abscissa range [start, end) to sample index range [i0, i1).
+    i1 is None when end is.
+    """
+    i0 = 0 if start is None else max(0, _time_index(info, start))
+    i1 = None if end is None else max(i0, _time_index(info, end))
+    return i0, i1
+
+def _range_info(info: dict, i0: int, i1=None) -> dict:
+    """Meta-data for samples [i0, i1)
+    """
+    mask = info.get('gap_mask')
+    if mask is not None and (i0 or i1 is not None):
+        info = info.copy()
+        mask = mask[..., i0:i1]
+        if mask.any():
+            info['gap_mask'] = mask
+        else:
+            del info['gap_mask']
+    if i0:
+        info = info.copy()
+        runs = info.get('abscissa_runs')
+        if runs is None:
+            info['abscissa_min'] = info['abscissa_min'] + i0*info['abscissa_inc']
+        else:
+            j = int(numpy.searchsorted(runs['sample'], i0, side='right'))-1
+            runs = runs[j:].copy()
+            runs['time'][0] += (i0 - runs['sample'][0])*runs['inc'][0]
+            runs['sample'] -= i0
+            runs['sample'][0] = 0
+            info['abscissa_min'], info['abscissa_inc'] = float(runs['time'][0]), float(runs['inc'][0])
+            if len(runs)>1:
+                info['abscissa_runs'] = runs
+            else:
+                del info['abscissa_runs']
+    return info
+
+def _decimate_info(info: dict, n: int, phase=0) -> dict:
+    """Meta-data for every n'th sample, starting from index phase.
+    An output sample is marked in 'gap_mask' if any of its n input samples are.
+    """
+    info = _range_info(info, phase).copy()
+    mask = info.get('gap_mask')
+    if mask is not None:
+        m = -(-mask.shape[-1]//n)
+        P = numpy.zeros(mask.shape[:-1] + (m*n,), dtype='?')
+        P[..., :mask.shape[-1]] = mask
+        info['gap_mask'] = P.reshape(mask.shape[:-1] + (m, n)).any(axis=-1)
+    runs = info.get('abscissa_runs')
+    if runs is not None:
+        runs = runs.copy()
+        first = -(-runs['sample']//n) # first output sample of each run
+        runs['time'] += (first*n - runs['sample'])*runs['inc']
+        runs['sample'] = first
+        runs['inc'] *= n
+        # drop runs spanning no output sample
+        keep = numpy.ones(len(runs), dtype='?')
+        keep[:-1] = runs['sample'][1:] > runs['sample'][:-1]
+        runs = runs[keep]
+        if len(runs)>1:
+            info['abscissa_runs'] = runs
+        else:
+            del info['abscissa_runs']
+    info['abscissa_inc'] *= n
+    return info
+
+# fnmatch() special characters
+_magic = re.compile(r'[*?[]')
+
+@lru_cache(maxsize=256)
+def _compile_pattern(pattern: str):
+    return re.compile(translate(pattern)).match
+
 class DataSet:
     """Interface to access a set of channels
 
@@ -76,6 +283,8 @@ class DataSet:
     # impl. notes
     # self._index is a list of namedtuple with at least attribute .info dict
     _index: list = None
+    # (self._index, {ID: [idx, ...]}) cf. _id_lookup()
+    _ids: tuple = None
 
     def close(self):
         pass
@@ -101,14 +310,106 @@ class DataSet:
         return [self._index[idx].info for idx in self._lookup_set(key, first=False)]
 
     def __getitem__(self, key) -> DataChannel:
-        """Load single matching dataset
+        """Load single matching dataset.
+
+        May include an abscissa range, in which case only those samples are read.
+
+        >>> S = U['Mic*', 2.0:4.0] # 2.0 <= time < 4.0
+        """
+        if isinstance(key, tuple):
+            key, trange = key
+            if not isinstance(trange, slice) or trange.step is not None:
+                raise TypeError("abscissa range must be start:end")
+            start, end = trange.start, trange.stop
+        else:
+            start = end = None
+        idx = self._lookup_set(key)
+        return self._read_set(idx, *_sample_range(self._index[idx].info, start, end))
+
+    def sets(self, key, start=None, end=None, workers=None) -> [DataChannel]:
+        """Load all matching datasets, optionally only within abscissa range [start, end)
+
+        :param workers: Number of threads used to read independent groups of datasets
+                        (eg. separate files) concurrently.  Default reads serially.
+        """
+        idxs = self._lookup_set(key, first=False)
+        if isinstance(idxs, int): # sets(0)
+            idxs = [idxs]
+
+        # datasets with identical sample ranges are read together
+        byrange = {}
+        for idx in idxs:
+            rng = _sample_range(self._index[idx].info, start, end)
+            byrange.setdefault(rng, []).append(idx)
+
+        jobs = [(group, rng) for rng, ridxs in byrange.items() for group in self._group_sets(ridxs)]
+
+        def job(J):
+            group, rng = J
+            return self._read_sets(group, *rng)
+
+        if workers is None or workers<=1 or len(jobs)<=1:
+            results = map(job, jobs)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(job, jobs))
+
+        R = {}
+        for (group, _rng), Ds in zip(jobs, results):
+            R.update(zip(group, Ds))
+        return [R[idx] for idx in idxs]
+
+    def iter_blocks(self, key, block_samples:int, overlap=0, start=None, end=None):
+        """Yield successive DataChannel blocks of the single matching dataset,
+        each with at most 'block_samples' samples.  Successive blocks share 'overlap' samples.
+        Optionally only within abscissa range [start, end).
+
+        >>> for blk in U.iter_blocks('Mic*', 65536):
+        ...     peak = max(peak, abs(blk).max())
         """
-        return self._read_set(self._lookup_set(key))
+        if not 0 <= overlap < block_samples:
+            raise ValueError('Require 0 <= overlap < block_samples')
+
+        idx = self._lookup_set(key)
+        i0, i1 = _sample_range(self._index[idx].info, start, end)
+        npoints = self._npoints(idx)
+        i1 = npoints if i1 is None else min(i1, npoints)
 
-    def sets(self, key) -> [DataChannel]:
-        """Load all matching datasets
+        pos = i0
+        while pos < i1:
+            stop = min(pos+block_samples, i1)
+            yield self._read_set(idx, pos, stop)
+            if stop==i1:
+                break
+            pos = stop - overlap
+
+    def iter_sets(self, key, block_samples:int, start=None, end=None):
+        """Yield lists of successive DataChannel blocks of all matching datasets,
+        each with at most 'block_samples' samples.  Optionally only within abscissa range [start, end).
+        Datasets are read together as for sets().  Once a dataset is exhausted,
+        its blocks are empty.
+
+        >>> for blks in U.iter_sets('Mic*', 65536):
+        ...     peak = max(peak, max(abs(blk).max() for blk in blks))
         """
-        return [self._read_set(idx) for idx in self._lookup_set(key, first=False)]
+        idxs = self._lookup_set(key, first=False)
+        if isinstance(idxs, int):
+            idxs = [idxs]
+
+        byrange = {}
+        for idx in idxs:
+            i0, i1 = _sample_range(self._index[idx].info, start, end)
+            npoints = self._npoints(idx)
+            i1 = npoints if i1 is None else min(i1, npoints)
+            byrange.setdefault((min(i0, i1), i1), []).append(idx)
+        jobs = [(group, rng) for rng, ridxs in byrange.items() for group in self._group_sets(ridxs)]
+
+        for pos in range(0, max([i1-i0 for (i0, i1) in byrange] + [0]), block_samples):
+            R = {}
+            for group, (i0, i1) in jobs:
+                s0 = min(i0+pos, i1)
+                R.update(zip(group, self._read_sets(group, s0, min(s0+block_samples, i1))))
+            yield [R[idx] for idx in idxs]
 
     def _lookup_set(self, key, first=True) -> int:
         """Lookup index from matching ID* line
@@ -116,11 +417,13 @@ class DataSet:
         if isinstance(key, int):
             return key
         elif isinstance(key, str):
-            R = []
-            for idx,S in enumerate(self._index):
-                for K,V in S.info.items():
-                    if K.startswith('id') and fnmatch(V, key):
-                        R.append(idx)
+            ids = self._id_lookup()
+            key = os.path.normcase(key)
+            if _magic.search(key) is None:
+                R = list(ids.get(key, ()))
+            else:
+                match = _compile_pattern(key)
+                R = sorted({idx for V, idxs in ids.items() if match(V) for idx in idxs})
             if first:
                 if len(R)==0:
                     raise ValueError(f'No such dataset {key}')
@@ -132,34 +435,86 @@ class DataSet:
         else:
             raise TypeError("lookup by index or ID line")
 
-    def _read_set(self, idx:int):
+    def _id_lookup(self) -> dict:
+        """Map of each distinct ID* line value to the ordered list of dataset indices having it.
+        Built once for each self._index
+        """
+        L = self._ids
+        if L is None or L[0] is not self._index:
+            ids = {}
+            for idx, S in enumerate(self._index):
+                for K, V in S.info.items():
+                    if K.startswith('id'):
+                        idxs = ids.setdefault(os.path.normcase(V), [])
+                        if not idxs or idxs[-1]!=idx:
+                            idxs.append(idx)
+            self._ids = L = (self._index, ids)
+        return L[1]
+
+    def _read_set(self, idx:int, start=0, stop=None) -> DataChannel:
+        """Read samples [start, stop) of one dataset.  stop=None reads to the end.
+        """
+        raise NotImplementedError()
+
+    def _npoints(self, idx:int) -> int:
+        """Number of samples in one dataset
+        """
         raise NotImplementedError()
 
-def open(fname: str) -> DataSet:
-    """Read in a data set from UFF or Quartz set HDR file
+    def _read_sets(self, idxs:list, start=0, stop=None) -> [DataChannel]:
+        # backends may override to read several channels at once
+        return [self._read_set(idx, start, stop) for idx in idxs]
+
+    def _group_sets(self, idxs:list) -> [list]:
+        """Partition dataset indices into groups which are best read together
+        by one call to _read_sets().  Different groups may be read concurrently.
+        """
+        return [[idx] for idx in idxs]
+
+def open(fname: str, **kws) -> DataSet:
+    """Read in a data set from UFF, Quartz set HDR, .dat, or HDF5 file
+
+    Keyword arguments are passed through to the specific DataSet type.
+    eg. index_cache=True for UFF
     """
     F = io.open(str(fname), 'rb')
     try:
-        magic = F.read(2)
+        magic = F.read(8)
         F.seek(0)
-        if magic==b'PS':
+        if magic[:2]==b'PS':
             from .psc import QuartzRaw
-            return QuartzRaw(F)
+            return QuartzRaw(F, **kws)
+        elif magic==b'\x89HDF\r\n\x1a\n':
+            from .hdf5 import HDF5
+            return HDF5(F, **kws)
 
         magic = F.readline().rstrip()
         F.seek(0)
         if magic[:1]==b'{': # JSON HDR file
             from .quartz import Quartz
-            return Quartz(F)
+            return Quartz(F, **kws)
         elif magic==b'    -1':
             from .uff import UFF
-            return UFF(F)
+            return UFF(F, **kws)
         else:
             raise RuntimeError(f'{fname!r} has bad magic {magic!r}')
     except:
         F.close()
         raise
 
+def _open_counts(fname, gaps=False, **kws) -> DataSet:
+    """open() for streaming reductions.
+
+    Quartz .hdr and HDF5 files default to raw=True, so that counts are read.
+    gaps is passed only for .hdr and .dat files, which may have missing packets.
+    """
+    name = str(fname)
+    if name.endswith(('.hdr', '.h5')):
+        kws.setdefault('raw', True)
+    if name.endswith(('.hdr', '.dat')):
+        kws['gaps'] = gaps
+    return open(fname, **kws)
+
 def getargs():
     from argparse import ArgumentParser
     P = ArgumentParser()
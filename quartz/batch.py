@@ -0,0 +1,278 @@
+"""Run check, info, fix, or convert jobs over many files in a process pool
+
+Results are written as JSON lines as each file completes,
+followed by a summary line.
+
+    python -m quartz.batch check -j 8 /data/run1 /data/run2 > check.jsonl
+    python -m quartz.batch fix -o /data/fixed /data/run1
+    python -m quartz.batch convert --format h5 -C gzip -o /data/h5 /data/run1
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from . import open as qopen, psc
+
+__all__ = (
+    'run',
+)
+
+_log = logging.getLogger(__name__)
+
+# default file types of each job
+_suffixes = {
+    'check': ('.dat',),
+    'info': ('.dat', '.hdr', '.uff'),
+    'fix': ('.dat',),
+    'convert': ('.hdr', '.uff'),
+}
+
+def find_files(paths, suffixes) -> [(Path, Path)]:
+    """Expand directories, recursively, to files with matching suffix
+
+    :returns: List of (file, path relative to its directory argument).
+              For a file argument, the relative path is its name.
+    """
+    R = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            R += sorted((P, P.relative_to(path)) for P in path.rglob('*') if P.suffix in suffixes and P.is_file())
+        else:
+            R.append((path, Path(path.name)))
+    return R
+
+def _input_bytes(path: Path) -> int:
+    """Size of file, including .dat files of a .hdr
+    """
+    size = path.stat().st_size
+    if path.suffix=='.hdr':
+        with path.open('rb') as F:
+            hdr = json.load(F)
+        for chassis in hdr.get('Chassis', []):
+            for dat in chassis['Dat']:
+                try:
+                    size += (path.parent / dat).stat().st_size
+                except FileNotFoundError:
+                    pass
+    return size
+
+def _open_kws(path: Path, opts: dict) -> dict:
+    kws = {}
+    if path.suffix in ('.hdr', '.dat'):
+        kws['gaps'] = opts.get('gaps', False)
+    if path.suffix=='.hdr':
+        kws['cache_bytes'] = opts.get('cache_bytes', 1<<30)
+    return kws
+
+def _stream_summary(S: psc.PacketStream) -> dict:
+    present = sum(len(P) for P in S.parts)
+    return {'packets': present, 'missing': len(S) - present, 'gaps': len(S.missing())}
+
+def _check(path: Path, opts: dict) -> dict:
+    if path.suffix=='.dat':
+        with path.open('rb') as F:
+            segs = psc.read_segments(F, gaps=True)
+            trailing = os.fstat(F.fileno()).st_size - F.tell()
+        R = _stream_summary(psc.PacketStream(segs, [str(path)]*len(segs), gaps=True))
+        R.update(segments=len(segs), trailing=trailing)
+        return R
+
+    elif path.suffix=='.hdr':
+        with qopen(path, gaps=True, cache_bytes=0) as Q:
+            return {'chassis': {str(chassis['Chassis']): _stream_summary(Q._stream(chassis['Chassis']))
+                                for chassis in Q._json['Chassis']}}
+
+    else:
+        with qopen(path) as U:
+            return {'signals': len(U._index)}
+
+def _info(path: Path, opts: dict) -> dict:
+    if path.suffix=='.dat':
+        with path.open('rb') as F:
+            I = psc.dat_info(F)
+        I['gaps'] = len(I['gaps'])
+        I['disorder'] = len(I['disorder'])
+        return I
+
+    with qopen(path, **_open_kws(path, opts)) as D:
+        infos = list(D)
+        return {
+            'signals': len(infos),
+            'npoints': max([D._npoints(idx) for idx in range(len(infos))] + [0]),
+            'abscissa_inc': float(infos[0]['abscissa_inc']) if infos else None,
+        }
+
+def _output(path: Path, opts: dict, suffix: str) -> Path:
+    """Output file mirroring the relative path of the input under outdir
+    """
+    dst = Path(opts['outdir']) / Path(opts.get('rel', path.name)).with_suffix(suffix)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    return dst
+
+def _fix(path: Path, opts: dict) -> dict:
+    if path.suffix!='.dat':
+        raise ValueError('fix applies only to .dat files')
+    with path.open('rb') as F:
+        I = psc.dat_info(F)
+    if I['disorder']:
+        raise RuntimeError(f'{len(I["disorder"])} jumps back in sequence, not fixable')
+    if not I['gaps'] and not opts.get('force'):
+        return {'fixed': False}
+
+    dst = _output(path, opts, '.dat')
+    if dst.resolve()==path.resolve():
+        raise ValueError('Output would overwrite input')
+    with path.open('rb') as F, dst.open('wb') as O:
+        P = psc.fix_dat(F, O, chunk=opts.get('chunk', 16384))
+    return {'fixed': True, 'output': str(dst), 'packets': P.packets, 'missing': P.missing, 'gaps': P.gaps}
+
+def _convert(path: Path, opts: dict) -> dict:
+    fmt = opts.get('format', 'h5')
+    dst = _output(path, opts, '.'+fmt)
+    if dst.resolve()==path.resolve():
+        raise ValueError('Output would overwrite input')
+    kws = _open_kws(path, opts)
+
+    if fmt=='h5':
+        from .hdf5 import export
+        n = export(path, dst, compression=opts.get('compression'), block=opts.get('block', 1<<22), **kws)
+
+    elif fmt=='uff':
+        from .uff import export
+        n = export(path, dst, block=opts.get('block', 1<<22), **kws)
+
+    else:
+        raise ValueError(f'Unsupported format {fmt!r}')
+    return {'output': str(dst), 'signals': n}
+
+_jobs = {
+    'check': _check,
+    'info': _info,
+    'fix': _fix,
+    'convert': _convert,
+}
+
+def _run1(job: str, path: Path, opts: dict, error=None) -> dict:
+    """Run one job, capturing any error in the result
+    """
+    R = {'file': str(path), 'job': job}
+    T0 = time.monotonic()
+    try:
+        if error is not None:
+            raise error
+        R['bytes'] = _input_bytes(path)
+        R['result'] = _jobs[job](path, opts)
+        R['ok'] = True
+    except Exception as e:
+        _log.debug('%s %s failed', job, path, exc_info=True)
+        R['ok'] = False
+        R['error'] = f'{e.__class__.__name__}: {e}'
+    R['seconds'] = dt = time.monotonic() - T0
+    if R.get('bytes') and dt>0:
+        R['MBps'] = R['bytes']/dt/1e6
+    return R
+
+def run(job: str, files: list, processes=None, **opts):
+    """Run job on files, optionally in a pool of processes.
+
+    Outputs of fix and convert are written under outdir with the relative path of each input.
+    Inputs which would write the same output all fail.
+
+    :param job: 'check', 'info', 'fix', or 'convert'
+    :param files: File names, or (file name, relative path) as from find_files()
+    :param processes: Number of worker processes.  Default serial.
+    :param opts: Job options.  eg. outdir, gaps, format, compression
+    :returns: Iterator of result dict for each file, in order of completion
+    """
+    if job not in _jobs:
+        raise ValueError(f'Unknown job {job!r}')
+    files = [(Path(F[0]), Path(F[1])) if isinstance(F, tuple) else (Path(F), Path(Path(F).name))
+             for F in files]
+
+    jobs = []
+    dups = Counter(rel.with_suffix('') for _F, rel in files)
+    for F, rel in files:
+        err = None
+        if job in ('fix', 'convert') and dups[rel.with_suffix('')]>1:
+            err = ValueError(f'Another input has output path {rel.with_suffix("")}')
+        jobs.append((job, F, dict(opts, rel=str(rel)), err))
+
+    if processes is None or processes<=1 or len(jobs)<=1:
+        for J in jobs:
+            yield _run1(*J)
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futs = [pool.submit(_run1, *J) for J in jobs]
+        for fut in as_completed(futs):
+            yield fut.result()
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description='Run jobs over many files.  Emits JSON lines.')
+    P.add_argument('job', choices=list(_jobs))
+    P.add_argument('paths', type=Path, nargs='+',
+                   help='Files, or directories to search')
+    P.add_argument('-j', '--processes', type=int, default=os.cpu_count(),
+                   help='Worker processes')
+    P.add_argument('-s', '--suffix', action='append',
+                   help='File types to find in directories.  eg. -s .dat -s .hdr')
+    P.add_argument('-o', '--outdir', type=Path,
+                   help='Output directory for fix and convert.  Mirrors paths below each directory argument')
+    P.add_argument('--format', choices=['h5', 'uff'], default='h5',
+                   help='convert output format')
+    P.add_argument('-C', '--compression', choices=['gzip', 'lzf'],
+                   help='HDF5 compression filter')
+    P.add_argument('--gaps', action='store_true',
+                   help='Tolerate missing .dat packets when reading')
+    P.add_argument('--force', action='store_true',
+                   help='fix even without missing packets')
+    P.add_argument('--cache-bytes', type=int, default=1<<30,
+                   help='Packet cache size per worker for .hdr files')
+    P.add_argument('--output', type=Path,
+                   help='Write JSON lines to file instead of stdout')
+    return P
+
+def main(argv=None) -> int:
+    P = getargs()
+    args = P.parse_args(argv)
+    if args.job in ('fix', 'convert') and args.outdir is None:
+        P.error(f'{args.job} requires --outdir')
+
+    files = find_files(args.paths, tuple(args.suffix or _suffixes[args.job]))
+    opts = {
+        'outdir': str(args.outdir) if args.outdir else None,
+        'format': args.format,
+        'compression': args.compression,
+        'gaps': args.gaps,
+        'force': args.force,
+        'cache_bytes': args.cache_bytes,
+    }
+
+    out = args.output.open('w') if args.output else sys.stdout
+    T0 = time.monotonic()
+    nbytes = nfail = 0
+    try:
+        for R in run(args.job, files, processes=args.processes, **opts):
+            nbytes += R.get('bytes', 0)
+            nfail += not R['ok']
+            print(json.dumps(R), file=out, flush=True)
+
+        dt = time.monotonic() - T0
+        print(json.dumps({'summary': True, 'job': args.job, 'files': len(files), 'failed': nfail,
+                          'bytes': nbytes, 'seconds': dt, 'MBps': nbytes/dt/1e6 if dt>0 else None}),
+              file=out, flush=True)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if nfail else 0
+
+if __name__=='__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""Signal processing over streams of DataChannel blocks
+
+eg. as yielded by DataSet.iter_blocks(), or (nchan, N) blocks
+as from DataSet.iter_sets() or Quartz.matrix()
+"""
+
+import numpy
+import scipy.signal as sig
+
+from . import DataChannel, RawChannel, _range_info, _decimate_info
+
+__all__ = (
+    'Decimator',
+    'Welch',
+    'Spectrogram',
+    'welch',
+    'spectrogram',
+)
+
+class Decimator:
+    """Stateful, block-wise equivalent of DataChannel.decimate(q, zero_phase=False)
+
+    Filter state is carried between blocks, so the concatenated output matches
+    decimating the whole record at once.
+    Blocks must be successive and non-overlapping.
+
+    >>> D = Decimator(10)
+    >>> overview = numpy.concatenate(list(D.process(U.iter_blocks('Mic*', 1<<20))))
+
+    :param q: Downsampling factor
+    :param n: Filter order.  Defaults as for scipy.signal.decimate
+    :param ftype: 'iir' or 'fir'
+    """
+    def __init__(self, q: int, n=None, ftype='iir'):
+        self.q = q
+        if ftype=='iir':
+            self._sos = sig.cheby1(8 if n is None else n, 0.05, 0.8/q, output='sos')
+            self._zi = numpy.zeros((self._sos.shape[0], 2))
+        elif ftype=='fir':
+            self._b = sig.firwin((20*q if n is None else n)+1, 1./q, window='hamming')
+            self._zi = numpy.zeros(len(self._b)-1)
+        else:
+            raise ValueError(f'Unsupported ftype {ftype!r}')
+        self._ftype = ftype
+        self._phase = 0 # index in next block of next output sample
+        self._next = None # expected abscissa_min of next block
+
+    def __call__(self, blk: DataChannel) -> DataChannel:
+        """Filter and decimate the next block
+        """
+        if isinstance(blk, RawChannel):
+            blk = blk.calibrate()
+        info = blk._info
+        if self._next is not None and abs(info['abscissa_min'] - self._next) > info['abscissa_inc']/2:
+            raise ValueError(f'Block at {info["abscissa_min"]} does not follow {self._next}')
+        self._next = _range_info(info, len(blk))['abscissa_min']
+
+        if self._ftype=='iir':
+            Y, self._zi = sig.sosfilt(self._sos, blk, zi=self._zi)
+        else:
+            Y, self._zi = sig.lfilter(self._b, 1., blk, zi=self._zi)
+
+        # output element type as for scipy.signal.decimate, though state is kept as float64
+        dtype = blk.dtype if blk.dtype in (numpy.float32, numpy.float64) else numpy.float64
+
+        R = Y[self._phase::self.q].astype(dtype).view(DataChannel)
+        R._info = _decimate_info(info, self.q, self._phase)
+
+        self._phase = (self._phase - len(blk)) % self.q
+        return R
+
+    def process(self, blocks):
+        """Yield decimated blocks
+        """
+        for blk in blocks:
+            yield self(blk)
+
+class _Segmenter:
+    """Split successive blocks into (possibly overlapping) windowed segments,
+    carrying samples not yet in a complete segment over to the next block.
+    """
+    def __init__(self, nperseg:int, noverlap=None, window='hann', detrend='constant', scaling='density'):
+        if noverlap is None:
+            noverlap = nperseg//2
+        if not 0 <= noverlap < nperseg:
+            raise ValueError('Require 0 <= noverlap < nperseg')
+        if detrend not in ('constant', 'linear', False):
+            raise ValueError(f'Unsupported detrend {detrend!r}')
+        if scaling not in ('density', 'spectrum'):
+            raise ValueError(f'Unsupported scaling {scaling!r}')
+        self.nperseg, self.noverlap = nperseg, noverlap
+        self._win = sig.get_window(window, nperseg)
+        self._detrend = detrend
+        self._scaling = scaling
+        self._tail = None # samples carried over
+        self._pos = 0 # index of first sample in _tail, from start of first block
+        self._info = None # of first block
+        self._next = None # expected abscissa_min of next block
+
+    def _segments(self, blk: DataChannel) -> (numpy.ndarray, int):
+        """Append block, and return spectra of all complete segments as (nchan, nseg, nfreq)
+        and the index of the first sample of the first segment.
+        """
+        if isinstance(blk, RawChannel):
+            blk = blk.calibrate()
+        info = blk._info
+        if self._info is None:
+            self._info = info
+            self._squeeze = blk.ndim==1
+        elif abs(info['abscissa_min'] - self._next) > info['abscissa_inc']/2:
+            raise ValueError(f'Block at {info["abscissa_min"]} does not follow {self._next}')
+        self._next = _range_info(info, blk.shape[-1])['abscissa_min']
+
+        X = numpy.atleast_2d(blk.view(numpy.ndarray))
+        if self._tail is not None:
+            X = numpy.concatenate((self._tail, X), axis=1)
+        pos = self._pos
+
+        step = self.nperseg - self.noverlap
+        nseg = max(0, (X.shape[1] - self.nperseg)//step + 1)
+        if nseg:
+            S = numpy.lib.stride_tricks.sliding_window_view(X, self.nperseg, axis=1)[:, :nseg*step:step, :]
+        else:
+            S = numpy.zeros((X.shape[0], 0, self.nperseg))
+
+        self._tail = X[:, nseg*step:].copy()
+        self._pos += nseg*step
+
+        if self._detrend is not False:
+            S = sig.detrend(S, axis=-1, type=self._detrend)
+        F = numpy.fft.rfft(S*self._win, axis=-1)
+        return F, pos
+
+    @property
+    def inc(self) -> float:
+        return self._info['abscissa_inc']
+
+    @property
+    def freqs(self) -> numpy.ndarray:
+        """Frequency of each spectral line"""
+        return numpy.fft.rfftfreq(self.nperseg, d=self.inc)
+
+    def _scale(self) -> numpy.ndarray:
+        """Scale for each spectral line of one-sided spectrum, cf. scipy.signal.welch()
+        """
+        if self._scaling=='density':
+            scale = self.inc/(self._win*self._win).sum()
+        else:
+            scale = 1.0/self._win.sum()**2
+        S = numpy.full(self.nperseg//2 + 1, scale)
+        S[1:None if self.nperseg%2 else -1] *= 2
+        return S
+
+class Welch(_Segmenter):
+    """Averaged power, and optionally cross, spectral densities accumulated over successive blocks.
+
+    Equivalent to scipy.signal.welch() and csd() over the concatenated blocks, with average='mean'.
+    Blocks may be 1-d, or (nchan, N) for several channels whose FFTs are computed together.
+    Blocks must be successive and non-overlapping.
+
+    >>> W = Welch(8192, cross=True)
+    >>> for blks in Q.iter_sets('CH1-*', 1<<20):
+    ...     W(numpy.stack(blks).view(DataChannel)) # cf. welch()
+    >>> f, Pxy = W.csd()
+
+    :param nperseg: Segment length
+    :param noverlap: Overlap between segments.  Default nperseg//2
+    :param window: Passed to scipy.signal.get_window()
+    :param detrend: 'constant', 'linear', or False
+    :param scaling: 'density' (V**2/Hz) or 'spectrum' (V**2)
+    :param cross: Also accumulate the (nchan, nchan) cross-spectral matrix.
+    """
+    def __init__(self, nperseg:int, noverlap=None, window='hann', detrend='constant', scaling='density',
+                 cross=False):
+        super().__init__(nperseg, noverlap, window, detrend, scaling)
+        self.nseg = 0
+        self._cross = cross
+        self._pxx = self._pxy = None
+
+    def __call__(self, blk: DataChannel):
+        """Accumulate the next block
+        """
+        F, _pos = self._segments(blk)
+        if self._pxx is None:
+            self._pxx = numpy.zeros(F.shape[::2])
+            if self._cross:
+                self._pxy = numpy.zeros((F.shape[2], F.shape[0], F.shape[0]), dtype='c16')
+        if F.shape[1]==0:
+            return
+
+        self._pxx += (F.real**2 + F.imag**2).sum(axis=1)
+        if self._cross:
+            # batch of (nchan, nseg) @ (nseg, nchan) for each spectral line
+            T = F.transpose(2, 0, 1)
+            self._pxy += T.conj() @ T.transpose(0, 2, 1)
+        self.nseg += F.shape[1]
+
+    def _check(self):
+        if not self.nseg:
+            raise RuntimeError('No complete segments')
+
+    def psd(self) -> (numpy.ndarray, numpy.ndarray):
+        """Returns (frequencies, Pxx) with Pxx shaped (nchan, nfreq), or (nfreq,) for 1-d blocks
+        """
+        self._check()
+        P = self._pxx * (self._scale()/self.nseg)
+        return self.freqs, P[0] if self._squeeze else P
+
+    def csd(self) -> (numpy.ndarray, numpy.ndarray):
+        """Returns (frequencies, Pxy) with Pxy[i, j] the cross spectral density of channels i and j,
+        as scipy.signal.csd(x[i], x[j]).  Pxy is shaped (nchan, nchan, nfreq)
+        """
+        self._check()
+        if not self._cross:
+            raise RuntimeError('Not accumulating cross spectra.  cf. cross=True')
+        P = self._pxy.transpose(1, 2, 0) * (self._scale()/self.nseg)
+        return self.freqs, P
+
+    def coherence(self) -> (numpy.ndarray, numpy.ndarray):
+        """Returns (frequencies, Cxy) with Cxy[i, j] the magnitude squared coherence of channels i and j
+        """
+        f, Pxy = self.csd()
+        _f, Pxx = self.psd()
+        Pxx = numpy.atleast_2d(Pxx)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return f, (Pxy.real**2 + Pxy.imag**2)/(Pxx[:,None,:]*Pxx[None,:,:])
+
+class Spectrogram(_Segmenter):
+    """Spectrogram of successive blocks, averaging 'navg' segments into each column.
+
+    With navg=1, equivalent to scipy.signal.spectrogram() over the concatenated blocks.
+    Columns are returned as they are completed.
+
+    >>> S = Spectrogram(4096, navg=16)
+    >>> cols = [S(blk) for blk in U.iter_blocks('Mic*', 1<<20)]
+    >>> t = numpy.concatenate([t for t, _P in cols])
+    >>> P = numpy.concatenate([P for _t, P in cols], axis=-2)
+
+    :param navg: Number of segments averaged into each column.
+    :param noverlap: Overlap between segments.  Default nperseg//8, as for scipy.signal.spectrogram()
+    """
+    def __init__(self, nperseg:int, noverlap=None, window=('tukey', .25), detrend='constant', scaling='density',
+                 navg=1):
+        super().__init__(nperseg, nperseg//8 if noverlap is None else noverlap, window, detrend, scaling)
+        self.navg = navg
+        self._part = None # power of segments not yet in a complete column
+        self._ppos = 0 # first sample index of first segment in _part
+
+    def __call__(self, blk: DataChannel) -> (numpy.ndarray, numpy.ndarray):
+        """Add the next block.
+
+        :returns: (times, P) of any completed columns.  times of the center of each column.
+                  P shaped (nchan, ncol, nfreq), or (ncol, nfreq) for 1-d blocks.
+        """
+        F, pos = self._segments(blk)
+        P = (F.real**2 + F.imag**2) * self._scale()
+        if self._part is not None:
+            P = numpy.concatenate((self._part, P), axis=1)
+            pos = self._ppos
+
+        step = self.nperseg - self.noverlap
+        ncol = P.shape[1]//self.navg
+        self._part = P[:, ncol*self.navg:]
+        self._ppos = pos + ncol*self.navg*step
+
+        C = P[:, :ncol*self.navg].reshape((P.shape[0], ncol, self.navg, P.shape[2])).mean(axis=2)
+        # center of column
+        center = pos + numpy.arange(ncol)*(self.navg*step) + ((self.navg-1)*step + self.nperseg)/2
+        t = self._info['abscissa_min'] + center*self.inc
+        return t, C[0] if self._squeeze else C
+
+def _stacked(src, key, block_samples, start, end):
+    """Yield (nchan, N) blocks of all matching datasets
+    """
+    for blks in src.iter_sets(key, block_samples, start, end):
+        n = min(len(B) for B in blks)
+        if n==0:
+            break
+        M = numpy.stack([B[:n] if not isinstance(B, RawChannel) else B.calibrate()[:n] for B in blks])
+        M = M.view(DataChannel)
+        M._info = blks[0]._info
+        yield M
+
+def welch(src, key, nperseg:int, block_samples=1<<20, start=None, end=None, **kws) -> Welch:
+    """Accumulate Welch for all matching datasets of a DataSet, read block by block.
+    Matching datasets must have the same abscissa.
+
+    >>> W = welch(U, 'Mic*', 8192)
+    >>> f, Pxx = W.psd()
+
+    :param kws: Passed to Welch.  eg. cross=True
+    """
+    W = Welch(nperseg, **kws)
+    for M in _stacked(src, key, block_samples, start, end):
+        W(M)
+    return W
+
+def spectrogram(src, key, nperseg:int, block_samples=1<<20, start=None, end=None, **kws) -> (numpy.ndarray, numpy.ndarray):
+    """Spectrogram of all matching datasets of a DataSet, read block by block.
+
+    :param kws: Passed to Spectrogram.  eg. navg=16
+    :returns: (times, P) with P shaped (nchan, ncol, nfreq)
+    """
+    S = Spectrogram(nperseg, **kws)
+    cols = [S(M) for M in _stacked(src, key, block_samples, start, end)]
+    if not cols:
+        raise RuntimeError('No samples')
+    return numpy.concatenate([t for t, _P in cols]), numpy.concatenate([P for _t, P in cols], axis=1)
@@ -0,0 +1,197 @@
+"""Store acquisitions as chunked HDF5, one dataset per signal
+
+Decoding of .dat files is done once by export(), after which
+HDF5 reads only those chunks spanning the requested samples.
+Placeholders for missing .dat packets are stored as the 'gap_fill' count,
+and read back as NaN, or with 'gap_mask' if raw.
+
+>>> from quartz.hdf5 import export
+>>> export('some.hdr', 'some.h5', compression='gzip')
+>>> with quartz.open('some.h5') as F:
+...     S = F['Mic*', 2.0:4.0]
+
+Requires h5py
+"""
+
+import enum
+import logging
+import threading
+from collections import namedtuple
+
+import numpy
+import h5py
+
+from . import DataSet, DataChannel, RawChannel, _range_info, _open_counts
+from .psc import _gap_info
+
+__all__ = (
+    'HDF5',
+    'export',
+)
+
+_log = logging.getLogger(__name__)
+
+# bump when layout changes
+_format_version = 1
+
+# info which describes the source file, or is not stored as an attribute
+_skip_info = {'dtype', 'endian', 'fp', 'nlines', 'nbytes', 'npoints', 'gap_mask', 'channels'}
+
+SetInfo = namedtuple("SetInfo", ['name', 'info'])
+
+def _save_attr(V):
+    if isinstance(V, enum.IntEnum):
+        return int(V)
+    elif isinstance(V, (int, float, str, numpy.number, numpy.ndarray)):
+        return V
+    return None # not stored
+
+def _load_attr(V):
+    if isinstance(V, numpy.generic):
+        return V.item()
+    elif isinstance(V, bytes):
+        return V.decode(errors='ignore')
+    return V
+
+class HDF5(DataSet):
+    """Access to HDF5 file written by export()
+
+    :param file: File name or file object
+    :param raw: Return int32 counts without applying 'slope' and 'intercept'.
+    :param lazy: With raw=True, return RawChannel to apply calibration on demand.
+    """
+    def __init__(self, file, raw=False, lazy=False):
+        self._raw = raw
+        if lazy and not raw:
+            raise ValueError('lazy=True requires raw=True')
+        self._type = RawChannel if lazy else DataChannel
+        self._fp = file if hasattr(file, 'read') else None
+        self._lock = threading.Lock() # h5py objects are not re-entrant
+        try:
+            self._H = H = h5py.File(file, 'r')
+            if H.attrs.get('quartz_format')!=_format_version:
+                raise RuntimeError(f'{H.filename} unsupported format {H.attrs.get("quartz_format")!r}')
+
+            self._index = []
+            for name in H.attrs['signals']:
+                name = _load_attr(name)
+                info = {K:_load_attr(V) for K, V in H[name].attrs.items()}
+                self._index.append(SetInfo(name, info))
+        except:
+            self.close()
+            raise
+
+    def close(self):
+        self._index = []
+        H = getattr(self, '_H', None)
+        if H is not None:
+            H.close()
+        if self._fp is not None:
+            self._fp.close()
+
+    def _npoints(self, idx:int) -> int:
+        return self._H[self._index[idx].name].shape[0]
+
+    def _read_set(self, idx:int, start=0, stop=None) -> DataChannel:
+        S = self._index[idx]
+        with self._lock:
+            A = self._H[S.name][start:stop]
+
+        mask = None
+        if 'gap_fill' in S.info:
+            mask = A==S.info['gap_fill']
+
+        if 'slope' not in S.info or A.dtype.kind=='f': # already calibrated
+            R = A.view(DataChannel)
+        elif self._raw:
+            R = A.view(self._type)
+        else: # cf. Quartz._wrap()
+            R = A.astype('f4')
+            R *= S.info['slope']
+            R += S.info['intercept']
+            if mask is not None:
+                R[mask] = numpy.nan
+            R = R.view(DataChannel)
+        R._info = _range_info(S.info, start)
+        if mask is not None:
+            R._info = _gap_info(R._info, mask)
+        return R
+
+def _dset_names(infos:list) -> [str]:
+    """Unique dataset names from ID line 1
+    """
+    names, seen = [], set()
+    for idx, info in enumerate(infos):
+        base = str(info.get('id1', '')).strip().replace('/', '_') or str(idx)
+        name, n = base, 1
+        while name in seen:
+            n += 1
+            name = f'{base}#{n}'
+        seen.add(name)
+        names.append(name)
+    return names
+
+def export(src, dst, key='*', chunks=1<<18, block=1<<22, compression=None, progress=None, **kws) -> int:
+    """Write matching datasets to HDF5 file
+
+    Quartz .hdr and HDF5 files are opened with raw=True by default, so that int32 counts are stored,
+    with 'slope' and 'intercept' as attributes.
+    Datasets with placeholder counts for missing packets have attribute 'gap_fill'.
+
+    :param src: DataSet, or file name passed to quartz.open() with kws.
+                gaps=True applies only to .hdr and .dat files.
+    :param dst: HDF5 file name
+    :param key: Dataset selection.  Default all.
+    :param chunks: HDF5 chunk size in samples.
+    :param block: Number of samples read at a time.  Rounded up to a multiple of chunks.
+    :param compression: eg. 'gzip' or 'lzf'.  Default uncompressed.
+    :param progress: Called with (samples written, total samples) after each block.
+    :returns: Number of datasets written
+    """
+    if not isinstance(src, DataSet):
+        with _open_counts(src, **kws) as S:
+            return export(S, dst, key=key, chunks=chunks, block=block,
+                          compression=compression, progress=progress)
+
+    idxs = src._lookup_set(key, first=False)
+    if isinstance(idxs, int):
+        idxs = [idxs]
+    block = -(-block//chunks)*chunks
+
+    infos = [src._index[idx].info for idx in idxs]
+    names = _dset_names(infos)
+    npoints = [src._npoints(idx) for idx in idxs]
+    total, done = sum(npoints), 0
+
+    with h5py.File(dst, 'w') as H:
+        H.attrs['quartz_format'] = _format_version
+        H.attrs['signals'] = names
+
+        dsets = {}
+        for idx, name, info, N in zip(idxs, names, infos, npoints):
+            T = src._read_set(idx, 0, 0).dtype
+            D = dsets[idx] = H.create_dataset(name, shape=(N,), dtype=T.newbyteorder('='),
+                                              chunks=(max(1, min(chunks, N)),),
+                                              compression=compression,
+                                              shuffle=compression is not None)
+            for K, V in info.items():
+                if K not in _skip_info:
+                    V = _save_attr(V)
+                    if V is not None:
+                        D.attrs[K] = V
+
+        # decode each group (eg. chassis) once per block
+        for group in src._group_sets(idxs):
+            N = max(src._npoints(idx) for idx in group)
+            for start in range(0, N, block):
+                for idx, C in zip(group, src._read_sets(group, start, start+block)):
+                    if len(C):
+                        D = dsets[idx]
+                        if C.dtype.kind=='i' and 'gap_mask' in C._info and 'gap_fill' not in D.attrs:
+                            D.attrs['gap_fill'] = numpy.iinfo(C.dtype).min
+                        D[start:start+len(C)] = C.view(numpy.ndarray)
+                        done += len(C)
+                if progress is not None:
+                    progress(done, total)
+
+    return len(idxs)
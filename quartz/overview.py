@@ -0,0 +1,296 @@
+"""Multi-resolution min/max/mean overview for fast plotting
+
+Built in one streaming pass over all channels, and stored in a sidecar file '<file>.ovw.npz'.
+Envelopes at any zoom level are then found without reading samples.
+
+>>> from quartz.overview import overview
+>>> O = overview('some.hdr')  # build, or load if up to date
+>>> t, lo, hi, mean = O.envelope('Mic*', 2.0, 4.0, width=1000)
+>>> plt.fill_between(t, lo, hi)
+"""
+
+import json
+import logging
+import math
+import os
+import warnings
+from collections import namedtuple
+from pathlib import Path
+
+import numpy
+
+from . import DataSet, _sample_range, _open_counts
+
+__all__ = (
+    'Overview',
+    'build',
+    'overview',
+)
+
+_log = logging.getLogger(__name__)
+
+# bump when content changes
+_ovw_version = 2
+
+_fields = ('min', 'max', 'mean', 'count')
+
+def _sidecar(fname) -> str:
+    return f'{fname}.ovw.npz'
+
+def _stamp(fname) -> list:
+    """Size and modification time of file, and of the .dat and .j files of a .hdr
+    """
+    files = [Path(fname)]
+    if files[0].suffix=='.hdr':
+        with open(fname, 'rb') as F:
+            hdr = json.load(F)
+        files += [files[0].parent / dat for chassis in hdr.get('Chassis', []) for dat in chassis['Dat']]
+        files += [files[0].parent / sig['OutDataFile'] for sig in hdr.get('Signals', []) if 'OutDataFile' in sig]
+    R = [_ovw_version]
+    for F in files:
+        try:
+            st = os.stat(F)
+            R.append([st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            R.append(None)
+    return R
+
+SetInfo = namedtuple("SetInfo", ['info'])
+
+class Overview:
+    """Pyramid of per-channel min/max/mean over bins of bin0*factor**level samples
+
+    Channels are selected by ID line, as for DataSet.
+
+    :param meta: dict of 'names', 'ids', 'abscissa_min', 'abscissa_inc', 'npoints', 'bin0', 'factor'
+    :param levels: List of (min, max, mean, count) arrays shaped (nchan, nbins), finest first.
+                   count is the number of samples in each bin, excluding placeholders.
+    """
+    _ids = None
+
+    def __init__(self, meta:dict, levels:list):
+        self.meta = meta
+        self.levels = levels
+        self._index = [SetInfo(ids) for ids in meta['ids']]
+
+    _lookup_set = DataSet._lookup_set
+    _id_lookup = DataSet._id_lookup
+
+    @property
+    def names(self) -> [str]:
+        return self.meta['names']
+
+    def save(self, fname):
+        """Write to file, replacing atomically
+        """
+        tmpname = f'{fname}.{os.getpid()}.tmp.npz'
+        arrays = {f'L{n}_{k}':A for n, L in enumerate(self.levels) for k, A in zip(_fields, L)}
+        numpy.savez(tmpname, meta=json.dumps(self.meta), **arrays)
+        os.replace(tmpname, fname)
+
+    @classmethod
+    def load(cls, fname) -> 'Overview':
+        with numpy.load(fname) as Z:
+            meta = json.loads(str(Z['meta']))
+            levels = [tuple(Z[f'L{n}_{k}'] for k in _fields)
+                      for n in range(meta['nlevels'])]
+        return cls(meta, levels)
+
+    def envelope(self, key, start=None, end=None, width=1000, src:DataSet=None):
+        """Envelope of the single matching channel over abscissa range [start, end),
+        with at most 'width' points.
+
+        Uses the coarsest level with at least 'width' bins in the range.
+        When even the finest level is coarser, samples are read from src if provided.
+
+        :param key: Channel ID line pattern, or index in this overview
+        :param src: Optional DataSet from which the overview was built.
+        :returns: (abscissa of start of each point, min, max, mean)
+        """
+        ch = self._lookup_set(key)
+        info = {'abscissa_min': self.meta['abscissa_min'][ch], 'abscissa_inc': self.meta['abscissa_inc'][ch]}
+        npoints = self.meta['npoints'][ch]
+        i0, i1 = _sample_range(info, start, end)
+        i1 = npoints if i1 is None else min(i1, npoints)
+        i0 = min(i0, i1)
+        per_point = max(1, (i1-i0)//max(1, width))
+
+        bin0, factor = self.meta['bin0'], self.meta['factor']
+        if per_point < bin0 and src is not None:
+            # finer than any level, reduce samples
+            idx = src._lookup_set(self.names[ch])
+            D = src._read_set(idx, i0, i1)
+            C = D.view(numpy.ndarray).astype('f8')
+            if D.dtype.kind=='i' and 'slope' in D._info: # counts
+                C *= D._info['slope']
+                C += D._info['intercept']
+            mask = D._info.get('gap_mask')
+            if mask is not None:
+                C[mask] = numpy.nan
+            lo, hi, mean, _n = _reduce(C, per_point)
+            t = info['abscissa_min'] + (i0 + numpy.arange(len(lo))*per_point)*info['abscissa_inc']
+            return t, lo, hi, mean
+
+        level = 0
+        while level+1 < len(self.levels) and bin0*factor**(level+1) <= per_point:
+            level += 1
+        B = bin0*factor**level
+        b0, b1 = i0//B, -(-i1//B)
+        k = max(1, math.ceil((b1-b0)/max(1, width))) # bins per point
+
+        Lmin, Lmax, Lmean, Lcnt = (A[ch, b0:b1] for A in self.levels[level])
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # all NaN
+            lo = _fold(Lmin, k, numpy.nanmin)
+            hi = _fold(Lmax, k, numpy.nanmax)
+            cnt = _fold(Lcnt.astype('f8'), k, numpy.nansum)
+            mean = _fold(numpy.nan_to_num(Lmean)*Lcnt, k, numpy.nansum)/cnt
+        t = info['abscissa_min'] + (b0 + numpy.arange(len(lo))*k)*B*info['abscissa_inc']
+        return t, lo, hi, mean
+
+def _fold(A, k, fn):
+    """Reduce consecutive groups of k elements.  The last group may be partial
+    """
+    n = -(-len(A)//k)
+    P = numpy.full(n*k, numpy.nan, dtype=A.dtype)
+    P[:len(A)] = A
+    return fn(P.reshape((n, k)), axis=1)
+
+def _reduce(C:numpy.ndarray, b:int):
+    """min, max, mean, and number of valid samples in consecutive bins of b samples.
+    Float input may include NaN placeholders.  The last bin may be partial
+    """
+    n = -(-len(C)//b)
+    if C.dtype.kind=='f':
+        P = numpy.full(n*b, numpy.nan, dtype=C.dtype)
+        P[:len(C)] = C
+        P = P.reshape((n, b))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # all NaN
+            cnt = b - numpy.isnan(P).sum(axis=1)
+            return numpy.nanmin(P, axis=1), numpy.nanmax(P, axis=1), numpy.nanmean(P, axis=1), cnt
+    full = len(C)//b
+    F = C[:full*b].reshape((full, b))
+    lo, hi, mean, cnt = F.min(axis=1), F.max(axis=1), F.mean(axis=1), numpy.full(full, b)
+    if full < n: # partial
+        R = C[full*b:]
+        lo, hi = numpy.append(lo, R.min()), numpy.append(hi, R.max())
+        mean, cnt = numpy.append(mean, R.mean()), numpy.append(cnt, len(R))
+    return lo, hi, mean, cnt
+
+def build(src, key='*', bin0=1024, factor=4, block=1<<20, **kws) -> Overview:
+    """Build overview of all matching channels in one streaming pass
+
+    Quartz .hdr and HDF5 files are opened with raw=True, so that bins are reduced from counts.
+
+    :param src: DataSet, or file name passed to quartz.open() with kws.
+                gaps=True applies only to .hdr and .dat files.
+    :param bin0: Samples per bin of the finest level
+    :param factor: Ratio of bin sizes of successive levels
+    :param block: Samples read at a time.  Rounded up to a multiple of bin0.
+    """
+    if not isinstance(src, DataSet):
+        with _open_counts(src, **kws) as S:
+            return build(S, key=key, bin0=bin0, factor=factor, block=block)
+
+    idxs = src._lookup_set(key, first=False)
+    if isinstance(idxs, int):
+        idxs = [idxs]
+    block = -(-block//bin0)*bin0
+
+    infos = [src._index[idx].info for idx in idxs]
+    acc = [([], [], [], []) for _idx in idxs]
+    cal = [None]*len(idxs) # (slope, intercept) when reducing counts
+
+    for blks in src.iter_sets(key, block):
+        for n, C in enumerate(blks):
+            if len(C)==0:
+                continue
+            mask = C._info.get('gap_mask')
+            if C.dtype.kind=='i' and 'slope' in C._info:
+                cal[n] = (C._info['slope'], C._info['intercept'])
+            C = C.view(numpy.ndarray)
+            if mask is not None: # exclude placeholders
+                C = C.astype('f8')
+                C[mask] = numpy.nan
+            for L, R in zip(acc[n], _reduce(C, bin0)):
+                L.append(R)
+
+    npoints = [src._npoints(idx) for idx in idxs]
+    nbins = -(-max(npoints + [1])//bin0)
+    Lmin, Lmax, Lmean = (numpy.full((len(idxs), nbins), numpy.nan, dtype='f8') for _n in range(3))
+    Lcnt = numpy.zeros((len(idxs), nbins), dtype='i8')
+    for n, (lo, hi, mean, cnt) in enumerate(acc):
+        if lo:
+            m = sum(len(R) for R in lo)
+            Lmin[n, :m], Lmax[n, :m], Lmean[n, :m] = map(numpy.concatenate, (lo, hi, mean))
+            Lcnt[n, :m] = numpy.concatenate(cnt)
+        if cal[n] is not None:
+            s, b = cal[n]
+            Lmin[n], Lmax[n] = Lmin[n]*s + b, Lmax[n]*s + b
+            if s < 0:
+                Lmin[n], Lmax[n] = Lmax[n].copy(), Lmin[n].copy()
+            Lmean[n] = Lmean[n]*s + b
+    del acc
+
+    levels = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning) # all NaN
+        while True:
+            levels.append(tuple(A.astype('f4') for A in (Lmin, Lmax, Lmean)) + (Lcnt.astype('i4'),))
+            if Lmin.shape[1] <= 1:
+                break
+            n = -(-Lmin.shape[1]//factor)
+            pad = n*factor - Lmin.shape[1]
+            def fold(A, fill):
+                return numpy.pad(A, ((0, 0), (0, pad)), constant_values=fill).reshape((len(idxs), n, factor))
+            W = fold(Lcnt, 0)
+            S = fold(numpy.nan_to_num(Lmean)*Lcnt, 0.0).sum(axis=2)
+            Lcnt = W.sum(axis=2)
+            Lmin = numpy.nanmin(fold(Lmin, numpy.nan), axis=2)
+            Lmax = numpy.nanmax(fold(Lmax, numpy.nan), axis=2)
+            Lmean = numpy.where(Lcnt>0, S/numpy.maximum(Lcnt, 1), numpy.nan)
+
+    meta = {
+        'names': [info.get('id1', str(idx)) for idx, info in zip(idxs, infos)],
+        'ids': [{K:str(V) for K, V in info.items() if K.startswith('id')} for info in infos],
+        'abscissa_min': [info['abscissa_min'] for info in infos],
+        'abscissa_inc': [info['abscissa_inc'] for info in infos],
+        'npoints': npoints,
+        'bin0': bin0,
+        'factor': factor,
+        'nlevels': len(levels),
+    }
+    return Overview(meta, levels)
+
+def overview(fname, key='*', bin0=1024, factor=4, **kws) -> Overview:
+    """Load overview from sidecar file '<fname>.ovw.npz', or build and save if missing or stale.
+
+    Stale when the file, or the .dat and .j files of a .hdr, change,
+    or when built with different parameters.
+
+    :param kws: Passed to build()
+    """
+    side = _sidecar(fname)
+    stamp = _stamp(fname)
+    # parameters which change content
+    params = json.loads(json.dumps(dict(kws, key=key, bin0=bin0, factor=factor)))
+    params.pop('block', None)
+    try:
+        O = Overview.load(side)
+        if O.meta.get('stamp')==stamp and O.meta.get('params')==params:
+            return O
+        _log.debug('stale overview %s', side)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        _log.exception('ignoring unreadable overview %s', side)
+
+    O = build(fname, key=key, bin0=bin0, factor=factor, **kws)
+    O.meta['stamp'] = stamp
+    O.meta['params'] = params
+    try:
+        O.save(side)
+    except OSError:
+        _log.exception('unable to write overview %s', side)
+    return O
@@ -5,16 +5,20 @@ http://mdavidsaver.github.io/pscdrv/udpfast.html#file-format
 Specialized for Quartz digitizer msgid
 """
 
+import os
 import struct
+import time
 from collections import namedtuple
 
 import numpy
 
-from . import DataSet, DataChannel
+from . import DataSet, DataChannel, _range_info, _runs_dtype
 
 _psc_hdr = struct.Struct('>2sHI')
+# PSC header, receive time, and Quartz body up to channel mask
+_psc_pkt = struct.Struct('>2sHIIIII')
 
-def _msg_layout(msgid: int, bodylen: int) -> numpy.dtype:
+def _msg_layout(msgid: int, bodylen: int, chmask=0xffffffff) -> numpy.dtype:
     """Quartz data packet format, including PSC UDP header
     """
     _T = [
@@ -42,90 +46,736 @@ def _msg_layout(msgid: int, bodylen: int) -> numpy.dtype:
     else:
         raise ValueError(f'Unsupported msgid 0x{msgid:04x}')
 
+    nchan = bin(chmask & 0xffffffff).count('1')
+    if nchan==0:
+        raise ValueError('Empty channel mask')
+
     samp_len = bodylen - (numpy.dtype(_T).itemsize - 16)
     assert samp_len >= 3, samp_len
-    nsamp_per_chan, rem = divmod(samp_len, 3*32) # TODO: assumes chmask==0xffffffff
+    nsamp_per_chan, rem = divmod(samp_len, 3*nchan)
     assert rem == 0, (msgid, bodylen, numpy.dtype(_T).itemsize, nsamp_per_chan, rem)
     _T += [
-        ('samp', 'u1', (nsamp_per_chan, 32, 3)), # packed I24, channels interleaved for each time point
+        ('samp', 'u1', (nsamp_per_chan, nchan, 3)), # packed I24, channels in mask interleaved for each time point
     ]
     return numpy.dtype(_T)
 
-def read_dat(file):
-    """Read packet stream from .dat file w/o decoding samples array
+def _chan_map(chmask: int) -> dict:
+    """Map channel index 0->31 to position in samples of a packet with channel mask
+    """
+    return {chan:n for n, chan in enumerate(c for c in range(32) if (chmask>>c)&1)}
+
+def _read_layout(file) -> numpy.dtype:
+    """Packet layout of the packet at the current file position.  Position is not changed.
     """
     pos = file.tell()
-    ps, msgid, blen = _psc_hdr.unpack(file.read(8))
-    assert ps == b'PS', ps
+    ps, msgid, blen, _rsec, _rns, _sts, chmask = _psc_pkt.unpack(file.read(_psc_pkt.size))
+    if ps != b'PS':
+        raise RuntimeError(f'{getattr(file, "name", None)} no packet at offset {pos}: {ps!r}')
     file.seek(pos)
+    return _msg_layout(msgid, blen, chmask)
+
+def read_dat(file, check=True, chunk=65536, gaps=False) -> numpy.ndarray:
+    """Map packet stream from .dat file w/o decoding samples array
 
-    T = _msg_layout(msgid, blen)
+    Returns a read-only numpy.memmap of packets, so only those packets
+    actually accessed are read from disk.
+
+    All packets must have the same msgid, body length, and channel mask.
+    cf. read_segments()
+
+    :param file: File opened in binary mode, positioned at the first packet.
+    :param check: Validate all packet headers.  cf. check_dat()
+    :param chunk: Number of packets to validate at a time.
+    :param gaps: Tolerate missing packets.  cf. PacketStream
+    """
+    pos = file.tell()
+    T = _read_layout(file)
 
-    F = numpy.fromfile(file, dtype=T)
+    npkt = (os.fstat(file.fileno()).st_size - pos)//T.itemsize
+    if npkt==0: # can't mmap() zero length
+        return numpy.zeros(0, dtype=T)
 
-    # TODO: assumes all with identical msgid (true so far...)
-    # the following checks effectively force the entire file into RAM
-    assert numpy.all(F['ps']==0x5053)
-    assert numpy.all(F['msgid']==msgid)
-    assert numpy.all(F['blen']==blen)
-    # TODO: assumes all channels included.  (FW supports any non-zero mask, so far IOC always selects all)
-    assert numpy.all(F['chmask']==0xffffffff)
+    F = numpy.memmap(file, dtype=T, mode='r', offset=pos, shape=(npkt,))
+    file.seek(pos + npkt*T.itemsize)
 
-    dSEQ = numpy.diff(F['seq'])
-    if numpy.any(dSEQ!=1):
-        raise RuntimeError(f'{file.name} missing packets: {numpy.where(dSEQ)}')
+    if check:
+        check_dat(F, chunk=chunk, name=getattr(file, 'name', None), gaps=gaps)
 
     return F
 
-def get_chan(F: numpy.ndarray, chan: int) -> numpy.ndarray:
+def read_segments(file, check=True, chunk=65536, gaps=False) -> [numpy.ndarray]:
+    """Map packet stream from .dat file as a list of segments, each of packets
+    with the same msgid, body length, and channel mask.
+
+    Packet headers are always scanned to find segment boundaries.
+
+    :param file: File opened in binary mode, positioned at the first packet.
+    :param check: Also check sequence continuity within segments.  cf. check_dat()
+    :param chunk: Number of packets to scan at a time.
+    :param gaps: Tolerate missing packets.  cf. PacketStream
+    :returns: List of read-only numpy.memmap, suitable for PacketStream
+    """
+    name = getattr(file, 'name', None)
+    size = os.fstat(file.fileno()).st_size
+    pos = file.tell()
+
+    segs = []
+    while size - pos >= _psc_pkt.size:
+        file.seek(pos)
+        T = _read_layout(file)
+        npkt = (size - pos)//T.itemsize
+        if npkt==0:
+            break # trailing partial packet
+
+        F = numpy.memmap(file, dtype=T, mode='r', offset=pos, shape=(npkt,))
+        end, _W = _scan_layout(F, chunk, name, gaps if check else None)
+        segs.append(F[:end])
+        pos += end*T.itemsize
+
+    file.seek(pos)
+    return segs
+
+def _seq_breaks(C: numpy.ndarray, name, gaps: bool) -> numpy.ndarray:
+    """Indices in C after which sequence numbers are not continuous
+    """
+    dSEQ = numpy.diff(C['seq'].astype('i8'))
+    W, = numpy.nonzero(dSEQ!=1)
+    if len(W) and not gaps:
+        raise RuntimeError(f'{name} missing packets after: {W}')
+    elif numpy.any(dSEQ[W] < 1):
+        raise RuntimeError(f'{name} sequence not increasing after: {W[dSEQ[W] < 1]}')
+    return W
+
+def _scan_layout(F: numpy.ndarray, chunk: int, name=None, gaps=None) -> (int, numpy.ndarray):
+    """Scan packet headers 'chunk' packets at a time.
+
+    :param gaps: If not None, check sequence continuity, and tolerate missing packets if True.
+    :returns: (number of leading packets with the same layout as the first,
+               indices of packets among these after which packets are missing)
+    """
+    W = [numpy.zeros(0, dtype='i8')]
+    if len(F)==0:
+        return 0, W[0]
+    H = F[0]
+    msgid, blen, chmask = H['msgid'], H['blen'], H['chmask']
+
+    for start in range(0, len(F), chunk):
+        C = F[start:start+chunk+1] # overlap by one to compare sequence numbers
+
+        same = C['ps']==0x5053
+        same &= C['msgid']==msgid
+        same &= C['blen']==blen
+        same &= C['chmask']==chmask
+        end, = numpy.nonzero(~same)
+        if len(end):
+            C = C[:end[0]]
+
+        if gaps is not None:
+            W.append(_seq_breaks(C, name, gaps) + start)
+
+        if len(end):
+            return start + int(end[0]), numpy.concatenate(W)
+
+    return len(F), numpy.concatenate(W)
+
+def check_dat(F: numpy.ndarray, chunk=65536, name=None, gaps=False) -> numpy.ndarray:
+    """Validate packet headers and sequence continuity of a packet stream.
+
+    Headers are inspected 'chunk' packets at a time to bound memory usage.
+
+    :param gaps: Tolerate missing packets.
+    :returns: Indices of packets after which packets are missing.
+    :raises RuntimeError: When packets are missing, unless gaps=True,
+                          when sequence numbers are not increasing,
+                          or when the packet layout changes.
+    """
+    end, W = _scan_layout(F, chunk, name, gaps)
+    if end!=len(F):
+        raise RuntimeError(f'{name} packet layout changes at {end}.  cf. read_segments()')
+    return W
+
+def find_gaps(F: numpy.ndarray, chunk=65536, name=None) -> numpy.ndarray:
+    """Indices of packets after which packets are missing.  Only sequence numbers are inspected.
+
+    :raises RuntimeError: When sequence numbers are not increasing.
+    """
+    W = [numpy.zeros(0, dtype='i8')]
+    for start in range(0, len(F), chunk):
+        W.append(_seq_breaks(F[start:start+chunk+1], name, True) + start)
+    return numpy.concatenate(W)
+
+def _hdr_layout(T: numpy.dtype, fields=None) -> numpy.dtype:
+    """View of packet layout T with only header fields, skipping the samples array
+    """
+    names = [n for n in T.names if n!='samp'] if fields is None else list(fields)
+    return numpy.dtype({
+        'names': names,
+        'formats': [T.fields[n][0] for n in names],
+        'offsets': [T.fields[n][1] for n in names],
+        'itemsize': T.itemsize,
+    })
+
+def read_headers(file, fields=None, count=None, chunk=65536) -> numpy.ndarray:
+    """Read packet headers from .dat file, skipping samples.
+
+    Headers are copied out of a strided map 'chunk' packets at a time,
+    so samples are not decoded or copied.
+    The packet layout may change.  cf. read_segments()
+    Fields absent from some packets (eg. 'hihi' when msgid changes) are zero for those.
+
+    :param file: File opened in binary mode, positioned at the first packet.
+    :param fields: Names of header fields to read.  eg. ('seq', 'sec', 'ns').  Default all of first packet.
+    :param count: Maximum number of packets.  Default all.
+    :returns: Compact array of header fields
+    """
+    name = getattr(file, 'name', None)
+    size = os.fstat(file.fileno()).st_size
+    pos = file.tell()
+
+    T = _read_layout(file)
+    if fields is None:
+        fields = [n for n in T.names if n!='samp']
+    ctype = numpy.dtype([(n, T.fields[n][0]) for n in fields])
+
+    Hs = []
+    n = 0
+    while size - pos >= _psc_pkt.size and (count is None or n < count):
+        file.seek(pos)
+        T = _read_layout(file)
+        npkt = (size - pos)//T.itemsize
+        if count is not None:
+            npkt = min(npkt, count - n)
+        if npkt==0:
+            break # trailing partial packet
+
+        M = numpy.memmap(file, dtype=_hdr_layout(T), mode='r', offset=pos, shape=(npkt,))
+        end, _W = _scan_layout(M, chunk, name)
+
+        present = [f for f in fields if f in T.names]
+        V = M[:end].view(_hdr_layout(T, present))
+        H = numpy.zeros(end, dtype=ctype)
+        if len(present)==len(fields):
+            for start in range(0, end, chunk):
+                H[start:start+chunk] = V[start:start+chunk]
+        else:
+            P = numpy.zeros(min(chunk, end), dtype=[(f, ctype.fields[f][0]) for f in present])
+            for start in range(0, end, chunk):
+                C = P[:min(chunk, end-start)]
+                C[:] = V[start:start+chunk]
+                for f in present:
+                    H[f][start:start+len(C)] = C[f]
+        del M, V
+
+        Hs.append(H)
+        n += end
+        pos += end*T.itemsize
+
+    file.seek(pos)
+    if len(Hs)==1:
+        return Hs[0]
+    return numpy.concatenate(Hs) if Hs else numpy.zeros(0, dtype=ctype)
+
+def dat_info(file, count=None, chunk=65536) -> dict:
+    """Summarize .dat file from packet headers.
+
+    :param count: Maximum number of packets to inspect.  Default all.
+    :returns: dict with keys:
+              'msgid', 'nchan', 'samp_per_chan' of first packet, 'packets',
+              'segments' number of runs of packets with the same layout,
+              'T0' and 'Tr0' receive time of first packet as float seconds,
+              'Fsamp' mean sample rate,
+              'gaps' list of (packet index, seq before, seq after, time before)
+              where packets are missing,
+              'disorder' list of the same where sequence numbers are not increasing.
+    """
+    name = getattr(file, 'name', None)
+    T = _read_layout(file)
+
+    H = read_headers(file, fields=('msgid', 'blen', 'chmask', 'seq', 'sec', 'ns', 'rsec', 'rns'),
+                     count=count, chunk=chunk)
+    if len(H)==0:
+        raise RuntimeError(f'{name} has no complete packets')
+
+    samp_per_chan = T['samp'].shape[0]
+    H0, H1 = H[0], H[-1]
+    T0 = int(H0['sec']) + int(H0['ns'])*1e-9
+    dSEQ = numpy.diff(H['seq'].astype('i8'))
+    nseq = int(H1['seq']) - int(H0['seq'])
+    if nseq>0 and numpy.all(dSEQ>0) and numpy.all(H['blen']==H0['blen']) and numpy.all(H['chmask']==H0['chmask']):
+        dT = (int(H1['sec']) - int(H0['sec'])) + (int(H1['ns']) - int(H0['ns']))*1e-9
+        Fsamp = nseq*samp_per_chan/dT
+    else:
+        Fsamp = None
+
+    change = H['msgid'][1:]!=H['msgid'][:-1]
+    change |= H['blen'][1:]!=H['blen'][:-1]
+    change |= H['chmask'][1:]!=H['chmask'][:-1]
+
+    # not find_gaps(), which raises on disorder
+    def jumps(W):
+        return [(int(w), int(H['seq'][w]), int(H['seq'][w+1]),
+                 int(H['sec'][w]) + int(H['ns'][w])*1e-9) for w in W]
+
+    return {
+        'msgid': int(H0['msgid']),
+        'nchan': bin(int(H0['chmask'])).count('1'),
+        'samp_per_chan': samp_per_chan,
+        'packets': len(H),
+        'segments': 1 + int(numpy.count_nonzero(change)),
+        'T0': T0,
+        'Tr0': int(H0['rsec']) + int(H0['rns'])*1e-9,
+        'Fsamp': Fsamp,
+        'gaps': jumps(numpy.flatnonzero(dSEQ>1)),
+        'disorder': jumps(numpy.flatnonzero(dSEQ<1)),
+    }
+
+def _decode_i24(S24: numpy.ndarray, out: numpy.ndarray):
+    """Decode packed big endian I24 (..., 3) into int32 'out' (...) w/ integer sign extension
+    """
+    numpy.copyto(out, S24[...,0].view('i1')) # sign extend MSB
+    out <<= 8
+    out |= S24[...,1]
+    out <<= 8
+    out |= S24[...,2]
+
+def get_chans(F: numpy.ndarray, chans=None, dtype='f4', chunk=4096, gaps=False) -> numpy.ndarray:
+    """Extract several channels from the provided message stream in one pass.
+
+    :param F: Input msg stream
+    :param chans: Sequence of channel indices 0->31.  Default all in channel mask.
+    :param dtype: Output element type.  eg. 'i4' for raw counts.
+    :param chunk: Number of packets to decode at a time.
+    :param gaps: Insert placeholders for missing packets.  cf. PacketStream.get_chans() and gap_mask()
+    :returns: (len(chans), N) array
+    """
+    npkt, nsamp, nchan = F['samp'].shape[:3]
+    if npkt==0:
+        return numpy.zeros((nchan if chans is None else len(chans), 0), dtype=dtype)
+
+    # position of each requested channel in packet samples
+    chmap = _chan_map(int(F[0]['chmask']))
+    if chans is None:
+        chans = list(chmap)
+
+    if gaps:
+        return PacketStream([F], gaps=True).get_chans(chans, dtype=dtype)
+
+    try:
+        sel = [chmap[chan] for chan in chans]
+    except KeyError as e:
+        raise ValueError(f'Channel {e.args[0]} not in mask 0x{int(F[0]["chmask"]):08x}') from None
+
+    out = numpy.empty((len(sel), npkt*nsamp), dtype=dtype)
+    I32 = numpy.empty((min(chunk, npkt)*nsamp, len(sel)), dtype='i4')
+
+    for start in range(0, npkt, chunk):
+        S24 = F['samp'][start:start+chunk] # (n, nsamp_per_chan, nchan, 3)
+        if sel!=list(range(nchan)):
+            S24 = S24[:,:,sel,:]
+        S24 = S24.reshape((-1, len(sel), 3))
+        I = I32[:S24.shape[0]]
+        _decode_i24(S24, I)
+        out[:, start*nsamp:start*nsamp+I.shape[0]] = I.T
+
+    return out
+
+def get_chan(F: numpy.ndarray, chan: int, gaps=False) -> numpy.ndarray:
     """Extract a single channel from the provided message stream.
 
     :param F: Input msg stream
     :param chan: Channel index 0->31
+    :param gaps: Insert NaN for missing packets.  cf. gap_mask()
+    :raises ValueError: If chan is not in the channel mask.
+    """
+    return get_chans(F, [chan], gaps=gaps)[0]
+
+def gap_mask(F: numpy.ndarray) -> numpy.ndarray:
+    """Boolean mask of samples from get_chan(F, ..., gaps=True) which are placeholders
+    """
+    return PacketStream([F], gaps=True).gap_mask()
+
+class FixProgress(namedtuple('FixProgress', ['packets', 'missing', 'gaps', 'nbytes', 'total', 'elapsed'])):
+    """Progress of fix_dat().
+
+    packets and nbytes are read from input so far, of total bytes.
+    missing placeholder packets have been written, filling gaps.
+    """
+    __slots__ = ()
+
+    @property
+    def rate(self) -> float:
+        """Input throughput in bytes per second"""
+        return self.nbytes/self.elapsed if self.elapsed>0 else 0.0
+
+    def __str__(self):
+        return (f'{self.nbytes/1e6:.1f}/{self.total/1e6:.1f} MB, {self.packets} packets,'
+                f' {self.missing} missing in {self.gaps} gaps, {self.rate/1e6:.1f} MB/s')
+
+def _placeholders(prev: numpy.void, nxt: numpy.void, chunk: int):
+    """Yield arrays of placeholder packets for sequence numbers between prev and nxt.
+
+    Samples are 0x7f7f7f.  Timestamps are interpolated.
     """
-    assert F[0]['chmask'] & (1<<chan), (F[0]['chmask'], chan)
-    assert F[0]['chmask']==0xffffffff
+    s0, s1 = int(prev['seq']), int(nxt['seq'])
+    t0 = int(prev['sec'])*1000000000 + int(prev['ns'])
+    t1 = int(nxt['sec'])*1000000000 + int(nxt['ns'])
+    dt = (t1-t0)/(s1-s0)
+
+    for a in range(s0+1, s1, chunk):
+        seq = numpy.arange(a, min(a+chunk, s1), dtype='u8')
+        S = numpy.zeros(len(seq), dtype=prev.dtype)
+        for fld in ('ps', 'msgid', 'blen', 'chmask'):
+            S[fld] = prev[fld]
+        S['seq'] = seq
+        S['sec'], S['ns'] = numpy.divmod(t0 + ((seq - s0)*dt).astype('i8'), 1000000000)
+        S['samp'] = 0x7f
+        yield S
+
+def fix_dat(src, dst, chunk=16384, progress=None) -> FixProgress:
+    """Copy packet stream from file src to dst, inserting placeholder packets
+    where any are missing.  Memory use is bounded by 'chunk' packets.
+
+    Each segment of packets with the same layout is copied as is.  cf. read_segments()
+    Placeholders have the layout of the packet before the gap.
+
+    :param src: Input file opened in binary mode, positioned at the first packet.
+    :param dst: Output file opened in binary mode.
+    :param progress: Called with FixProgress after each chunk.
+    :returns: Final FixProgress
+    :raises RuntimeError: When sequence numbers are not increasing.
+    """
+    name = getattr(src, 'name', None)
+    total = os.fstat(src.fileno()).st_size - src.tell()
+    segs = read_segments(src, check=False)
+
+    T0 = time.monotonic()
+    last = None # last input packet
+    npkt = nmissing = ngaps = nbytes = 0
+
+    for F in segs:
+        for start in range(0, len(F), chunk):
+            C = F[start:start+chunk]
+
+            seq = C['seq'].astype('i8')
+            prev = seq[0]-1 if last is None else int(last['seq'])
+            dSEQ = numpy.diff(seq, prepend=prev)
+            if numpy.any(dSEQ<1):
+                raise RuntimeError(f'{name} sequence not increasing near packet {npkt}')
+
+            i = 0
+            for w in numpy.nonzero(dSEQ!=1)[0]: # C[w] is first after gap
+                dst.write(C[i:w].data)
+                for S in _placeholders(C[w-1] if w else last, C[w], chunk):
+                    dst.write(S.data)
+                ngaps += 1
+                nmissing += int(dSEQ[w]) - 1
+                i = w
+            dst.write(C[i:].data)
+
+            last = C[-1].copy()
+            npkt += len(C)
+            nbytes += C.nbytes
+            if progress is not None:
+                progress(FixProgress(npkt, nmissing, ngaps, nbytes, total, time.monotonic()-T0))
+
+    return FixProgress(npkt, nmissing, ngaps, nbytes, total, time.monotonic()-T0)
+
+class PacketStream:
+    """Virtual concatenation of successive packet streams, eg. the .dat files
+    of one chassis during a long acquisition.  No packets are copied.
+
+    With gaps=True, missing packets (sequence number gaps) within or between
+    parts are replaced by placeholders when decoding.  cf. get_chans() and gap_mask().
+
+    :param parts: Packet arrays, as returned by read_dat(), in order.
+    :param names: File names of parts, for error messages.
+    :param gaps: Tolerate missing packets.
+    :raises RuntimeError: If sequence numbers are not continuous, or with gaps=True not increasing.
+    """
+    def __init__(self, parts: list, names=None, gaps=False, chunk=65536):
+        if names is None:
+            names = [getattr(P, 'filename', None) for P in parts]
+        keep = [n for n, P in enumerate(parts) if len(P)]
+        if len(keep)==0:
+            raise ValueError('No packets')
+        self.parts = parts = [parts[n] for n in keep]
+        self.names = names = [names[n] for n in keep]
+
+        # segments of consecutive packets within a part, or of missing packets (part -1)
+        segs = [] # [(part, first packet in part, #packets, #samples per packet)]
+        last = None
+        for part, (P, name) in enumerate(zip(parts, names)):
+            nsamp = P['samp'].shape[1]
+            edges = [0, len(P)]
+            if gaps:
+                edges[1:1] = find_gaps(P, chunk=chunk)+1
 
-    S24 = F['samp'][:,:,chan,:] # (npkt, nsamp_per_chan, 3)
-    S32 = numpy.ndarray(S24.shape[:2] + (4,), dtype='u1')
-    S32[...,1:] = S24
-    S32[...,0] = numpy.bitwise_and(S24[...,0], 0x80)/128*255 # sign extend
-    del S24
+            for p0, p1 in zip(edges[:-1], edges[1:]):
+                first = int(P[p0]['seq'])
+                if last is not None:
+                    missing = first - last[0] - 1
+                    if missing<0 or (missing and not gaps):
+                        where = f'{name} does not continue {names[part-1]}' if p0==0 else f'{name} packet {p0}'
+                        raise RuntimeError(f'{where}: seq {last[0]} -> {first}')
+                    elif missing:
+                        segs.append((-1, 0, missing, last[1]))
+                segs.append((part, p0, p1-p0, nsamp))
+                last = (int(P[p1-1]['seq']), nsamp)
 
-    S32 = S32.view('>i4') # (npkt, nsamp_per_chan, 1)
+        self._segs = segs
+        npkt = numpy.asarray([S[2] for S in segs])
+        self._pstart = numpy.concatenate(([0], numpy.cumsum(npkt)))
+        self._sstart = numpy.concatenate(([0], numpy.cumsum(npkt*[S[3] for S in segs])))
 
-    return S32.astype('f4').flatten()
+    @property
+    def nbytes(self) -> int:
+        return sum(P.nbytes for P in self.parts)
+
+    def __len__(self) -> int:
+        """Total number of packets, including any missing
+        """
+        return int(self._pstart[-1])
+
+    def __getitem__(self, n: int) -> numpy.void:
+        """Packet by global index.  None if missing.
+        """
+        if n<0:
+            n += len(self)
+        if not 0<=n<len(self):
+            raise IndexError(n)
+        seg = int(numpy.searchsorted(self._pstart, n, side='right'))-1
+        part, pkt0, _npkt, _nsamp = self._segs[seg]
+        if part<0:
+            return None
+        return self.parts[part][pkt0 + n - self._pstart[seg]]
+
+    @property
+    def nsamp(self) -> int:
+        """Total number of samples per channel, including any missing
+        """
+        return int(self._sstart[-1])
+
+    def locate(self, n: int) -> (int, int, int):
+        """Map global sample index to (part, packet in part, sample in packet).
+        part is None for missing packets.
+        """
+        if not 0<=n<self.nsamp:
+            raise IndexError(n)
+        seg = int(numpy.searchsorted(self._sstart, n, side='right'))-1
+        part, pkt0, _npkt, nsamp = self._segs[seg]
+        pkt, off = divmod(n - int(self._sstart[seg]), nsamp)
+        if part<0:
+            return None, pkt, off
+        return part, pkt0 + pkt, off
+
+    def _overlap(self, start, stop):
+        """Yield (segment, s0, s1) for segments overlapping sample range [start, stop)
+        """
+        first = max(0, int(numpy.searchsorted(self._sstart, start, side='right'))-1)
+        for seg in range(first, len(self._segs)):
+            s0, s1 = max(start, int(self._sstart[seg])), min(stop, int(self._sstart[seg+1]))
+            if s0>=s1:
+                break
+            yield seg, s0, s1
+
+    def _range(self, start, stop) -> (int, int):
+        stop = self.nsamp if stop is None else min(stop, self.nsamp)
+        start = max(0, min(start, stop))
+        return start, stop
+
+    def get_chans(self, chans=None, start=0, stop=None, dtype='f4', fill=None, out=None) -> numpy.ndarray:
+        """Extract several channels for the sample range [start, stop).
+
+        Only those packets spanning the range are read.
+
+        :param chans: Sequence of channel indices 0->31.  Default all.
+        :param fill: Placeholder value for samples of missing packets,
+                     or of channels not in the channel mask of some packets.
+                     Default NaN for floating point, or the minimum integer value,
+                     which is outside of the I24 sample range.
+        :param out: Optional (len(chans), stop-start) array to fill, whose type overrides dtype.
+        :returns: (len(chans), stop-start) array
+        """
+        if chans is None:
+            chans = range(32)
+        chans = list(chans)
+        start, stop = self._range(start, stop)
+        if out is None:
+            out = numpy.empty((len(chans), stop-start), dtype=dtype)
+        elif out.shape!=(len(chans), stop-start):
+            raise ValueError(f'out shape {out.shape} != {(len(chans), stop-start)}')
+        dtype = out.dtype
+        if fill is None:
+            fill = numpy.nan if dtype.kind=='f' else numpy.iinfo(dtype).min
+
+        for seg, s0, s1 in self._overlap(start, stop):
+            part, pkt0, _npkt, nsamp = self._segs[seg]
+            if part<0:
+                out[:, s0-start:s1-start] = fill
+                continue
+
+            base = int(self._sstart[seg])
+            p0, p1 = (s0-base)//nsamp, -(-(s1-base)//nsamp) # packets spanning [s0, s1)
+
+            P = self.parts[part][pkt0+p0:pkt0+p1]
+            first = base + p0*nsamp # sample index of D[:,0]
+
+            chmap = _chan_map(int(P[0]['chmask']))
+            have = [n for n, chan in enumerate(chans) if chan in chmap]
+            D = get_chans(P, [chans[n] for n in have], dtype=dtype)
+            if len(have)==len(chans):
+                out[:, s0-start:s1-start] = D[:, s0-first:s1-first]
+            else:
+                out[:, s0-start:s1-start] = fill
+                out[have, s0-start:s1-start] = D[:, s0-first:s1-first]
+
+        return out
+
+    def missing(self) -> [(int, int)]:
+        """List of sample ranges [start, stop) of missing packets
+        """
+        return [(int(self._sstart[seg]), int(self._sstart[seg+1]))
+                for seg, S in enumerate(self._segs) if S[0]<0]
+
+    def gap_mask(self, start=0, stop=None) -> numpy.ndarray:
+        """Boolean mask of sample range [start, stop) which is True for placeholder samples
+        """
+        start, stop = self._range(start, stop)
+        mask = numpy.zeros(stop-start, dtype='?')
+        for seg, s0, s1 in self._overlap(start, stop):
+            if self._segs[seg][0]<0:
+                mask[s0-start:s1-start] = True
+        return mask
+
+    def _times(self, chunk=65536):
+        """Yield (first sample index, timestamp in ns) arrays of present packets, 'chunk' at a time
+        """
+        for seg, (part, pkt0, npkt, nsamp) in enumerate(self._segs):
+            if part<0:
+                continue
+            base = int(self._sstart[seg])
+            for c0 in range(0, npkt, chunk):
+                C = self.parts[part][pkt0+c0:pkt0+min(c0+chunk, npkt)]
+                tns = C['sec'].astype('i8')*1000000000 + C['ns'].astype('i8')
+                yield base + (c0 + numpy.arange(len(C)))*nsamp, tns
+
+    def time_model(self, tol=0.5, chunk=65536) -> numpy.ndarray:
+        """Piecewise linear model of sample time from packet timestamps.
+
+        Packet timestamps are taken as the time of the first sample in each packet.
+        A new run begins where a packet timestamp differs from that predicted
+        from the preceding packet by more than 'tol' sample periods.  eg. a clock jump.
+        Missing packets do not begin a new run.
+
+        :param tol: Tolerance in (nominal) sample periods.
+        :returns: Array of runs with fields
+                  'sample' index of the first sample of the run,
+                  'sec' and 'ns' timestamp of this sample,
+                  and 'inc' mean sample period within the run in seconds.
+        :raises ValueError: If there are too few packets to estimate a sample period.
+        """
+        # nominal sample period from the first packets
+        S, T = [], []
+        for smp, tns in self._times(chunk):
+            S.append(smp)
+            T.append(tns)
+            if sum(len(s) for s in S)>=chunk:
+                break
+        S, T = numpy.concatenate(S), numpy.concatenate(T)
+        if len(S)<2:
+            raise ValueError('Too few packets to estimate sample period')
+        nominal = float(numpy.median(numpy.diff(T)/numpy.diff(S)))
+
+        runs = [] # [[first sample, first ns, last sample, last ns]]
+        for smp, tns in self._times(chunk):
+            if runs:
+                smp = numpy.concatenate(([runs[-1][2]], smp))
+                tns = numpy.concatenate(([runs[-1][3]], tns))
+            else:
+                runs.append([int(smp[0]), int(tns[0]), 0, 0])
+
+            resid = numpy.diff(tns) - numpy.diff(smp)*nominal
+            for w in numpy.nonzero(numpy.abs(resid) > tol*nominal)[0]:
+                runs[-1][2:] = int(smp[w]), int(tns[w])
+                runs.append([int(smp[w+1]), int(tns[w+1]), 0, 0])
+            runs[-1][2:] = int(smp[-1]), int(tns[-1])
+
+        R = numpy.zeros(len(runs), dtype=[('sample', 'i8'), ('sec', 'i8'), ('ns', 'i8'), ('inc', 'f8')])
+        for r, (s0, t0, s1, t1) in zip(R, runs):
+            r['sample'] = s0
+            r['sec'], r['ns'] = divmod(t0, 1000000000)
+            r['inc'] = (t1-t0)/(s1-s0)*1e-9 if s1>s0 else nominal*1e-9
+        return R
+
+def _gap_info(info: dict, mask: numpy.ndarray) -> dict:
+    """Add 'gap_mask' to channel meta-data if any samples are placeholders
+    """
+    if mask.any():
+        info = info.copy()
+        info['gap_mask'] = mask
+    return info
 
 SetInfo = namedtuple("SetInfo", ['idx', 'info'])
 
 class QuartzRaw(DataSet):
-    def __init__(self, file):
+    """Access to the channels of a single .dat file
+
+    The abscissa is derived from packet timestamps.  cf. PacketStream.time_model()
+    Where the clock jumps, info 'abscissa_runs' describes the piecewise linear abscissa.
+
+    :param gaps: Tolerate missing packets, which are replaced by NaN.
+                 Where present, info 'gap_mask' marks the placeholder samples.
+    :param abstime: If True, abscissa is POSIX time in seconds.
+                    Default is time relative to the first sample.
+    :param tol: Timestamp tolerance, in sample periods, before a clock jump is recognized.
+    """
+    def __init__(self, file, gaps=False, abstime=False, tol=0.5):
         try:
-            self.__data = D = read_dat(file)
+            segs = read_segments(file, gaps=gaps)
+            self.__data = S = PacketStream(segs, [file.name]*len(segs), gaps=gaps)
+            self._gaps = gaps
         finally:
             file.close()
 
-        assert D['samp'].shape[2:]==(32, 3)
-        samp_per_pkt = D['samp'].shape[1]
-        # times of first sample in each packet
-        T = D['sec'] + D['ns']*1e-9
-        dT = numpy.diff(T).mean() / samp_per_pkt
-        # TODO: account for extra samp_per_pkt-1
+        #: Piecewise linear time model.  cf. PacketStream.time_model()
+        self.time_model = M = S.time_model(tol=tol)
+        sec0, ns0 = int(M[0]['sec']), int(M[0]['ns'])
+        T0 = sec0 + ns0*1e-9 if abstime else 0.0
+
+        info = {
+            'abscissa_min': T0,
+            'abscissa_inc': float(M[0]['inc']),
+        }
+        if len(M)>1:
+            runs = numpy.zeros(len(M), dtype=_runs_dtype)
+            runs['sample'] = M['sample']
+            runs['time'] = T0 + ((M['sec'] - sec0) + (M['ns'] - ns0)*1e-9)
+            runs['inc'] = M['inc']
+            info['abscissa_runs'] = runs
 
         self._index = []
         for n in range(1, 33): # 1's index
             self._index.append(SetInfo(
                 idx=n,
-                info={
-                    'abscissa_min': 0.0,
-                    'abscissa_inc': dT,
-                },
+                info=info.copy(),
             ))
 
-    def _read_set(self, idx:int):
-        _idx, info = self._index[idx]
-        chan = get_chan(self.__data, idx)
+    def _npoints(self, idx:int) -> int:
+        return self.__data.nsamp
+
+    def _read_set(self, idx:int, start=0, stop=None):
+        return self._read_sets([idx], start, stop)[0]
+
+    def _group_sets(self, idxs:list) -> [list]:
+        return [list(idxs)] # decode all in one pass
 
-        chan = chan.view(DataChannel)
-        chan._info = info
-        return chan
+    def _read_sets(self, idxs:list, start=0, stop=None) -> [DataChannel]:
+        mask = self.__data.gap_mask(start, stop) if self._gaps else None
+        R = []
+        for idx, chan in zip(idxs, self.__data.get_chans(idxs, start, stop)):
+            chan = chan.view(DataChannel)
+            chan._info = _range_info(self._index[idx].info, start)
+            if mask is not None:
+                chan._info = _gap_info(chan._info, mask)
+            R.append(chan)
+        return R
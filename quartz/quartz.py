@@ -1,13 +1,14 @@
 
 import json
 import logging
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from pathlib import Path
 import struct
+import threading
 
 import numpy
 
-from . import psc, DataSet, DataChannel
+from . import psc, DataSet, DataChannel, RawChannel, _range_info, _sample_range
 
 _jhdr = struct.Struct('<IIIQ')
 
@@ -15,13 +16,74 @@ _log = logging.getLogger(__name__)
 
 SetInfo = namedtuple("SetInfo", ['idx', 'info'])
 
+class _PacketCache:
+    """LRU cache of mapped packet streams or .j files, bounded by total size in bytes.
+
+    The most recently used entry is always kept, even if it alone exceeds the budget.
+    """
+    def __init__(self, budget: int):
+        self.budget = budget
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, load):
+        """Return cached entry for key, or call load() to create it.
+
+        Thread safe.  load() is called without locking, so concurrent
+        misses on one key may each call load(), with one result kept.
+        """
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            except KeyError:
+                pass
+
+        F = load()
+
+        with self._lock:
+            F = self._entries.setdefault(key, F)
+            self._entries.move_to_end(key)
+
+            used = sum(E.nbytes for E in self._entries.values())
+            while used > self.budget and len(self._entries)>1:
+                _key, E = self._entries.popitem(last=False)
+                _log.debug('evict %r', _key)
+                used -= E.nbytes
+
+        return F
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
 class Quartz(DataSet):
-    def __init__(self, file):
+    """Access to a Quartz acquisition described by a .hdr file
+
+    :param file: .hdr file name or file object
+    :param cache_bytes: Total size of .dat packet streams and .j files to keep mapped
+                        between reads.
+    :param raw: Return int32 counts without applying Slope/Intercept,
+                which are available as info 'slope' and 'intercept'.
+                Counts read from .j files are read-only views of the mapped file.
+    :param lazy: With raw=True, return RawChannel to apply calibration on demand.
+    :param gaps: Tolerate missing .dat packets, which are replaced by NaN,
+                 or the minimum int32 value if raw.
+                 Where present, info 'gap_mask' marks the placeholder samples.
+    """
+    def __init__(self, file, cache_bytes=16<<30, raw=False, lazy=False, gaps=False):
+        self._cache = _PacketCache(cache_bytes)
+        self._raw = raw
+        self._gaps = gaps
+        if lazy and not raw:
+            raise ValueError('lazy=True requires raw=True')
+        self._type = RawChannel if lazy else DataChannel
         if not hasattr(file, 'readline'): # str or Path
             file = open(file, 'rb')
 
-        self._base = Path(file.name).parent # directory containing HDR file
-        index = self._json = json.load(file)
+        with file:
+            self._base = Path(file.name).parent # directory containing HDR file
+            index = self._json = json.load(file)
         Fsamp = index["SampleRate"]
 
         self._index = []
@@ -42,57 +104,241 @@ class Quartz(DataSet):
                 'id4': 'NONE',
                 'id5': 'NONE',
                 'label': sig['Desc'],
+                'slope': sig['Slope'],
+                'intercept': sig['Intercept'],
             }
 
             self._index.append(SetInfo(idx, info))
 
     def close(self):
         self._index = []
-        self._fp.close()
-
-    def _read_set(self, idx:int):
-        idx, info = self._index[idx]
+        self._cache.clear()
 
-        sig = self._json['Signals'][idx]
-        slope, offset = sig['Slope'], sig['Intercept']
+    def _read_set(self, idx:int, start=0, stop=None):
+        sig = self._json['Signals'][self._index[idx].idx]
 
         # prefer .j file when available
         jfile = sig.get('OutDataFile')
         if jfile is not None:
             # read .j channel data
             try:
-                J = open(self._base / jfile, 'rb')
-                jhdr = _jhdr.unpack(J.read(_jhdr.size))
-                if jhdr[0]!=1:
-                    raise RuntimeError('Unsupported J version {jhdr}')
-
-                jsize = jhdr[3]
-                F32 = numpy.fromfile(J, dtype='<i4', count=jsize//4).astype('f4')
-                F32 *= slope
-                F32 += offset
-                F32 = F32.view(DataChannel)
-                F32._info = info
-                return F32
-
+                counts = self._map_j(jfile)
             except:
                 _log.exception(f'unable to open {jfile!r}')
                 # fall through to try .dat
+            else:
+                return self._wrap(idx, counts[start:stop], start)
 
         chas, chan = sig['Address']['Chassis'], sig['Address']['Channel'] # 1-indexed
 
-        # lookup .dat file for chassis
+        counts, = self._read_dat(chas, [chan-1], start, stop)
+        return self._wrap(idx, counts, start, self._gap_mask(chas, start, stop))
+
+    def _wrap(self, idx:int, counts:numpy.ndarray, start:int, mask=None) -> DataChannel:
+        """Apply calibration to counts of one channel, unless raw
+        """
+        info = self._index[idx].info
+        if self._raw:
+            R = counts.view(self._type)
+        else:
+            R = counts.astype('f4', copy=False) # .j maps are read-only, so always copied
+            R *= info['slope']
+            R += info['intercept']
+            R = R.view(DataChannel)
+        R._info = _range_info(info, start)
+        if mask is not None:
+            R._info = psc._gap_info(R._info, mask)
+        return R
+
+    def _npoints(self, idx:int) -> int:
+        sig = self._json['Signals'][self._index[idx].idx]
+        jfile = sig.get('OutDataFile')
+        if jfile is not None:
+            try:
+                return len(self._map_j(jfile))
+            except:
+                _log.exception(f'unable to open {jfile!r}')
+        return self._stream(sig['Address']['Chassis']).nsamp
+
+    def _map_j(self, jfile:str) -> numpy.ndarray:
+        """Map .j file payload as int32 counts
+        """
+        def load():
+            with open(self._base / jfile, 'rb') as J:
+                jhdr = _jhdr.unpack(J.read(_jhdr.size))
+                if jhdr[0]!=1:
+                    raise RuntimeError(f'Unsupported J version {jhdr}')
+                jcount = jhdr[3]//4
+                if jcount==0: # can't mmap() zero length
+                    return numpy.zeros(0, dtype='<i4')
+                return numpy.memmap(J, dtype='<i4', mode='r', offset=_jhdr.size, shape=(jcount,))
+
+        return self._cache.get(('j', jfile), load)
+
+    def _group_sets(self, idxs:list) -> [list]:
+        # each .j file alone, and channels decoded from .dat grouped by chassis
+        groups, bychas = [], {}
+        for idx in idxs:
+            sig = self._json['Signals'][self._index[idx].idx]
+            if sig.get('OutDataFile') is not None:
+                groups.append([idx])
+            else:
+                chas = sig['Address']['Chassis']
+                if chas not in bychas:
+                    bychas[chas] = []
+                    groups.append(bychas[chas])
+                bychas[chas].append(idx)
+        return groups
+
+    def _read_sets(self, idxs:list, start=0, stop=None) -> [DataChannel]:
+        R = [None]*len(idxs)
+
+        # group channels without .j file by chassis to decode each .dat only once
+        bychas = {}
+        for n, idx in enumerate(idxs):
+            sig = self._json['Signals'][self._index[idx].idx]
+            if sig.get('OutDataFile') is not None:
+                R[n] = self._read_set(idx, start, stop)
+            else:
+                bychas.setdefault(sig['Address']['Chassis'], []).append((n, idx, sig))
+
+        for chas, sigs in bychas.items():
+            if len(sigs)==1:
+                n, idx, _sig = sigs[0]
+                R[n] = self._read_set(idx, start, stop)
+                continue
+
+            counts = self._read_dat(chas, [sig['Address']['Channel']-1 for _n, _idx, sig in sigs], start, stop)
+            mask = self._gap_mask(chas, start, stop)
+
+            for (n, idx, sig), chan in zip(sigs, counts):
+                R[n] = self._wrap(idx, chan, start, mask)
+
+        return R
+
+    def matrix(self, key, start=None, end=None, abstime=False) -> DataChannel:
+        """Load all matching datasets as one (nchan, N) array, aligned in time across chassis.
+
+        Rows are aligned to the first packet timestamp of each chassis,
+        and span the time during which all chassis were recording.
+        Each chassis is decoded once, directly into the output array.
+
+        >>> M = Q.matrix('CH*', 2.0, 4.0)
+        >>> M.shape, M.channels[0]['id1'], M.time[0]
+
+        :param start: Optional start of abscissa range.
+        :param end: Optional end of abscissa range.
+        :param abstime: If True, abscissa is POSIX time in seconds.
+                        Default is time relative to the start of the common overlap.
+        :returns: DataChannel with info 'channels' listing the meta-data of each row.
+                  Where present, info 'gap_mask' is an (nchan, N) mask of placeholder samples.
+        """
+        idxs = self._lookup_set(key, first=False)
+        if isinstance(idxs, int):
+            idxs = [idxs]
+        if len(idxs)==0:
+            raise ValueError(f'No such dataset {key}')
+        sigs = [self._json['Signals'][self._index[idx].idx] for idx in idxs]
+
+        # chassis start times as integer ns
+        T0 = {}
+        for sig in sigs:
+            chas = sig['Address']['Chassis']
+            if chas not in T0:
+                H = self._stream(chas)[0]
+                T0[chas] = int(H['sec'])*1000000000 + int(H['ns'])
+        tstart = max(T0.values())
+
+        info0 = self._index[idxs[0]].info
+        inc = info0['abscissa_inc']
+        offset = {chas: round((tstart - T)*1e-9/inc) for chas, T in T0.items()}
+
+        # each row is read from a .j file, or decoded with others of its chassis
+        jrows, bychas = [], {}
+        navail = []
+        for row, sig in enumerate(sigs):
+            chas = sig['Address']['Chassis']
+            jfile = sig.get('OutDataFile')
+            if jfile is not None:
+                try:
+                    J = self._map_j(jfile)
+                except:
+                    _log.exception(f'unable to open {jfile!r}')
+                else:
+                    jrows.append((row, chas, J))
+                    navail.append(len(J) - offset[chas])
+                    continue
+            bychas.setdefault(chas, []).append((row, sig['Address']['Channel']-1))
+            navail.append(self._stream(chas).nsamp - offset[chas])
+
+        info = {K: V for K, V in info0.items() if K.startswith('abscissa_')}
+        info['abscissa_min'] = tstart*1e-9 if abstime else 0.0
+        info['channels'] = [self._index[idx].info for idx in idxs]
+
+        i0, i1 = _sample_range(info, start, end)
+        N = max(0, min(navail))
+        i1 = N if i1 is None else min(i1, N)
+        i0 = min(i0, i1)
+
+        M = numpy.empty((len(idxs), i1-i0), dtype='i4' if self._raw else 'f4')
+        mask = None
+
+        for row, chas, J in jrows:
+            M[row] = J[offset[chas]+i0:offset[chas]+i1]
+
+        for chas, rows in bychas.items():
+            S = self._stream(chas)
+            first, last = rows[0][0], rows[-1][0]
+            s0, s1 = offset[chas]+i0, offset[chas]+i1
+            chans = [chan for _row, chan in rows]
+            if last-first+1 == len(rows): # contiguous rows, decode in place
+                S.get_chans(chans, s0, s1, out=M[first:last+1])
+            else:
+                M[[row for row, _chan in rows]] = S.get_chans(chans, s0, s1, dtype=M.dtype)
+
+            if self._gaps:
+                G = S.gap_mask(s0, s1)
+                if G.any():
+                    if mask is None:
+                        mask = numpy.zeros(M.shape, dtype='?')
+                    mask[[row for row, _chan in rows]] = G
+
+        if not self._raw:
+            M *= numpy.asarray([I['slope'] for I in info['channels']], dtype=M.dtype)[:,None]
+            M += numpy.asarray([I['intercept'] for I in info['channels']], dtype=M.dtype)[:,None]
+
+        R = M.view(DataChannel)
+        R._info = _range_info(info, i0)
+        if mask is not None:
+            R._info = psc._gap_info(R._info, mask)
+        return R
+
+    def _read_dat(self, chas:int, chans:list, start=0, stop=None) -> numpy.ndarray:
+        """Decode (0-indexed) channels of one chassis as (len(chans), N) counts.
+        int32 if raw, otherwise float32 to be calibrated in place.
+        """
+        return self._stream(chas).get_chans(chans, start, stop, dtype='i4' if self._raw else 'f4')
+
+    def _stream(self, chas:int) -> psc.PacketStream:
+        """Packet stream of a chassis, spanning all of its .dat files
+        """
         datfiles, = [chassis['Dat'] for chassis in self._json['Chassis'] if chassis['Chassis']==chas]
 
-        if len(datfiles)>1:
-            _log.warning('.dat file concat not implemented, ignoring additional files: %r', datfiles[1:])
+        def load():
+            parts, names = [], []
+            for datfile in datfiles:
+                segs = self._load_dat(datfile)
+                parts += segs
+                names += [datfile]*len(segs)
+            return psc.PacketStream(parts, names, gaps=self._gaps)
 
-        with open(self._base / datfiles[0], 'rb') as F:
-            pkts = psc.read_dat(F) # TODO: cache most recently opened file
+        # One entry for all files of the chassis, so that continuity between
+        # files is checked, and gaps located, once per stream rather than per read.
+        return self._cache.get((chas, tuple(datfiles)), load)
 
-            F32 = psc.get_chan(pkts, chan-1)
+    def _gap_mask(self, chas:int, start=0, stop=None):
+        return self._stream(chas).gap_mask(start, stop) if self._gaps else None
 
-        F32 *= slope
-        F32 += offset
-        F32 = F32.view(DataChannel)
-        F32._info = info
-        return F32
+    def _load_dat(self, datfile: str) -> [numpy.ndarray]:
+        with open(self._base / datfile, 'rb') as F:
+            return psc.read_segments(F, gaps=self._gaps)
@@ -0,0 +1,207 @@
+"""Per-channel statistics in one streaming pass
+
+Reductions are made on blocks of uncalibrated counts where available,
+so each .dat file is decoded once, and memory use is bounded by the block size.
+Calibration is applied to the final results.
+
+>>> from quartz.stats import stats
+>>> for S in stats('some.hdr', peak=1.0, bins=numpy.linspace(-10, 10, 101)):
+...     print(S.name, S.min, S.max, S.rms, S.peaks, S.clipped)
+"""
+
+import math
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy
+
+from . import DataSet, _open_counts
+
+__all__ = (
+    'Stats',
+    'stats',
+    'file_stats',
+)
+
+# I24 sample limits
+_full_scale = (-(1<<23), (1<<23)-1)
+
+Stats = namedtuple('Stats', ['name', 'count', 'min', 'max', 'mean', 'rms', 'std', 'peaks', 'clipped', 'hist'])
+Stats.__doc__ = """Statistics of one channel, in calibrated units.
+
+count excludes placeholders for missing packets.
+peaks is the number of samples with magnitude >= peak, or None.
+clipped is the number of samples at I24 full scale, or with magnitude >= full_scale, or None.
+hist is an array of counts in each bin, or None.
+"""
+
+class _Accum:
+    """Accumulate one channel from successive blocks
+    """
+    def __init__(self, info:dict, counts:bool, bins=None, peak=None, full_scale=None):
+        self.name = info.get('id1')
+        # map from calibrated values to values being accumulated
+        self.slope, self.intercept = (info['slope'], info['intercept']) if counts else (1.0, 0.0)
+        self.counts = counts
+        self.n = 0
+        self.sum = 0 # int if counts
+        self.sumsq = 0.0
+        self.min = self.max = None
+
+        self.peak = None
+        if peak is not None:
+            self.peak = sorted(self._uncal(numpy.asarray([peak, -peak], dtype='f8')))
+            self.npeak = 0
+
+        self.clip = None
+        if counts:
+            self.clip = _full_scale
+        elif full_scale is not None:
+            self.clip = (-full_scale, full_scale)
+        self.nclip = 0
+
+        self.hist = None
+        if bins is not None:
+            edges = self._uncal(numpy.asarray(bins, dtype='f8'))
+            self.flip = edges[0] > edges[-1]
+            if self.flip:
+                edges = edges[::-1]
+            D = numpy.diff(edges)
+            if numpy.allclose(D, D[0]): # uniform, use fast path
+                self.edges = (len(D), (edges[0], edges[-1]))
+            else:
+                self.edges = (edges, None)
+            self.hist = numpy.zeros(len(D), dtype='i8')
+
+    def _uncal(self, V):
+        return (V - self.intercept)/self.slope
+
+    def update(self, C:numpy.ndarray):
+        if len(C)==0:
+            return
+        self.n += len(C)
+        if self.counts:
+            self.sum += int(C.sum(dtype='i8'))
+        else:
+            self.sum += float(C.sum(dtype='f8'))
+        F = C.astype('f8')
+        self.sumsq += float(numpy.dot(F, F))
+        del F
+
+        lo, hi = C.min(), C.max()
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+        if self.peak is not None:
+            self.npeak += int(numpy.count_nonzero(C <= self.peak[0])) + int(numpy.count_nonzero(C >= self.peak[1]))
+        if self.clip is not None:
+            self.nclip += int(numpy.count_nonzero(C <= self.clip[0])) + int(numpy.count_nonzero(C >= self.clip[1]))
+        if self.hist is not None:
+            self.hist += numpy.histogram(C, bins=self.edges[0], range=self.edges[1])[0]
+
+    def result(self) -> Stats:
+        s, b = self.slope, self.intercept
+        if self.n==0:
+            mean = rms = std = lo = hi = math.nan
+        else:
+            # mean and mean square of counts
+            mc, msq = self.sum/self.n, self.sumsq/self.n
+            mean = s*mc + b
+            rms = math.sqrt(max(0.0, s*s*msq + 2*s*b*mc + b*b))
+            std = abs(s)*math.sqrt(max(0.0, msq - mc*mc))
+            lo, hi = sorted((float(self.min)*s + b, float(self.max)*s + b))
+
+        hist = self.hist
+        if hist is not None and self.flip:
+            hist = hist[::-1].copy()
+
+        return Stats(
+            name=self.name,
+            count=self.n,
+            min=lo,
+            max=hi,
+            mean=mean,
+            rms=rms,
+            std=std,
+            peaks=None if self.peak is None else self.npeak,
+            clipped=None if self.clip is None else self.nclip,
+            hist=hist,
+        )
+
+def stats(src, key='*', block=1<<20, bins=None, peak=None, full_scale=None, workers=None, **kws) -> [Stats]:
+    """Compute statistics of all matching channels in one pass
+
+    Quartz .hdr and HDF5 files are opened with raw=True by default,
+    so that reductions are made on counts.
+
+    :param src: DataSet, or file name passed to quartz.open() with kws.
+                gaps=True applies only to .hdr and .dat files.
+    :param key: Dataset selection.  Default all.
+    :param block: Number of samples read at a time.
+    :param bins: Histogram bin edges, in calibrated units.  Default no histogram.
+    :param peak: Count samples with magnitude >= peak, in calibrated units.  Default not counted.
+    :param full_scale: For channels without counts, count samples with magnitude >= full_scale
+                       as clipped.  Channels with counts are clipped at the I24 limits.
+    :param workers: Number of threads to process independent groups of channels
+                    (eg. chassis) concurrently.  Default serial.
+    :returns: List of Stats for each matching channel
+    """
+    if not isinstance(src, DataSet):
+        with _open_counts(src, **kws) as S:
+            return stats(S, key=key, block=block, bins=bins, peak=peak,
+                         full_scale=full_scale, workers=workers)
+
+    idxs = src._lookup_set(key, first=False)
+    if isinstance(idxs, int):
+        idxs = [idxs]
+
+    def job(group):
+        acc = None
+        N = max(src._npoints(idx) for idx in group)
+        for start in range(0, N, block):
+            Cs = src._read_sets(group, start, start+block)
+            if acc is None:
+                acc = [_Accum(C._info, C.dtype.kind=='i' and 'slope' in C._info,
+                              bins=bins, peak=peak, full_scale=full_scale) for C in Cs]
+            for A, C in zip(acc, Cs):
+                mask = C._info.get('gap_mask')
+                C = C.view(numpy.ndarray)
+                if mask is not None: # exclude placeholders
+                    C = C[~mask]
+                A.update(C)
+        if acc is None: # all empty
+            acc = [_Accum(src._index[idx].info, False, bins=bins, peak=peak, full_scale=full_scale)
+                   for idx in group]
+        return [A.result() for A in acc]
+
+    groups = src._group_sets(idxs)
+    if workers is None or workers<=1 or len(groups)<=1:
+        results = map(job, groups)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(job, groups))
+
+    R = {}
+    for group, Ss in zip(groups, results):
+        R.update(zip(group, Ss))
+    return [R[idx] for idx in idxs]
+
+def _file_job(args):
+    fname, kws = args
+    return stats(fname, **kws)
+
+def file_stats(files, processes=None, **kws):
+    """Compute statistics of several files, optionally in parallel processes.
+
+    :param files: File names
+    :param processes: Number of processes.  Default serial.
+    :param kws: Passed to stats()
+    :returns: Iterator of (file name, [Stats]), in order
+    """
+    jobs = [(fname, kws) for fname in files]
+    if processes is None or processes<=1 or len(jobs)<=1:
+        results = map(_file_job, jobs)
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(_file_job, jobs))
+    return zip(files, results)
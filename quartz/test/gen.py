@@ -0,0 +1,81 @@
+"""Synthetic Quartz .dat packet streams for tests
+"""
+
+import numpy
+
+from .. import psc
+
+def chan_value(chan: int, n) -> numpy.ndarray:
+    """Expected (signed 24-bit) sample value of channel 'chan' at global sample 'n'
+    """
+    n = numpy.asarray(n, dtype='i8')
+    return ((n*(chan+1)*7919 + chan*104729) % (1<<24)) - (1<<23)
+
+def make_packets(npkt: int, nsamp=14, msgid=0x4e42, seq0=0,
+                 t0=1715701765.0, fsamp=50000.0, chmask=0xffffffff) -> numpy.ndarray:
+    """Build a packet stream with 'nsamp' samples per channel per packet.
+    """
+    chans = list(psc._chan_map(chmask))
+    # body header length following 'blen'
+    blen = {0x4e41:24, 0x4e42:40}[msgid] + 3*len(chans)*nsamp
+    T = psc._msg_layout(msgid, blen, chmask)
+
+    P = numpy.zeros(npkt, dtype=T)
+    P['ps'] = 0x5053
+    P['msgid'] = msgid
+    P['blen'] = blen
+    P['chmask'] = chmask
+    seq = numpy.arange(npkt, dtype='u8') + seq0
+    P['seq'] = seq
+
+    T0 = int(t0*1e9) + (seq*nsamp*1e9/fsamp).astype('i8')
+    P['sec'], P['ns'] = numpy.divmod(T0, 1000000000)
+    P['rsec'], P['rns'] = P['sec'], P['ns']
+
+    n = (seq.astype('i8')[:,None]*nsamp + numpy.arange(nsamp)[None,:]) # (npkt, nsamp)
+    for i, c in enumerate(chans):
+        V = chan_value(c, n) & 0xffffff
+        P['samp'][:,:,i,0] = (V>>16) & 0xff
+        P['samp'][:,:,i,1] = (V>>8) & 0xff
+        P['samp'][:,:,i,2] = V & 0xff
+    return P
+
+def write_dat(fname, P: numpy.ndarray):
+    with open(fname, 'wb') as F:
+        F.write(P.tobytes())
+
+def write_hdr(fname, chassis: dict, fsamp=50000.0, slope=0.5, intercept=1.0, jfiles={}):
+    """Write a .hdr JSON file for the .dat files in {chassis#: ['file.dat', ...]}
+    with signals named 'CH<chassis>-<channel>' (1-indexed channel).
+    jfiles maps signal name to .j file name.
+    """
+    import json
+    signals = []
+    for chas in chassis:
+        for chan in range(1, 33):
+            signals.append({
+                'Address': {'Chassis': chas, 'Channel': chan},
+                'Name': f'CH{chas}-{chan}',
+                'Desc': f'Chassis {chas} channel {chan}',
+                'Egu': 'V',
+                'Slope': slope,
+                'Intercept': intercept,
+            })
+            if signals[-1]['Name'] in jfiles:
+                signals[-1]['OutDataFile'] = jfiles[signals[-1]['Name']]
+    with open(fname, 'w') as F:
+        json.dump({
+            'AcquisitionId': 'synth',
+            'SampleRate': fsamp,
+            'Signals': signals,
+            'Chassis': [{'Chassis': chas, 'Dat': dats} for chas, dats in chassis.items()],
+        }, F, indent=2)
+
+def write_j(fname, counts: numpy.ndarray):
+    """Write a version 1 .j channel file of int32 counts
+    """
+    import struct
+    counts = numpy.asarray(counts, dtype='<i4')
+    with open(fname, 'wb') as F:
+        F.write(struct.pack('<IIIQ', 1, 0, 0, counts.nbytes))
+        F.write(counts.tobytes())
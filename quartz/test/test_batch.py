@@ -0,0 +1,115 @@
+import json
+import unittest
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy
+
+from .. import open as qopen
+from ..batch import find_files, run, main
+from . import gen
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        (self.dir / 'run').mkdir()
+        gen.write_dat(self.dir / 'run' / 'a.dat', gen.make_packets(100))
+        P = gen.make_packets(90)
+        gen.write_dat(self.dir / 'run' / 'b.dat', P[P['seq']!=20])
+        gen.write_hdr(self.dir / 'run' / 'synth.hdr', {1: ['a.dat'], 2: ['b.dat']})
+        (self.dir / 'run' / 'bad.dat').write_bytes(b'\0'*10)
+
+    def test_find(self):
+        F = find_files([self.dir], ('.dat',))
+        self.assertListEqual([str(R) for _P, R in F], ['run/a.dat', 'run/b.dat', 'run/bad.dat'])
+
+    def test_check(self):
+        R = {Path(r['file']).name: r for r in run('check', find_files([self.dir / 'run'], ('.dat', '.hdr')), processes=2)}
+        self.assertEqual(len(R), 4)
+
+        self.assertTrue(R['a.dat']['ok'])
+        self.assertDictEqual(R['a.dat']['result'],
+                             {'packets': 100, 'missing': 0, 'gaps': 0, 'segments': 1, 'trailing': 0})
+        self.assertEqual(R['b.dat']['result']['missing'], 1)
+        self.assertEqual(R['b.dat']['bytes'], 89*gen.make_packets(1).itemsize)
+        self.assertIn('MBps', R['b.dat'])
+        self.assertEqual(R['synth.hdr']['result']['chassis']['2']['gaps'], 1)
+
+        self.assertFalse(R['bad.dat']['ok'])
+        self.assertIn('error', R['bad.dat'])
+
+    def test_fix(self):
+        out = self.dir / 'fixed'
+        R = {Path(r['file']).name: r for r in run('fix', [self.dir / 'run' / 'a.dat', self.dir / 'run' / 'b.dat'],
+                                                  outdir=str(out))}
+        self.assertDictEqual(R['a.dat']['result'], {'fixed': False})
+        self.assertTrue(R['b.dat']['result']['fixed'])
+        self.assertEqual(R['b.dat']['result']['missing'], 1)
+
+        R, = run('check', [out / 'b.dat'])
+        self.assertEqual(R['result']['packets'], 90)
+        self.assertEqual(R['result']['missing'], 0)
+
+    def test_disorder(self):
+        P = gen.make_packets(10)
+        gen.write_dat(self.dir / 'd.dat', P[[0, 1, 2, 1, 2, 5, 6]])
+        I, = run('info', [self.dir / 'd.dat'])
+        self.assertTrue(I['ok'])
+        self.assertEqual(I['result']['disorder'], 1)
+        F, = run('fix', [self.dir / 'd.dat'], outdir=str(self.dir / 'fixed'))
+        self.assertFalse(F['ok'])
+        self.assertIn('sequence', F['error'])
+
+    def test_fix_mirror(self):
+        for d in ('r1/x', 'r2/x'):
+            (self.dir / d).mkdir(parents=True)
+            P = gen.make_packets(50)
+            gen.write_dat(self.dir / d / 'a.dat', P[P['seq']!=10])
+        out = self.dir / 'fixed'
+
+        # same relative path from two roots
+        R = list(run('fix', find_files([self.dir / 'r1', self.dir / 'r2'], ('.dat',)), processes=2, outdir=str(out)))
+        self.assertEqual(len(R), 2)
+        for r in R:
+            self.assertFalse(r['ok'])
+            self.assertIn('output path', r['error'])
+        self.assertFalse(out.exists())
+
+        # directory structure below the root is kept
+        R = {r['file']: r for r in run('fix', find_files([self.dir / 'r1', self.dir / 'r2' / 'x'], ('.dat',)),
+                                       processes=2, outdir=str(out))}
+        self.assertEqual(R[str(self.dir / 'r1' / 'x' / 'a.dat')]['result']['output'], str(out / 'x' / 'a.dat'))
+        self.assertEqual(R[str(self.dir / 'r2' / 'x' / 'a.dat')]['result']['output'], str(out / 'a.dat'))
+
+    def test_main(self):
+        out = StringIO()
+        with patch('sys.stdout', out):
+            ret = main(['info', '-j', '1', '--gaps', '-s', '.hdr', str(self.dir)])
+        self.assertEqual(ret, 0)
+        L = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(L), 2)
+        self.assertEqual(L[0]['result']['signals'], 64)
+        self.assertEqual(L[0]['result']['npoints'], 1400)
+        self.assertTrue(L[1]['summary'])
+        self.assertEqual(L[1]['files'], 1)
+        self.assertEqual(L[1]['failed'], 0)
+
+    def test_convert_uff(self):
+        out = self.dir / 'uff'
+        R, = run('convert', [self.dir / 'run' / 'synth.hdr'], outdir=str(out), format='uff', gaps=True)
+        self.assertTrue(R['ok'], R.get('error'))
+        self.assertEqual(R['result']['signals'], 64)
+
+        with qopen(self.dir / 'run' / 'synth.hdr') as Q, qopen(out / 'synth.uff') as U:
+            numpy.testing.assert_allclose(U['CH1-3'], Q['CH1-3'], rtol=1e-6)
+
+        # outdir is the input directory
+        size = (out / 'synth.uff').stat().st_size
+        R, = run('convert', [out / 'synth.uff'], outdir=str(out), format='uff')
+        self.assertFalse(R['ok'])
+        self.assertIn('overwrite', R['error'])
+        self.assertEqual((out / 'synth.uff').stat().st_size, size)
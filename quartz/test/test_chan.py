@@ -2,7 +2,7 @@ import unittest
 
 import numpy
 
-from .. import DataChannel
+from .. import DataChannel, RawChannel
 
 class TestChan(unittest.TestCase):
     def setUp(self):
@@ -25,8 +25,80 @@ class TestChan(unittest.TestCase):
         assert x.abscissa_inc==self.t[1]-self.t[0]
         assert x.shape==(127,)
 
+    def test_slice_exact(self):
+        # boundaries at exact sample times include the first, and exclude the last
+        x = numpy.zeros(1000).view(DataChannel)
+        for amin in (0.0, 1715701765.0):
+            x._info = {'abscissa_min': amin, 'abscissa_inc': 1/50000}
+            x._abscissa = None
+            t = x.time
+            for k in range(0, 990):
+                S = x.slice(t[k], t[k+10])
+                self.assertEqual(S.shape, (10,), k)
+                self.assertEqual(S.abscissa_min, t[k], k)
+
     def test_decimate(self):
         x = self.x.decimate(2)
         assert x.abscissa_inc==(self.t[1]-self.t[0])*2
         assert x.abscissa_min==self.t[0]
         assert x.shape==(128,)
+
+class TestRawChan(unittest.TestCase):
+    def setUp(self):
+        x = self.x = numpy.asarray([5, -3, 10, 0, 7], dtype='i4').view(RawChannel)
+        x._info = {
+            'abscissa_min': 0.0,
+            'abscissa_inc': 0.5,
+            'slope': -0.25,
+            'intercept': 1.0,
+        }
+        self.cal = numpy.asarray([5, -3, 10, 0, 7])*-0.25 + 1.0
+
+    def test_calibrate(self):
+        for dtype in ('f8', 'f4'):
+            C = self.x.calibrate(dtype)
+            self.assertNotIsInstance(C, RawChannel)
+            self.assertEqual(C.dtype, numpy.dtype(dtype))
+            numpy.testing.assert_array_equal(C, self.cal)
+            self.assertEqual(C.abscissa_inc, 0.5)
+        numpy.testing.assert_array_equal(self.x.counts, [5, -3, 10, 0, 7])
+
+    def test_arith(self):
+        numpy.testing.assert_array_equal(self.x*2, self.cal*2)
+        numpy.testing.assert_array_equal(self.x > 0, self.cal > 0)
+        self.assertEqual((self.x + 1).dtype, numpy.dtype('f8'))
+        self.assertAlmostEqual(self.x.mean(), self.cal.mean())
+        with self.assertRaises(TypeError):
+            numpy.add(self.x, 1, out=self.x)
+
+    def test_extrema(self):
+        self.assertEqual(self.x.max(), self.cal.max())
+        self.assertEqual(self.x.min(), self.cal.min())
+        self.assertEqual(self.x.slice(1.0, 2.0).max(), self.cal[2:4].max())
+
+    def test_item(self):
+        self.assertIsInstance(self.x[2], numpy.float64)
+        self.assertEqual(self.x[2], self.cal[2])
+        self.assertEqual(self.x[self.x.argmax()], self.x.max())
+        self.assertEqual(self.x[self.x.argmin()], self.x.min())
+        self.assertListEqual(list(self.x), list(self.cal))
+        self.assertEqual(self.x.item(2), 10)
+        self.assertEqual(repr(self.x), 'RawChannel([ 5, -3, 10,  0,  7], dtype=int32)')
+
+    def test_view(self):
+        V = self.x[1:3]
+        self.assertIsInstance(V, RawChannel)
+        numpy.testing.assert_array_equal(V*2, self.cal[1:3]*2)
+        self.assertEqual(V.max(), self.cal[1:3].max())
+        self.assertEqual(self.x.argmax(), self.cal.argmax())
+        self.assertEqual(self.x.argmin(), self.cal.argmin())
+
+    def test_gap_view(self):
+        x = numpy.asarray([5, -(1<<31), 10], dtype='i4').view(RawChannel)
+        x._info = dict(self.x._info, gap_mask=numpy.asarray([False, True, False]))
+        numpy.testing.assert_array_equal(x[1:].calibrate(), [numpy.nan, -1.5])
+        self.assertTrue(numpy.isnan(x.max()))
+        self.assertEqual(x[::2].argmax(), 0)
+        self.assertEqual(x.argmin(), 1) # NaN
+        self.assertTrue(numpy.isnan(x[1]))
+        self.assertEqual(x[2], -1.5)
@@ -0,0 +1,117 @@
+import unittest
+from pathlib import Path
+
+import numpy
+import scipy.signal as sig
+
+from .. import DataChannel
+from ..dsp import Decimator, Welch, Spectrogram, welch
+from ..uff import UFF
+
+_datadir = Path(__file__).parent
+
+def _blocks(x: DataChannel, sizes):
+    pos = 0
+    for n in sizes:
+        yield x.slice(x.time[pos], x.time[pos+n] if pos+n < x.shape[-1] else None)
+        pos += n
+
+class TestDecimator(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(42)
+        x = self.x = rng.normal(size=10000).astype('f4').view(DataChannel)
+        x._info = {
+            'abscissa_min': 1.5,
+            'abscissa_inc': 0.01,
+        }
+
+    def check(self, q, **kws):
+        ref = self.x.decimate(q, zero_phase=False, **kws)
+        out = list(Decimator(q, **kws).process(_blocks(self.x, [333, 1000, 7, 8660])))
+        Y = numpy.concatenate(out)
+        self.assertTupleEqual(Y.shape, ref.shape)
+        self.assertEqual(Y.dtype, ref.dtype)
+        # reference is computed in float32
+        numpy.testing.assert_allclose(Y, ref, rtol=0, atol=1e-4)
+        for B in out:
+            self.assertAlmostEqual(B.abscissa_inc, ref.abscissa_inc)
+            n = int(round((B.abscissa_min - ref.abscissa_min)/ref.abscissa_inc))
+            self.assertAlmostEqual(B.abscissa_min, ref.time[n])
+
+    def test_iir(self):
+        self.check(10)
+
+    def test_fir(self):
+        self.check(3, ftype='fir')
+
+    def test_gap(self):
+        D = Decimator(4)
+        D(self.x.slice(1.5, 2.5))
+        with self.assertRaises(ValueError):
+            D(self.x.slice(2.6, 3.0))
+
+class TestWelch(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(42)
+        x = self.x = rng.normal(size=(3, 10000)).view(DataChannel)
+        x[1] += x[0] # correlated
+        x._info = {
+            'abscissa_min': 1.5,
+            'abscissa_inc': 0.01,
+        }
+        self.x2 = x[2].view(DataChannel)
+        self.x2._info = x._info
+
+    def test_psd(self):
+        W = Welch(256, cross=True)
+        for blk in _blocks(self.x, [333, 1000, 7, 8660]):
+            W(blk)
+        f, P = W.psd()
+        fr, Pr = sig.welch(self.x.view(numpy.ndarray), fs=100.0, nperseg=256)
+        numpy.testing.assert_allclose(f, fr)
+        numpy.testing.assert_allclose(P, Pr)
+
+        _f, C = W.csd()
+        self.assertTupleEqual(C.shape, (3, 3, 129))
+        _fr, Cr = sig.csd(self.x[0].view(numpy.ndarray), self.x[1].view(numpy.ndarray), fs=100.0, nperseg=256)
+        numpy.testing.assert_allclose(C[0, 1], Cr)
+        numpy.testing.assert_allclose(C[1, 1].real, Pr[1])
+
+        _f, K = W.coherence()
+        _fr, Kr = sig.coherence(self.x[0].view(numpy.ndarray), self.x[2].view(numpy.ndarray), fs=100.0, nperseg=256)
+        numpy.testing.assert_allclose(K[0, 2], Kr)
+
+    def test_1d(self):
+        W = Welch(100, noverlap=0, window='hamming', detrend='linear', scaling='spectrum')
+        for blk in _blocks(self.x2, [5000, 5000]):
+            W(blk)
+        f, P = W.psd()
+        _fr, Pr = sig.welch(self.x2.view(numpy.ndarray), fs=100.0, nperseg=100, noverlap=0,
+                            window='hamming', detrend='linear', scaling='spectrum')
+        numpy.testing.assert_allclose(P, Pr)
+        with self.assertRaisesRegex(RuntimeError, 'cross'):
+            W.csd()
+
+    def test_spectrogram(self):
+        S = Spectrogram(128)
+        cols = [S(blk) for blk in _blocks(self.x2, [333, 1000, 7, 8660])]
+        t = numpy.concatenate([t for t, _P in cols])
+        P = numpy.concatenate([P for _t, P in cols])
+        fr, tr, Pr = sig.spectrogram(self.x2.view(numpy.ndarray), fs=100.0, nperseg=128)
+        numpy.testing.assert_allclose(t, tr + 1.5)
+        numpy.testing.assert_allclose(P, Pr.T)
+
+        S = Spectrogram(128, navg=4)
+        t, P = S(self.x)
+        self.assertTupleEqual(P.shape, (3, len(tr)//4, 65))
+        numpy.testing.assert_allclose(P[2, 1], Pr.T[4:8].mean(axis=0))
+        numpy.testing.assert_allclose(t[1], tr[4:8].mean() + 1.5)
+
+    def test_dataset(self):
+        with UFF(_datadir / 'Sample_UFF58b_bin.uff') as U:
+            W = welch(U, 'Mic*', 1024, block_samples=10000)
+            D = U[0]
+        f, P = W.psd()
+        fr, Pr = sig.welch(D.view(numpy.ndarray), fs=1/D.abscissa_inc, nperseg=1024)
+        numpy.testing.assert_allclose(f, fr)
+        numpy.testing.assert_allclose(P[0], Pr, rtol=1e-5)
@@ -0,0 +1,79 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy
+
+from .. import open as qopen, RawChannel
+from . import gen
+
+try:
+    from ..hdf5 import export, HDF5
+except ImportError:
+    HDF5 = None
+
+_datadir = Path(__file__).parent
+
+@unittest.skipIf(HDF5 is None, 'h5py not available')
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        gen.write_dat(self.dir / 'a.dat', gen.make_packets(100))
+        gen.write_dat(self.dir / 'b.dat', gen.make_packets(90))
+        gen.write_hdr(self.dir / 'synth.hdr', {1: ['a.dat'], 2: ['b.dat']})
+
+    def test_quartz(self):
+        progress = []
+        n = export(self.dir / 'synth.hdr', self.dir / 'synth.h5', key='CH*-[12]',
+                   chunks=100, block=250, compression='gzip',
+                   progress=lambda *P: progress.append(P))
+        self.assertEqual(n, 4)
+        self.assertTupleEqual(progress[-1], (2*1400 + 2*1260, 2*1400 + 2*1260))
+
+        with qopen(self.dir / 'synth.hdr') as Q, qopen(self.dir / 'synth.h5') as H:
+            self.assertIsInstance(H, HDF5)
+            self.assertListEqual([I['id1'] for I in H], ['CH1-1', 'CH1-2', 'CH2-1', 'CH2-2'])
+            for name in ('CH1-2', 'CH2-1'):
+                A, B = Q[name], H[name]
+                self.assertEqual(B.dtype, numpy.dtype('f4'))
+                numpy.testing.assert_array_equal(B, A)
+                self.assertEqual(B.abscissa_inc, A.abscissa_inc)
+                self.assertEqual(B.slope, 0.5)
+
+            A, B = Q['CH1-2', 0.001:0.002], H['CH1-2', 0.001:0.002]
+            numpy.testing.assert_array_equal(B, A)
+            self.assertAlmostEqual(B.abscissa_min, A.abscissa_min)
+
+        with qopen(self.dir / 'synth.h5', raw=True, lazy=True) as H:
+            C = H['CH2-2']
+            self.assertIsInstance(C, RawChannel)
+            self.assertEqual(C.dtype, numpy.dtype('i4'))
+            numpy.testing.assert_array_equal(C.counts, gen.chan_value(1, numpy.arange(1260)))
+
+    def test_gaps(self):
+        P = gen.make_packets(100)
+        gen.write_dat(self.dir / 'g.dat', P[P['seq']!=50])
+        gen.write_hdr(self.dir / 'gaps.hdr', {3: ['g.dat']})
+        export(self.dir / 'gaps.hdr', self.dir / 'gaps.h5', key='CH3-[12]', chunks=100, block=300, gaps=True)
+
+        ref = gen.chan_value(1, numpy.arange(1400))*0.5 + 1.0
+        ref[700:714] = numpy.nan
+        with qopen(self.dir / 'gaps.h5') as H:
+            B = H['CH3-2']
+            numpy.testing.assert_array_equal(B, ref.astype('f4'))
+            numpy.testing.assert_array_equal(B.gap_mask, numpy.isnan(ref))
+            self.assertFalse(hasattr(H['CH3-2', 0:0.01], 'gap_mask'))
+
+        with qopen(self.dir / 'gaps.h5', raw=True, lazy=True) as H:
+            numpy.testing.assert_array_equal(H['CH3-2'].calibrate(), ref)
+
+    def test_uff(self):
+        self.assertEqual(export(_datadir / 'Sample_UFF58b_bin.uff', self.dir / 'mic.h5', gaps=True), 1)
+        with qopen(_datadir / 'Sample_UFF58b_bin.uff') as U, qopen(self.dir / 'mic.h5') as H:
+            A, B = U['Mic*'], H['Mic*']
+            self.assertEqual(B.dtype, numpy.dtype('f4'))
+            numpy.testing.assert_array_equal(B, A)
+            self.assertEqual(B.respdir, 1)
+            self.assertEqual(B.egu, 'Pa')
@@ -0,0 +1,89 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy
+
+from .. import open as qopen
+from ..overview import overview, build
+from . import gen
+
+class TestOverview(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        P = gen.make_packets(100)
+        gen.write_dat(self.dir / 'a.dat', P[P['seq']!=30])
+        self.hdr = self.dir / 'synth.hdr'
+        gen.write_hdr(self.hdr, {1: ['a.dat']}, slope=-2e-6, intercept=0.5)
+        with qopen(self.hdr, gaps=True) as Q:
+            self.ref = Q['CH1-3'].view(numpy.ndarray).astype('f8')
+
+    def check(self, t, lo, hi, mean, i0, per):
+        ref = self.ref
+        self.assertAlmostEqual(t[0], i0/50000.0)
+        for n in range(len(lo)):
+            R = ref[i0+n*per:i0+(n+1)*per]
+            R = R[~numpy.isnan(R)]
+            if len(R)==0:
+                self.assertTrue(numpy.isnan(lo[n]))
+                continue
+            self.assertAlmostEqual(lo[n], R.min(), places=5)
+            self.assertAlmostEqual(hi[n], R.max(), places=5)
+            self.assertAlmostEqual(mean[n], R.mean(), places=4)
+
+    def test_overview(self):
+        O = overview(self.hdr, bin0=16, factor=4, block=100, gaps=True)
+        self.assertTrue(Path(f'{self.hdr}.ovw.npz').exists())
+        self.assertListEqual([L[0].shape for L in O.levels], [(32, 88), (32, 22), (32, 6), (32, 2), (32, 1)])
+
+        # coarse: level 1 bins of 64 samples, 3 bins per point
+        t, lo, hi, mean = O.envelope('CH1-3', width=10)
+        self.assertEqual(len(lo), 8)
+        self.check(t, lo, hi, mean, 0, 192)
+
+        # fine: level 0 bins of 16 samples, over the gap
+        t, lo, hi, mean = O.envelope('CH1-3', 400/50000.0, 480/50000.0, width=5)
+        self.check(t, lo, hi, mean, 400, 16)
+
+        # finer still, from samples
+        with qopen(self.hdr, gaps=True, raw=True) as Q:
+            t, lo, hi, mean = O.envelope('CH1-3', 100/50000.0, 140/50000.0, width=10, src=Q)
+        self.assertEqual(len(lo), 10)
+        self.check(t, lo, hi, mean, 100, 4)
+
+        with patch('quartz.overview.build', side_effect=AssertionError('not cached')):
+            O2 = overview(self.hdr, bin0=16, factor=4, gaps=True)
+        numpy.testing.assert_array_equal(O2.levels[1][0], O.levels[1][0])
+
+    def test_mean(self):
+        O = build(self.hdr, key='CH1-3', bin0=16, factor=4, gaps=True)
+        _t, _lo, _hi, mean = O.envelope(0, width=1)
+        self.assertAlmostEqual(mean[0], numpy.nanmean(self.ref), places=4)
+
+    def test_subset(self):
+        O = build(self.hdr, key='CH1-[34]', bin0=16, factor=4, gaps=True)
+        self.assertEqual(O._lookup_set('Chassis 1 channel 4'), 1) # by id2
+        with qopen(self.hdr, gaps=True, raw=True) as Q:
+            ref = Q['CH1-4'].view(numpy.ndarray)*-2e-6 + 0.5
+            _t, lo, hi, _mean = O.envelope(1, 0, 8/50000.0, width=2, src=Q)
+        self.assertAlmostEqual(lo[0], ref[:4].min(), places=5)
+        self.assertAlmostEqual(hi[1], ref[4:8].max(), places=5)
+
+    def test_stale(self):
+        O = overview(self.hdr, bin0=16, gaps=True)
+        with patch('quartz.overview.build', side_effect=AssertionError('not cached')):
+            overview(self.hdr, bin0=16, gaps=True, block=1000) # block does not change content
+
+        # rebuilt for different parameters
+        O2 = overview(self.hdr, bin0=32, gaps=True)
+        self.assertEqual(O2.meta['bin0'], 32)
+
+        # rebuilt when .dat changes
+        P = gen.make_packets(50)
+        gen.write_dat(self.dir / 'a.dat', P)
+        O3 = overview(self.hdr, bin0=32, gaps=True)
+        self.assertEqual(O3.meta['npoints'][0], 700)
+        self.assertNotEqual(O.meta['npoints'][0], 700)
@@ -1,7 +1,13 @@
 import unittest
 from pathlib import Path
+from tempfile import TemporaryDirectory
 
-from .. import psc, open as qopen
+import numpy
+
+from .. import psc, open as qopen, RawChannel
+from ..quartz import _PacketCache
+from ..dsp import Decimator
+from . import gen
 
 _datadir = Path(__file__).parent
 
@@ -39,6 +45,16 @@ class TestQuartz(unittest.TestCase):
         self.assertEqual(infos[1]['id1'], '514-BS02-DV02-CM2')
         self.assertEqual(len(infos), 32)
 
+    def test_lookup(self):
+        self.assertEqual(self.q._lookup_set('513-BS01-DV01-CM1'), 0)
+        self.assertEqual(self.q._lookup_set('Control Mic 1'), 0) # id2
+        # id1, id2 and id3 all match, yet each set appears once
+        self.assertListEqual(self.q._lookup_set('*', first=False), list(range(32)))
+        self.assertListEqual(self.q._lookup_set('51[34]-*', first=False), [0, 1])
+        self.assertListEqual(self.q._lookup_set('nosuch', first=False), [])
+        with self.assertRaisesRegex(ValueError, 'No such'):
+            self.q._lookup_set('nosuch')
+
     def test_set(self):
         D = self.q['*CM1']
         self.assertEqual(D.id1, '513-BS01-DV01-CM1')
@@ -48,3 +64,555 @@ class TestQuartz(unittest.TestCase):
 
         D = self.q[0]
         self.assertEqual(D.id1, '513-BS01-DV01-CM1')
+
+class TestSynthDat(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.fname = Path(self.tmp.name) / 'synth.dat'
+        gen.write_dat(self.fname, gen.make_packets(100))
+
+    def test_read_dat(self):
+        with open(self.fname, 'rb') as F:
+            D = psc.read_dat(F, chunk=16)
+        self.assertIsInstance(D, numpy.memmap)
+        self.assertTupleEqual(D['samp'].shape, (100, 14, 32, 3))
+        for c in (0, 5, 31):
+            numpy.testing.assert_array_equal(psc.get_chan(D, c),
+                                             gen.chan_value(c, numpy.arange(1400)))
+
+    def test_get_chans(self):
+        with open(self.fname, 'rb') as F:
+            D = psc.read_dat(F)
+        I = psc.get_chans(D, dtype='i4', chunk=7)
+        self.assertEqual(I.dtype, numpy.dtype('i4'))
+        self.assertTupleEqual(I.shape, (32, 1400))
+        for c in range(32):
+            numpy.testing.assert_array_equal(I[c], gen.chan_value(c, numpy.arange(1400)))
+
+        F = psc.get_chans(D, [7, 2])
+        self.assertEqual(F.dtype, numpy.dtype('f4'))
+        numpy.testing.assert_array_equal(F, I[[7, 2]])
+
+    def test_missing(self):
+        P = gen.make_packets(100)
+        gen.write_dat(self.fname, P[numpy.arange(100)!=40])
+        with open(self.fname, 'rb') as F:
+            with self.assertRaisesRegex(RuntimeError, 'missing packets'):
+                psc.read_dat(F, chunk=16)
+            F.seek(0)
+            D = psc.read_dat(F, check=False)
+        self.assertEqual(len(D), 99)
+
+    def test_headers(self):
+        P = gen.make_packets(100)
+        gen.write_dat(self.fname, P[numpy.arange(100)!=40])
+        with open(self.fname, 'rb') as F:
+            H = psc.read_headers(F, chunk=7)
+            self.assertEqual(F.tell(), 99*P.itemsize)
+            F.seek(0)
+            H2 = psc.read_headers(F, fields=('seq', 'lolo'), count=10)
+            F.seek(0)
+            I = psc.dat_info(F, chunk=7)
+
+        self.assertNotIn('samp', H.dtype.names)
+        self.assertEqual(H.dtype.itemsize, 56)
+        numpy.testing.assert_array_equal(H['seq'], P['seq'][numpy.arange(100)!=40])
+        numpy.testing.assert_array_equal(H['ns'], P['ns'][numpy.arange(100)!=40])
+        self.assertTupleEqual(H2.dtype.names, ('seq', 'lolo'))
+        numpy.testing.assert_array_equal(H2['seq'], numpy.arange(10))
+
+        self.assertEqual(I['msgid'], 0x4e42)
+        self.assertEqual(I['nchan'], 32)
+        self.assertEqual(I['samp_per_chan'], 14)
+        self.assertEqual(I['packets'], 99)
+        self.assertAlmostEqual(I['Fsamp'], 50000.0, places=2)
+        self.assertAlmostEqual(I['T0'], 1715701765.0)
+        self.assertEqual(len(I['gaps']), 1)
+        self.assertTupleEqual(I['gaps'][0][:3], (39, 39, 41))
+        self.assertListEqual(I['disorder'], [])
+
+        # reported, not raised
+        gen.write_dat(self.fname, P[[0, 1, 2, 1, 2, 5, 6]])
+        with open(self.fname, 'rb') as F:
+            I = psc.dat_info(F)
+        self.assertListEqual([W[:3] for W in I['gaps']], [(4, 2, 5)])
+        self.assertListEqual([W[:3] for W in I['disorder']], [(2, 2, 1)])
+        self.assertIsNone(I['Fsamp'])
+
+    def test_raw_gaps(self):
+        P = gen.make_packets(100)
+        gen.write_dat(self.fname, P[numpy.arange(100)!=40])
+        with qopen(self.fname, gaps=True) as F:
+            D = F[3]
+            self.assertAlmostEqual(1/D.abscissa_inc, 50000.0, places=2)
+            self.assertEqual(D.gap_mask.sum(), 14)
+            self.assertTrue(numpy.isnan(D[40*14:41*14]).all())
+
+    def test_raw_short(self):
+        # sample period can not be estimated from one packet
+        gen.write_dat(self.fname, gen.make_packets(1))
+        with self.assertRaisesRegex(ValueError, 'Too few packets'):
+            qopen(self.fname)
+
+    def test_raw(self):
+        with qopen(self.fname) as F:
+            self.assertAlmostEqual(1/F[0].abscissa_inc, 50000.0, places=2)
+            numpy.testing.assert_array_equal(F[3], gen.chan_value(3, numpy.arange(1400)))
+
+            D = F[3, 0.001:0.002]
+            numpy.testing.assert_array_equal(D, gen.chan_value(3, numpy.arange(50, 100)))
+            self.assertAlmostEqual(D.abscissa_min, 0.001)
+
+class TestTimeModel(unittest.TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.fname = Path(self.tmp.name) / 'jump.dat'
+        P = gen.make_packets(100)
+        P['sec'][60:] += 2 # clock jumps 2 seconds forward at packet 60
+        gen.write_dat(self.fname, P[numpy.arange(100)!=30])
+        self.T0 = int(P[0]['sec']) + int(P[0]['ns'])*1e-9
+
+    def test_model(self):
+        with open(self.fname, 'rb') as F:
+            S = psc.PacketStream(psc.read_segments(F, gaps=True), gaps=True)
+        M = S.time_model(chunk=16)
+        self.assertEqual(len(M), 2)
+        numpy.testing.assert_array_equal(M['sample'], [0, 60*14])
+        numpy.testing.assert_allclose(M['inc'], 2e-5, rtol=1e-6)
+        self.assertEqual(int(M[1]['sec']) - int(M[0]['sec']), 2)
+        del S
+
+    def test_abscissa(self):
+        with qopen(self.fname, gaps=True, abstime=True) as F:
+            self.assertEqual(len(F.time_model), 2)
+            D = F[3]
+            self.assertAlmostEqual(D.abscissa_min, self.T0)
+            t = D.time
+            self.assertAlmostEqual(t[840] - t[839], 2.0 + 2e-5, places=6)
+            self.assertAlmostEqual(t[1] - t[0], 2e-5, places=6)
+
+            # range spanning the jump
+            E = F[3, self.T0 + 0.01659:self.T0 + 2.01699]
+            numpy.testing.assert_array_equal(E, D[830:850])
+            numpy.testing.assert_allclose(E.time, t[830:850])
+            # range in the hole left by the jump ends at the jump
+            E = F[3, self.T0 + 0.01659:self.T0 + 1.0]
+            self.assertEqual(len(E), 10)
+
+            E = D.slice(self.T0 + 2.01699)
+            self.assertNotIn('abscissa_runs', E._info)
+            numpy.testing.assert_allclose(E.time, t[850:])
+
+            X = D.decimate(4)
+            numpy.testing.assert_allclose(X.time, t[::4])
+            Y = list(Decimator(4).process(F.iter_blocks(3, 301)))
+            numpy.testing.assert_allclose(numpy.concatenate([B.time for B in Y]), t[::4])
+
+        with qopen(self.fname, gaps=True) as F:
+            self.assertAlmostEqual(F[3].abscissa_min, 0.0)
+            self.assertAlmostEqual(F[3].time[840], 2.0 + 840*2e-5, places=6)
+
+class TestPacketStream(unittest.TestCase):
+    def setUp(self):
+        P = gen.make_packets(30)
+        self.S = psc.PacketStream([P[:10], P[10:11], P[11:]], ['a', 'b', 'c'])
+
+    def test_locate(self):
+        S = self.S
+        self.assertEqual(len(S), 30)
+        self.assertEqual(S.nsamp, 420)
+        self.assertEqual(S[10]['seq'], 10)
+        self.assertEqual(S[-1]['seq'], 29)
+        self.assertTupleEqual(S.locate(0), (0, 0, 0))
+        self.assertTupleEqual(S.locate(139), (0, 9, 13))
+        self.assertTupleEqual(S.locate(140), (1, 0, 0))
+        self.assertTupleEqual(S.locate(160), (2, 0, 6))
+        with self.assertRaises(IndexError):
+            S.locate(420)
+
+    def test_range(self):
+        I = self.S.get_chans([4, 0], dtype='i4')
+        numpy.testing.assert_array_equal(I[0], gen.chan_value(4, numpy.arange(420)))
+        numpy.testing.assert_array_equal(I[1], gen.chan_value(0, numpy.arange(420)))
+
+        for start, stop in [(0, 1), (5, 9), (130, 300), (139, 155), (400, 1000)]:
+            I = self.S.get_chans([4], start, stop, dtype='i4')
+            numpy.testing.assert_array_equal(I[0], gen.chan_value(4, numpy.arange(start, min(stop, 420))))
+
+    def test_discontinuous(self):
+        P = gen.make_packets(30)
+        with self.assertRaisesRegex(RuntimeError, 'b does not continue a'):
+            psc.PacketStream([P[:10], P[11:]], ['a', 'b'])
+
+class TestGaps(unittest.TestCase):
+    def setUp(self):
+        P = gen.make_packets(30)
+        self.P = P[(numpy.arange(30)<5) | (numpy.arange(30)>=8)] # drop 5, 6, 7
+        self.ref = gen.chan_value(3, numpy.arange(420)).astype('f4')
+        self.ref[5*14:8*14] = numpy.nan
+
+    def test_get_chan(self):
+        with self.assertRaisesRegex(RuntimeError, 'missing packets'):
+            psc.check_dat(self.P)
+        numpy.testing.assert_array_equal(psc.check_dat(self.P, chunk=4, gaps=True), [4])
+        numpy.testing.assert_array_equal(psc.find_gaps(self.P, chunk=4), [4])
+
+        C = psc.get_chan(self.P, 3, gaps=True)
+        numpy.testing.assert_array_equal(C, self.ref)
+        M = psc.gap_mask(self.P)
+        numpy.testing.assert_array_equal(M, numpy.isnan(self.ref))
+
+    def test_stream(self):
+        P = self.P
+        S = psc.PacketStream([P[:3], P[3:20], P[21:]], ['a', 'b', 'c'], gaps=True)
+        self.assertEqual(len(S), 30)
+        self.assertIsNone(S[6])
+        self.assertEqual(S[25]['seq'], 25)
+        self.assertTupleEqual(S.locate(5*14+1), (None, 0, 1))
+        self.assertTupleEqual(S.locate(8*14), (1, 2, 0))
+        self.assertListEqual(S.missing(), [(70, 112), (23*14, 24*14)])
+
+        ref = self.ref.copy()
+        ref[23*14:24*14] = numpy.nan
+        numpy.testing.assert_array_equal(S.get_chans([3])[0], ref)
+        numpy.testing.assert_array_equal(S.get_chans([3], 60, 120)[0], ref[60:120])
+        numpy.testing.assert_array_equal(S.gap_mask(60, 120), numpy.isnan(ref[60:120]))
+
+        I = S.get_chans([3], dtype='i4')[0]
+        self.assertTrue(numpy.all(I[numpy.isnan(ref)]==numpy.iinfo('i4').min))
+
+        with self.assertRaisesRegex(RuntimeError, 'c does not continue b'):
+            psc.PacketStream([P[:3], P[3:20], P[21:]], ['a', 'b', 'c'])
+        with self.assertRaisesRegex(RuntimeError, 'not increasing'):
+            psc.PacketStream([P[[0, 1, 3, 2]]], gaps=True)
+
+class TestLayout(unittest.TestCase):
+    def setUp(self):
+        # channels 1, 4, and 30 only.  Then msgid and mask change part way through
+        self.mask = (1<<1) | (1<<4) | (1<<30)
+        self.P = [gen.make_packets(10, chmask=self.mask),
+                  gen.make_packets(5, seq0=10, msgid=0x4e41, chmask=self.mask),
+                  gen.make_packets(15, seq0=15)]
+
+    def test_mask(self):
+        P = self.P[0]
+        self.assertTupleEqual(P['samp'].shape, (10, 14, 3, 3))
+        I = psc.get_chans(P, dtype='i4')
+        self.assertTupleEqual(I.shape, (3, 140))
+        numpy.testing.assert_array_equal(I[2], gen.chan_value(30, numpy.arange(140)))
+        numpy.testing.assert_array_equal(psc.get_chan(P, 4), gen.chan_value(4, numpy.arange(140)))
+        with self.assertRaisesRegex(ValueError, 'not in mask'):
+            psc.get_chan(P, 3)
+
+        # default channels are those in the mask, with or without gaps
+        G = psc.get_chans(P[P['seq']!=4], dtype='i4', gaps=True)
+        self.assertTupleEqual(G.shape, (3, 140))
+        numpy.testing.assert_array_equal(G[:, 4*14:5*14], numpy.iinfo('i4').min)
+        numpy.testing.assert_array_equal(G[2, 5*14:], I[2, 5*14:])
+        self.assertTupleEqual(psc.get_chans(P[:0]).shape, (3, 0))
+
+    def test_segments(self):
+        with TemporaryDirectory() as tmp:
+            fname = Path(tmp) / 'mixed.dat'
+            with open(fname, 'wb') as F:
+                for P in self.P:
+                    F.write(P.tobytes())
+
+            with open(fname, 'rb') as F:
+                with self.assertRaisesRegex(RuntimeError, 'layout changes at 10'):
+                    psc.read_dat(F, chunk=4)
+                F.seek(0)
+                segs = psc.read_segments(F, chunk=4)
+                F.seek(0)
+                H = psc.read_headers(F, fields=('seq', 'lolo'), chunk=4)
+                F.seek(0)
+                I = psc.dat_info(F)
+
+            self.assertListEqual([len(S) for S in segs], [10, 5, 15])
+            numpy.testing.assert_array_equal(H['seq'], numpy.arange(30))
+            numpy.testing.assert_array_equal(H['lolo'][10:15], 0)
+            self.assertEqual(I['segments'], 3)
+            self.assertEqual(I['packets'], 30)
+            self.assertEqual(I['nchan'], 3)
+            self.assertEqual(len(I['gaps']), 0)
+
+            S = psc.PacketStream(segs)
+            C = S.get_chans([4, 7], dtype='f4')
+            del segs, S
+
+        numpy.testing.assert_array_equal(C[0], gen.chan_value(4, numpy.arange(420)))
+        ref = gen.chan_value(7, numpy.arange(420)).astype('f4')
+        ref[:15*14] = numpy.nan
+        numpy.testing.assert_array_equal(C[1], ref)
+
+    def test_fix(self):
+        with TemporaryDirectory() as tmp:
+            fname = Path(tmp) / 'mixed.dat'
+            with open(fname, 'wb') as F:
+                F.write(self.P[0].tobytes())
+                F.write(self.P[1][[0, 1, 3, 4]].tobytes())
+                F.write(self.P[2][1:].tobytes()) # gap at layout change
+
+            with open(fname, 'rb') as F, open(Path(tmp) / 'out.dat', 'wb') as O:
+                R = psc.fix_dat(F, O, chunk=4)
+            self.assertEqual((R.packets, R.missing, R.gaps), (28, 2, 2))
+            self.assertEqual(R.nbytes, R.total)
+
+            with open(Path(tmp) / 'out.dat', 'rb') as F:
+                segs = psc.read_segments(F)
+            # placeholder before the gap has the earlier layout
+            self.assertListEqual([len(S) for S in segs], [10, 6, 14])
+            S = psc.PacketStream(segs)
+            numpy.testing.assert_array_equal(S.get_chans([4], dtype='i4')[0, :10*14],
+                                             gen.chan_value(4, numpy.arange(140)))
+            del segs, S
+
+class TestFix(unittest.TestCase):
+    def test_fix(self):
+        with TemporaryDirectory() as tmp:
+            P = gen.make_packets(100)
+            keep = numpy.ones(100, dtype='?')
+            keep[[15, 16, 40, 41, 42, 43, 44, 90]] = False
+            gen.write_dat(Path(tmp) / 'in.dat', P[keep])
+
+            progress = []
+            with open(Path(tmp) / 'in.dat', 'rb') as F, open(Path(tmp) / 'out.dat', 'wb') as O:
+                R = psc.fix_dat(F, O, chunk=16, progress=progress.append)
+
+            self.assertEqual((R.packets, R.missing, R.gaps), (92, 8, 3))
+            self.assertEqual(len(progress), 6)
+            self.assertEqual(R.nbytes, R.total)
+            self.assertIn('8 missing in 3 gaps', str(R))
+
+            with open(Path(tmp) / 'out.dat', 'rb') as F:
+                D = psc.read_dat(F)
+                numpy.testing.assert_array_equal(D['seq'], numpy.arange(100))
+                numpy.testing.assert_array_equal(D['sec'], P['sec'])
+                numpy.testing.assert_array_equal(D['ns']//1000, P['ns']//1000)
+                C = psc.get_chan(D, 2)
+
+        ref = gen.chan_value(2, numpy.arange(1400))
+        mask = numpy.repeat(~keep, 14)
+        numpy.testing.assert_array_equal(C[~mask], ref[~mask])
+        self.assertTrue(numpy.all(C[mask]==0x7f7f7f))
+
+class TestSynthQuartz(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        gen.write_dat(self.dir / 'a.dat', gen.make_packets(100))
+        gen.write_hdr(self.dir / 'synth.hdr', {1: ['a.dat']})
+        self.q = qopen(self.dir / 'synth.hdr')
+        self.addCleanup(self.q.close)
+
+    def test_set(self):
+        D = self.q['CH1-3']
+        self.assertEqual(D.dtype, numpy.dtype('f4'))
+        numpy.testing.assert_array_equal(D, gen.chan_value(2, numpy.arange(1400))*0.5 + 1.0)
+
+    def test_sets(self):
+        S = self.q.sets('CH1-1*')
+        self.assertListEqual([D.id1 for D in S], ['CH1-1'] + [f'CH1-{n}' for n in range(10, 20)])
+        for D in S:
+            self.assertEqual(D.dtype, numpy.dtype('f4'))
+            chan = int(D.id1.split('-')[1]) - 1
+            numpy.testing.assert_array_equal(D, gen.chan_value(chan, numpy.arange(1400))*0.5 + 1.0)
+
+    def test_range(self):
+        inc = 1/50000.0
+        D = self.q['CH1-3', 100*inc:150.5*inc]
+        self.assertTupleEqual(D.shape, (51,))
+        self.assertAlmostEqual(D.abscissa_min, 100*inc)
+        numpy.testing.assert_array_equal(D, gen.chan_value(2, numpy.arange(100, 151))*0.5 + 1.0)
+
+        S = self.q.sets('CH1-?', end=20*inc)
+        self.assertEqual(len(S), 9)
+        for D in S:
+            self.assertEqual(D.abscissa_min, 0.0)
+            self.assertTupleEqual(D.shape, (20,))
+
+    def test_j(self):
+        counts = numpy.arange(-500, 500, dtype='i4')
+        gen.write_j(self.dir / 'x.j', counts)
+        gen.write_hdr(self.dir / 'j.hdr', {1: ['a.dat']}, jfiles={'CH1-4': 'x.j'})
+        with qopen(self.dir / 'j.hdr') as Q:
+            numpy.testing.assert_array_equal(Q['CH1-4'], counts*0.5 + 1.0)
+            D = Q['CH1-4', 10/50000.0:20/50000.0]
+            numpy.testing.assert_array_equal(D, counts[10:20]*0.5 + 1.0)
+            S = Q.sets('CH1-[345]', start=10/50000.0)
+            numpy.testing.assert_array_equal(S[1], counts[10:]*0.5 + 1.0)
+            numpy.testing.assert_array_equal(S[0], gen.chan_value(2, numpy.arange(10, 1400))*0.5 + 1.0)
+
+    def test_blocks(self):
+        B = list(self.q.iter_blocks('CH1-3', 500, overlap=100))
+        self.assertListEqual([len(D) for D in B], [500, 500, 500, 200])
+        for n, D in enumerate(B):
+            self.assertAlmostEqual(D.abscissa_min, n*400/50000.0)
+            numpy.testing.assert_array_equal(D, gen.chan_value(2, numpy.arange(n*400, n*400+len(D)))*0.5 + 1.0)
+
+        counts = numpy.arange(1000, dtype='i4')
+        gen.write_j(self.dir / 'x.j', counts)
+        gen.write_hdr(self.dir / 'j.hdr', {1: ['a.dat']}, jfiles={'CH1-4': 'x.j'})
+        with qopen(self.dir / 'j.hdr') as Q:
+            B = list(Q.iter_blocks('CH1-4', 300, start=100/50000.0))
+        self.assertListEqual([len(D) for D in B], [300, 300, 300])
+        numpy.testing.assert_array_equal(numpy.concatenate(B), counts[100:]*0.5 + 1.0)
+
+        with qopen(self.dir / 'j.hdr') as Q:
+            B = list(Q.iter_sets('CH1-[345]', 600, start=100/50000.0))
+        self.assertListEqual([[len(D) for D in Ds] for Ds in B], [[600, 600, 600], [600, 300, 600], [100, 0, 100]])
+        numpy.testing.assert_array_equal(B[1][0], gen.chan_value(2, numpy.arange(700, 1300))*0.5 + 1.0)
+        numpy.testing.assert_array_equal(B[1][1], counts[700:]*0.5 + 1.0)
+
+    def test_workers(self):
+        P = gen.make_packets(50, seq0=7)
+        gen.write_dat(self.dir / 'b.dat', P)
+        counts = numpy.arange(700, dtype='i4')
+        gen.write_j(self.dir / 'x.j', counts)
+        gen.write_hdr(self.dir / 'two.hdr', {1: ['a.dat'], 2: ['b.dat']}, jfiles={'CH2-4': 'x.j'})
+        with qopen(self.dir / 'two.hdr') as Q:
+            self.assertListEqual(Q._group_sets(Q._lookup_set('CH[12]-[34]', first=False)),
+                                 [[2, 3], [34], [35]])
+            self.assertListEqual(Q._group_sets(Q._lookup_set('CH?-[35]', first=False)),
+                                 [[2, 4], [34, 36]])
+            ref = Q.sets('CH[12]-?')
+            S = Q.sets('CH[12]-?', workers=4)
+        self.assertListEqual([D.id1 for D in S], [D.id1 for D in ref])
+        for D, R in zip(S, ref):
+            numpy.testing.assert_array_equal(D, R)
+        numpy.testing.assert_array_equal(S[12], counts*0.5 + 1.0)
+
+    def test_raw(self):
+        counts = numpy.arange(-500, 500, dtype='i4')
+        gen.write_j(self.dir / 'x.j', counts)
+        gen.write_hdr(self.dir / 'j.hdr', {1: ['a.dat']}, jfiles={'CH1-4': 'x.j'})
+        with qopen(self.dir / 'j.hdr', raw=True) as Q:
+            D = Q['CH1-4', 10/50000.0:20/50000.0]
+            self.assertEqual(D.dtype, numpy.dtype('i4'))
+            self.assertIsInstance(D.base, numpy.memmap)
+            numpy.testing.assert_array_equal(D, counts[10:20])
+            self.assertEqual((D.slope, D.intercept), (0.5, 1.0))
+
+            A, B = Q.sets('CH1-[23]')
+            self.assertEqual(A.dtype, numpy.dtype('i4'))
+            numpy.testing.assert_array_equal(B, gen.chan_value(2, numpy.arange(1400)))
+
+    def test_lazy(self):
+        with qopen(self.dir / 'synth.hdr', raw=True, lazy=True) as Q:
+            D = Q['CH1-3']
+        self.assertIsInstance(D, RawChannel)
+        self.assertEqual(D.dtype, numpy.dtype('i4'))
+        ref = gen.chan_value(2, numpy.arange(1400))*0.5 + 1.0
+        self.assertEqual(D.max(), ref.max())
+        numpy.testing.assert_array_equal(D.calibrate('f4'), ref.astype('f4'))
+        numpy.testing.assert_array_equal(D - 1.0, ref - 1.0)
+        with self.assertRaisesRegex(ValueError, 'raw'):
+            qopen(self.dir / 'synth.hdr', lazy=True)
+
+    def test_gaps(self):
+        P = gen.make_packets(100)
+        gen.write_dat(self.dir / 'g1.dat', P[:50])
+        gen.write_dat(self.dir / 'g2.dat', P[52:])
+        gen.write_hdr(self.dir / 'gaps.hdr', {3: ['g1.dat', 'g2.dat']})
+        with self.assertRaises(RuntimeError):
+            with qopen(self.dir / 'gaps.hdr') as Q:
+                Q['CH3-1']
+
+        with qopen(self.dir / 'gaps.hdr', gaps=True) as Q:
+            A, B = Q.sets('CH3-[12]')
+            C = Q['CH3-1', 0:600/50000.0]
+        ref = gen.chan_value(1, numpy.arange(1400))*0.5 + 1.0
+        ref[700:728] = numpy.nan
+        numpy.testing.assert_array_equal(B, ref)
+        numpy.testing.assert_array_equal(B.gap_mask, numpy.isnan(ref))
+        self.assertIs(A.gap_mask, B.gap_mask)
+        self.assertFalse(hasattr(C, 'gap_mask'))
+
+        # mask follows slicing and decimation
+        S = B.slice(600/50000.0, 800/50000.0)
+        self.assertTupleEqual(S.gap_mask.shape, (200,))
+        numpy.testing.assert_array_equal(S.gap_mask, numpy.isnan(ref[600:800]))
+        self.assertFalse(hasattr(B.slice(None, 700/50000.0), 'gap_mask'))
+        X = B.slice(None, 1000/50000.0).decimate(10)
+        self.assertTupleEqual(X.gap_mask.shape, X.shape)
+        numpy.testing.assert_array_equal(numpy.flatnonzero(X.gap_mask), [70, 71, 72])
+
+        # placeholder counts calibrate to NaN
+        with qopen(self.dir / 'gaps.hdr', gaps=True, raw=True, lazy=True) as Q:
+            R = Q['CH3-2']
+        self.assertEqual(R.counts[700], numpy.iinfo('i4').min)
+        numpy.testing.assert_array_equal(R.calibrate(), ref)
+        numpy.testing.assert_array_equal(R.slice(650/50000.0, 750/50000.0).calibrate(), ref[650:750])
+
+    def test_cache(self):
+        self.q['CH1-1']
+        pkts, = self.q._cache._entries.values()
+        self.q['CH1-2']
+        self.assertIs(self.q._cache.get((1, ('a.dat',)), None), pkts)
+        self.q.close()
+        self.assertEqual(len(self.q._cache._entries), 0)
+
+    def test_cache_evict(self):
+        C = _PacketCache(100)
+        A = C.get('a', lambda: numpy.zeros(60, dtype='u1'))
+        self.assertIs(C.get('a', None), A)
+        C.get('b', lambda: numpy.zeros(30, dtype='u1'))
+        C.get('a', None) # 'b' now least recently used
+        C.get('c', lambda: numpy.zeros(30, dtype='u1'))
+        self.assertListEqual(list(C._entries), ['a', 'c'])
+        C.get('d', lambda: numpy.zeros(200, dtype='u1'))
+        self.assertListEqual(list(C._entries), ['d'])
+
+    def test_concat(self):
+        P = gen.make_packets(100)
+        gen.write_dat(self.dir / 'b1.dat', P[:60])
+        gen.write_dat(self.dir / 'b2.dat', P[60:])
+        gen.write_hdr(self.dir / 'split.hdr', {2: ['b1.dat', 'b2.dat']})
+        with qopen(self.dir / 'split.hdr') as Q:
+            D = Q['CH2-5']
+        numpy.testing.assert_array_equal(D, gen.chan_value(4, numpy.arange(1400))*0.5 + 1.0)
+
+class TestMatrix(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        # chassis 2 starts 10 packets (140 samples) after chassis 1, and runs 5 packets longer
+        gen.write_dat(self.dir / 'a.dat', gen.make_packets(100))
+        P = gen.make_packets(95, seq0=10)
+        gen.write_dat(self.dir / 'b.dat', P[P['seq']!=50])
+        gen.write_j(self.dir / 'CH1-4.j', gen.chan_value(3, numpy.arange(1400)))
+        gen.write_hdr(self.dir / 'synth.hdr', {1: ['a.dat'], 2: ['b.dat']}, jfiles={'CH1-4': 'CH1-4.j'})
+
+    def test_matrix(self):
+        with qopen(self.dir / 'synth.hdr', gaps=True) as Q:
+            M = Q.matrix('CH[12]-[345]')
+            self.assertTupleEqual(M.shape, (6, 1260))
+            self.assertListEqual([I['id1'] for I in M.channels],
+                                 ['CH1-3', 'CH1-4', 'CH1-5', 'CH2-3', 'CH2-4', 'CH2-5'])
+            self.assertEqual(M.dtype, numpy.dtype('f4'))
+            n = numpy.arange(140, 1400)
+            for row, chan in enumerate([2, 3, 4, 2, 3, 4]):
+                ref = gen.chan_value(chan, n)*0.5 + 1.0
+                if row>=3:
+                    ref[(n//14)==50] = numpy.nan
+                numpy.testing.assert_array_equal(M[row], ref)
+            self.assertEqual(M.gap_mask.sum(), 3*14)
+            self.assertAlmostEqual(M.abscissa_min, 0.0)
+
+            E = Q.matrix('CH[12]-3', 0.001, 0.002, abstime=False)
+            numpy.testing.assert_array_equal(E, M[[0, 3], 50:100])
+            self.assertAlmostEqual(E.time[0], 0.001)
+            numpy.testing.assert_array_equal(M.slice(0.001, 0.002)[[0, 3]], E)
+
+            A = Q.matrix('CH2-3', abstime=True)
+            self.assertAlmostEqual(A.abscissa_min, 1715701765.0 + 140/50000.0, places=6)
+            self.assertEqual(A.shape[1], 1330)
+
+        with qopen(self.dir / 'synth.hdr', gaps=True, raw=True) as Q:
+            R = Q.matrix('CH[12]-5', end=0.001)
+            self.assertEqual(R.dtype, numpy.dtype('i4'))
+            numpy.testing.assert_array_equal(R[1], gen.chan_value(4, numpy.arange(140, 190)))
@@ -0,0 +1,65 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import numpy
+
+from .. import open as qopen
+from ..stats import stats, file_stats
+from . import gen
+
+_datadir = Path(__file__).parent
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        gen.write_dat(self.dir / 'a.dat', gen.make_packets(100))
+        P = gen.make_packets(90)
+        gen.write_dat(self.dir / 'b.dat', P[P['seq']!=20])
+        gen.write_hdr(self.dir / 'synth.hdr', {1: ['a.dat'], 2: ['b.dat']}, slope=-2e-6, intercept=0.5)
+
+    def check(self, S, D, bins):
+        mask = D._info.get('gap_mask', numpy.zeros(len(D), dtype='?'))
+        ref = D.view(numpy.ndarray)[~mask]*D.slope + D.intercept
+        self.assertEqual(S.count, len(ref))
+        self.assertAlmostEqual(S.min, ref.min())
+        self.assertAlmostEqual(S.max, ref.max())
+        self.assertAlmostEqual(S.mean, ref.mean())
+        self.assertAlmostEqual(S.rms, numpy.sqrt(numpy.mean(ref**2)))
+        self.assertAlmostEqual(S.std, ref.std())
+        self.assertEqual(S.peaks, numpy.count_nonzero(numpy.abs(ref) >= 10.0))
+        numpy.testing.assert_array_equal(S.hist, numpy.histogram(ref, bins)[0])
+
+    def test_quartz(self):
+        bins = numpy.linspace(-20, 20, 17)
+        R = stats(self.dir / 'synth.hdr', key='CH*-[25]', block=500, bins=bins, peak=10.0,
+                  workers=2, gaps=True)
+        self.assertListEqual([S.name for S in R], ['CH1-2', 'CH1-5', 'CH2-2', 'CH2-5'])
+
+        with qopen(self.dir / 'synth.hdr', gaps=True, raw=True) as Q:
+            for S in R:
+                self.check(S, Q[S.name], bins)
+        self.assertEqual(R[2].count, 89*14)
+
+        counts = gen.chan_value(4, numpy.arange(1400))
+        self.assertEqual(R[1].clipped, numpy.count_nonzero((counts==-(1<<23)) | (counts==(1<<23)-1)))
+
+    def test_uff(self):
+        fname = _datadir / 'Sample_UFF58b_bin.uff'
+        (F, (S,)), = file_stats([fname], block=10000, full_scale=0.1, gaps=True) # gaps n/a for UFF
+        self.assertEqual(F, fname)
+        with qopen(fname) as U:
+            D = U[0].view(numpy.ndarray).astype('f8')
+        self.assertEqual(S.count, len(D))
+        self.assertAlmostEqual(S.max, D.max())
+        self.assertAlmostEqual(S.rms, numpy.sqrt(numpy.mean(D**2)))
+        self.assertIsNone(S.peaks)
+        self.assertIsNone(S.hist)
+        self.assertEqual(S.clipped, numpy.count_nonzero(numpy.abs(D) >= 0.1))
+
+    def test_processes(self):
+        R = list(file_stats([self.dir / 'synth.hdr']*2, processes=2, key='CH2-3', gaps=True))
+        self.assertEqual(len(R), 2)
+        self.assertEqual(R[0][1], R[1][1])
@@ -1,9 +1,18 @@
 
+import io
+import os
+import shutil
 import unittest
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy
 
 from .. import open
-from ..uff import Dir
+from .. import DataChannel, RawChannel
+from ..uff import Dir, UFF, write_uff, export
+from . import gen
 
 _datadir = Path(__file__).parent
 
@@ -32,6 +41,28 @@ class TestUFF(unittest.TestCase):
         D = self.u[0]
         self.assertEqual(D.id1, 'Mic 01.0Scalar')
 
+    def test_range(self):
+        D = self.u[0]
+        R = self.u['Mic*', D.time[100]:D.time[200]]
+        self.assertTupleEqual(R.shape, (100,))
+        self.assertEqual(R.abscissa_min, D.time[100])
+        self.assertTrue((R==D[100:200]).all())
+
+        S, = self.u.sets('Mic*', start=D.time[-10])
+        self.assertTrue((S==D[-10:]).all())
+
+    def test_blocks(self):
+        D = self.u[0]
+        B = list(self.u.iter_blocks(0, 30000))
+        self.assertListEqual([len(b) for b in B], [30000, 30000, 19292])
+        self.assertEqual(B[1].abscissa_min, D.time[30000])
+        self.assertTrue((numpy.concatenate(B)==D).all())
+
+        B = list(self.u.iter_blocks(0, 100000, overlap=10))
+        self.assertEqual(len(B), 1)
+        with self.assertRaises(ValueError):
+            next(self.u.iter_blocks(0, 10, overlap=10))
+
     def test_sets(self):
         S = self.u.sets('Mic*')
         self.assertEqual(S[0].id1, 'Mic 01.0Scalar')
@@ -42,3 +73,130 @@ class TestUFF(unittest.TestCase):
             self.u[object()]
         with self.assertRaises(IndexError):
             self.u[42]
+
+class TestIndexCache(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.fname = Path(tmp.name) / 'sample.uff'
+        shutil.copy(_datadir / 'Sample_UFF58b_bin.uff', self.fname)
+
+    def test_cache(self):
+        with open(self.fname) as U:
+            ref = list(U)
+        self.assertFalse(Path(f'{self.fname}.idx').exists())
+
+        with open(self.fname, index_cache=True) as U:
+            self.assertListEqual(list(U), ref)
+        self.assertTrue(Path(f'{self.fname}.idx').exists())
+
+        with patch.object(UFF, '_build_index', side_effect=AssertionError('not cached')):
+            with open(self.fname, index_cache=True) as U:
+                self.assertListEqual(list(U), ref)
+                D = U['Mic*']
+        self.assertEqual(D.dtype, ref[0]['dtype'])
+        self.assertEqual(D.respdir, Dir.Xp)
+
+        # stale after modification
+        st = self.fname.stat()
+        os.utime(self.fname, ns=(st.st_atime_ns, st.st_mtime_ns+1000000000))
+        with patch.object(UFF, '_build_index', autospec=True, side_effect=UFF._build_index) as B:
+            with open(self.fname, index_cache=True) as U:
+                self.assertListEqual(list(U), ref)
+        B.assert_called_once()
+
+        # read-only storage
+        Path(f'{self.fname}.idx').unlink()
+        def ro_open(name, mode='r', *args, **kws):
+            if 'w' in mode:
+                raise PermissionError(13, 'Permission denied', name)
+            return io.open(name, mode, *args, **kws)
+        with patch('quartz.uff.open', ro_open, create=True):
+            with self.assertLogs('quartz.uff', 'WARNING') as L:
+                with open(self.fname, index_cache=True) as U:
+                    self.assertListEqual(list(U), ref)
+        self.assertEqual(len(L.records), 1)
+        self.assertIsNone(L.records[0].exc_info)
+
+class TestWrite(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.fname = Path(tmp.name) / 'out.uff'
+
+    def test_roundtrip(self):
+        with open(_datadir / 'Sample_UFF58b_bin.uff') as U:
+            ref = list(U)
+            D = U[0]
+        self.assertEqual(write_uff(self.fname, [D, D.slice(D.time[100], D.time[200])]), 2)
+
+        with open(self.fname) as U:
+            out = list(U)
+            E, F = U.sets('Mic*')
+        self.assertEqual(len(out), 2)
+        for k, v in ref[0].items():
+            if k not in ('nbytes', 'npoints', 'abscissa_min'):
+                self.assertEqual(out[0][k], v, k)
+        numpy.testing.assert_array_equal(E, D)
+        numpy.testing.assert_array_equal(F, D[100:200])
+        self.assertAlmostEqual(F.abscissa_min, D.time[100], places=9)
+
+    def test_defaults(self):
+        C = numpy.arange(10, dtype='i4').view(RawChannel)
+        C._info = {'abscissa_min': 0.0, 'abscissa_inc': 0.5, 'id1': 'CH1-1', 'egu': 'V',
+                   'slope': 2.0, 'intercept': 1.0}
+        M = numpy.arange(6, dtype='f4').reshape((2, 3)).view(DataChannel)
+        M._info = {'abscissa_min': 1.0, 'abscissa_inc': 0.25,
+                   'channels': [{'id1': 'A'}, {'id1': 'B'}]}
+        write_uff(self.fname, [C, M], chunk=3)
+
+        with open(self.fname) as U:
+            A, B = U['A'], U['B']
+            R = U['CH1-1']
+        self.assertEqual(R.dtype, numpy.dtype('<f8'))
+        numpy.testing.assert_array_equal(R, numpy.arange(10)*2.0 + 1.0)
+        self.assertEqual(R.egu, 'V')
+        self.assertEqual(R.abscissa_egu, 's')
+        self.assertEqual(A.dtype, numpy.dtype('<f4'))
+        numpy.testing.assert_array_equal(B, [3, 4, 5])
+        self.assertEqual(B.abscissa_inc, 0.25)
+        self.assertEqual(B.id2, 'NONE')
+
+        # counts without RawChannel, eg. Quartz(raw=True), are calibrated
+        I = numpy.asarray([1, -(1<<31), 3], dtype='i4').view(DataChannel)
+        I._info = {'abscissa_min': 1715701765.25, 'abscissa_inc': 2e-5, 'id1': 'I',
+                   'slope': 0.5, 'intercept': 0.0, 'gap_mask': numpy.asarray([False, True, False])}
+        with self.assertLogs('quartz.uff', 'WARNING'):
+            write_uff(self.fname, [I])
+        with open(self.fname) as U:
+            R = U['I']
+        numpy.testing.assert_array_equal(R, [0.5, numpy.nan, 1.5])
+        self.assertEqual(R.abscissa_min, 0.0)
+        self.assertAlmostEqual(R.abscissa_inc, 2e-5)
+
+        # relative start time, eg. of a block, is rounded to within half a sample
+        I._info.update(abscissa_min=1234.5678, abscissa_inc=1e-3)
+        with self.assertNoLogs('quartz.uff', 'WARNING'):
+            write_uff(self.fname, [I])
+        with open(self.fname) as U:
+            self.assertEqual(U['I'].abscissa_min, 1234.568)
+
+        C._info['abscissa_runs'] = numpy.zeros(2)
+        with self.assertRaisesRegex(ValueError, 'uneven'):
+            write_uff(self.fname, [C])
+
+    def test_export(self):
+        d = self.fname.parent
+        P = gen.make_packets(100)
+        gen.write_dat(d / 'a.dat', P[P['seq']!=40])
+        gen.write_hdr(d / 'synth.hdr', {1: ['a.dat']})
+        progress = []
+        self.assertEqual(export(d / 'synth.hdr', self.fname, key='CH1-[1-3]', block=500,
+                                gaps=True, progress=lambda *P: progress.append(P)), 3)
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(progress[-1], (4200, 4200))
+
+        # same as reading calibrated sets whole
+        with open(d / 'synth.hdr', gaps=True) as Q:
+            write_uff(d / 'ref.uff', Q.sets('CH1-[1-3]'))
+        self.assertEqual(self.fname.read_bytes(), (d / 'ref.uff').read_bytes())
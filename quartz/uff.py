@@ -5,12 +5,15 @@ https://www.ceas3.uc.edu/sdrluff/
 
 import enum
 import io
+import json
 import logging
+import os
+import threading
 from collections import namedtuple
 
 import numpy
 
-from . import DataSet, DataChannel
+from . import DataSet, DataChannel, _range_info, _open_counts
 
 class Dir(enum.IntEnum):
     Scalar = 0
@@ -21,7 +24,7 @@ class Dir(enum.IntEnum):
     Yn = -2
     Zn = -3
 
-__all__ = ('UFF',)
+__all__ = ('UFF', 'write_uff', 'export')
 
 _log = logging.getLogger(__name__)
 
@@ -120,6 +123,285 @@ _decode_58axisline = _line_decoder(
     length=65,
 )
 
+def _line_encoder(specmap:list, length=80):
+    """Inverse of _line_decoder().  specmap entries are (width, conv, name)
+    where conv(info[name]) gives the field text, or conv is constant text if name is None.
+    Text is right justified.
+    """
+    assert sum(width for width, _conv, _name in specmap)==length, specmap
+
+    def action(info:dict) -> bytes:
+        parts = []
+        for width, conv, name in specmap:
+            text = (conv if name is None else conv(info[name])).rjust(width)
+            if len(text)!=width:
+                raise ValueError(f'{name}={info[name]!r} does not fit in {width} columns')
+            parts.append(text)
+        return ''.join(parts).encode('ascii', errors='replace')
+    return action
+
+def _ltext(width):
+    """Left justified text field, truncated"""
+    return lambda v: f'{v:<{width}.{width}}'
+
+def _etext(v):
+    # E13.5, with one more digit where it fits
+    return f'{v:13.6E}'
+
+_endian_code = {v:k for k,v in _endian.items()}
+_btype_code = {v:k for k,v in _btype.items()}
+
+_encode_58line0 = _line_encoder(
+    [
+        (6 , '58',  None),
+        (1 , 'b',   None),
+        (6 , lambda v:str(_endian_code[v]),   "endian"),
+        (6 , str,   "fp"),
+        (12, str,   "nlines"),
+        (12, str,   "nbytes"),
+        (6 , '0',   None),
+        (6 , '0',   None),
+        (12, '0',   None),
+        (12, '0',   None),
+    ],
+    length=79,
+)
+
+_encode_58line6 = _line_encoder(
+    [
+        (5, str, 'functype'),
+        (10, str, 'funcnum'),
+        (5, str, 'uffvers'),
+        (10, str, 'loadcase'),
+        (1, '', None),
+        (10, _ltext(10), 'respname'),
+        (10, str, 'respnode'),
+        (4, lambda v:str(int(v)), 'respdir'),
+        (1, '', None),
+        (10, _ltext(10), 'refname'),
+        (10, str, 'refnode'),
+        (4, lambda v:str(int(v)), 'refdir'),
+    ],
+)
+
+_encode_58line7 = _line_encoder(
+    [
+        (10, lambda v:str(_btype_code[v.newbyteorder('=')]), 'dtype'),
+        (10, str, 'npoints'),
+        (10, str, 'abscissa_spacing'),
+        (13, _etext, 'abscissa_min'),
+        (13, _etext, 'abscissa_inc'),
+        (13, _etext, 'abscissa_z'),
+    ],
+    length=69,
+)
+
+_encode_58axisline = _line_encoder(
+    [
+        (10, str, 'stype'),
+        (5, '0', None),
+        (5, '0', None),
+        (5, '0', None),
+        (20, lambda v:' '+_ltext(19)(v), 'label'),
+        (20, lambda v:' '+_ltext(19)(v), 'egu'),
+    ],
+    length=65,
+)
+
+# defaults for meta-data not provided by eg. Quartz
+_58defaults = {
+    'id1': 'NONE', 'id2': 'NONE', 'id3': 'NONE', 'id4': 'NONE', 'id5': 'NONE',
+    'functype': 1, # time response
+    'funcnum': 0,
+    'uffvers': 0,
+    'loadcase': 0,
+    'respname': 'NONE',
+    'respnode': 0,
+    'respdir': Dir.Scalar,
+    'refname': 'NONE',
+    'refnode': 0,
+    'refdir': Dir.Scalar,
+    'abscissa_spacing': 1,
+    'abscissa_z': 0.0,
+    'abscissa_stype': 17, # time
+    'abscissa_label': 'Time',
+    'abscissa_egu': 's',
+    'stype': 0, # unknown
+    'label': 'NONE',
+    'egu': 'NONE',
+}
+
+_crlf = b'\r\n'
+
+def _58b_header(info:dict, npoints:int, dtype:numpy.dtype) -> bytes:
+    if info.get('abscissa_runs') is not None:
+        raise ValueError(f'{info.get("id1")} has uneven abscissa')
+
+    hdr = dict(_58defaults)
+    hdr.update(info)
+    hdr.update({
+        'endian': dtype.str[0],
+        'fp': 2, # IEEE 754
+        'nlines': 11,
+        'dtype': dtype,
+        'npoints': npoints,
+        'nbytes': npoints*dtype.itemsize,
+        'abscissa_spacing': 1,
+    })
+    amin = hdr['abscissa_min']
+    if abs(float(_etext(amin)) - amin) > 0.5*abs(hdr['abscissa_inc']):
+        # eg. POSIX time, which would be off by many samples.
+        # Otherwise the nearest E13.6 value is written.
+        _log.warning('%s abscissa_min %r does not fit E13.6, written as 0.0', info.get('id1'), amin)
+        hdr['abscissa_min'] = 0.0
+
+    lines = [b'    -1', _encode_58line0(hdr)]
+    lines += [_ltext(80)(hdr[f'id{n}']).rstrip().encode('ascii', errors='replace') for n in range(1, 6)]
+    lines += [
+        _encode_58line6(hdr),
+        _encode_58line7(hdr),
+        _encode_58axisline({k:hdr[f'abscissa_{k}'] for k in ('stype', 'label', 'egu')}),
+        _encode_58axisline(hdr),
+        _encode_58axisline({'stype': 0, 'label': 'NONE', 'egu': 'NONE'}),
+        _encode_58axisline({'stype': 0, 'label': 'NONE', 'egu': 'NONE'}),
+    ]
+    return _crlf.join(lines) + _crlf
+
+_58b_trailer = b'    -1' + _crlf
+
+def _write_58b_body(fp, info:dict, data:numpy.ndarray, dtype:numpy.dtype, chunk:int):
+    """Write samples, which may be part of a dataset body
+    """
+    # counts, eg. RawChannel or Quartz(raw=True), are calibrated
+    counts = data.dtype.kind in 'iu' and 'slope' in info
+    data = data.view(numpy.ndarray)
+    mask, fill = info.get('gap_mask'), info.get('gap_fill')
+
+    for start in range(0, len(data), chunk):
+        C = data[start:start+chunk]
+        if counts: # cf. RawChannel.calibrate()
+            F = C.astype(dtype)
+            F *= info['slope']
+            F += info['intercept']
+            if mask is not None:
+                F[mask[start:start+chunk]] = numpy.nan
+            elif fill is not None:
+                F[C==fill] = numpy.nan
+            C = F
+        # no copy when data already has the output type, eg. from memmap
+        fp.write(memoryview(numpy.ascontiguousarray(C, dtype=dtype)))
+
+def _write_58b(fp, info:dict, data:numpy.ndarray, dtype:numpy.dtype, chunk:int):
+    if data.ndim!=1:
+        raise ValueError(f'{info.get("id1")} not 1-d')
+    fp.write(_58b_header(info, len(data), dtype))
+    _write_58b_body(fp, info, data, dtype, chunk)
+    fp.write(_58b_trailer)
+
+def write_uff(file, chans, dtype=None, chunk=1<<20) -> int:
+    """Write DataChannels as UFF 58b datasets.
+
+    Meta-data is taken from DataChannel info, as read by UFF or Quartz,
+    with defaults for any missing.  Sample bodies are written 'chunk'
+    samples at a time without intermediate copies where possible.
+    Integer counts with 'slope' and 'intercept' are written calibrated,
+    with NaN for placeholders of missing packets.
+    abscissa_min is written as the nearest E13.6 value, or as 0.0 with a warning
+    where that is off by more than half of abscissa_inc, eg. POSIX time.
+
+    >>> with quartz.open('some.hdr') as Q:
+    ...     write_uff('some.uff', Q.sets('*'))
+
+    :param file: File name, or file opened in binary mode.
+    :param chans: Iterable of DataChannel.  Each row of a 2-d DataChannel,
+                  as from Quartz.matrix(), is written as a dataset.
+    :param dtype: 'f4' or 'f8'.  Default float32 for float32 data, otherwise float64.
+                  Little endian unless explicitly '>f4' or '>f8'.
+    :returns: Number of datasets written
+    """
+    if not hasattr(file, 'write'): # str or Path
+        with open(file, 'wb') as F:
+            return write_uff(F, chans, dtype=dtype, chunk=chunk)
+
+    n = 0
+    for C in chans:
+        if C.ndim==2:
+            rows = [({**I, **{k:v for k,v in C._info.items() if k.startswith('abscissa_')}}, R)
+                    for I, R in zip(C._info['channels'], C.view(numpy.ndarray))]
+            mask = C._info.get('gap_mask')
+            if mask is not None:
+                for (I, _R), M in zip(rows, mask):
+                    I['gap_mask'] = M
+        else:
+            rows = [(C._info, C)]
+
+        for info, data in rows:
+            T = numpy.dtype(dtype if dtype is not None else 'f4' if data.dtype==numpy.float32 else 'f8')
+            if T.byteorder=='=':
+                T = T.newbyteorder('<')
+            _write_58b(file, info, data, T, chunk)
+            n += 1
+    return n
+
+def export(src, dst, key='*', dtype=None, block=1<<22, chunk=1<<20, progress=None, **kws) -> int:
+    """Write matching datasets as UFF 58b, 'block' samples at a time.
+
+    Unlike write_uff(), no dataset is read whole, and each group of datasets,
+    eg. a Quartz chassis, is decoded once per block.  Bodies are written in place,
+    so dst is seekable.
+
+    Quartz .hdr and HDF5 files are opened with raw=True by default,
+    and counts calibrated as written.  cf. write_uff()
+
+    :param src: DataSet, or file name passed to quartz.open() with kws.
+                gaps=True applies only to .hdr and .dat files.
+    :param dst: UFF file name
+    :param key: Dataset selection.  Default all.
+    :param dtype: 'f4' or 'f8'.  Default float32 for float32 data or counts, otherwise float64.
+    :param progress: Called with (samples written, total samples) after each block.
+    :returns: Number of datasets written
+    """
+    if not isinstance(src, DataSet):
+        with _open_counts(src, **kws) as S:
+            return export(S, dst, key=key, dtype=dtype, block=block, chunk=chunk, progress=progress)
+
+    idxs = src._lookup_set(key, first=False)
+    if isinstance(idxs, int):
+        idxs = [idxs]
+    npoints = {idx:src._npoints(idx) for idx in idxs}
+    total, done = sum(npoints.values()), 0
+
+    with open(dst, 'wb') as F:
+        # headers and trailers first, leaving space for bodies
+        layout = {} # {idx: (dtype, body offset)}
+        for idx in idxs:
+            info, N = src._index[idx].info, npoints[idx]
+            T = numpy.dtype(dtype) if dtype is not None else None
+            if T is None:
+                S = src._read_set(idx, 0, 0).dtype
+                counts = S.kind in 'iu' and 'slope' in info
+                T = numpy.dtype('f4' if S==numpy.float32 or counts else 'f8')
+            if T.byteorder=='=':
+                T = T.newbyteorder('<')
+            F.write(_58b_header(info, N, T))
+            layout[idx] = (T, F.tell())
+            F.seek(N*T.itemsize, io.SEEK_CUR)
+            F.write(_58b_trailer)
+
+        for group in src._group_sets(idxs):
+            N = max(npoints[idx] for idx in group)
+            for start in range(0, N, block):
+                for idx, C in zip(group, src._read_sets(group, start, start+block)):
+                    if len(C):
+                        T, bpos = layout[idx]
+                        F.seek(bpos + start*T.itemsize)
+                        _write_58b_body(F, C._info, C, T, chunk)
+                        done += len(C)
+                if progress is not None:
+                    progress(done, total)
+
+    return len(idxs)
+
 SetInfo = namedtuple("SetInfo", ['hpos', 'bpos', 'info'])
 
 class UFF(DataSet):
@@ -138,24 +420,40 @@ class UFF(DataSet):
 
     >>> plt.plot(S.time, S)
     """
-    def __init__(self, file):
+    def __init__(self, file, index_cache=False):
         self._index = []
         if not hasattr(file, 'readline'): # str or Path
             file = open(file, 'rb')
-        self._build_index(file)
+        try:
+            if index_cache:
+                self._cached_index(file)
+            else:
+                self._build_index(file)
+        except:
+            file.close()
+            raise
         self._fp = file
+        self._lock = threading.Lock()
 
     def close(self):
         self._index = []
         self._fp.close()
 
-    def _read_set(self, idx:int) -> DataChannel:
+    def _npoints(self, idx:int) -> int:
+        return self._index[idx].info['npoints']
+
+    def _read_set(self, idx:int, start=0, stop=None) -> DataChannel:
         S = self._index[idx]
         if S.info['abscissa_spacing']!=1:
             raise RuntimeError('Unable to read dataset with uneven abscissa_spacing')
-        self._fp.seek(S.bpos, io.SEEK_SET)
-        A = numpy.fromfile(self._fp, dtype=S.info['dtype'], count=S.info['npoints']).view(DataChannel)
-        A._info = S.info
+        npoints = S.info['npoints']
+        stop = npoints if stop is None else min(stop, npoints)
+        start = min(start, stop)
+
+        with self._lock: # file position is shared
+            self._fp.seek(S.bpos + start*S.info['dtype'].itemsize, io.SEEK_SET)
+            A = numpy.fromfile(self._fp, dtype=S.info['dtype'], count=stop-start).view(DataChannel)
+        A._info = _range_info(S.info, start)
         return A
 
     @staticmethod
@@ -213,6 +511,58 @@ class UFF(DataSet):
 
         self._index = index
 
+    # bump when SetInfo or info content changes
+    _idx_version = 1
+
+    def _cached_index(self, fp:io.BufferedRandom):
+        """Load index from sidecar file '<uff>.idx', or build and save if missing or stale.
+        """
+        st = os.fstat(fp.fileno())
+        stamp = [self._idx_version, st.st_size, st.st_mtime_ns]
+        idxname = fp.name + '.idx'
+
+        try:
+            with open(idxname, 'r') as F:
+                cache = json.load(F)
+            if cache['stamp']==stamp:
+                self._index = [SetInfo(hpos, bpos, self._load_info(info))
+                               for hpos, bpos, info in cache['sets']]
+                return
+            _log.debug('stale index %s', idxname)
+        except FileNotFoundError:
+            pass
+        except Exception:
+            _log.exception('ignoring unreadable index %s', idxname)
+
+        self._build_index(fp)
+
+        try:
+            tmpname = f'{idxname}.{os.getpid()}.tmp'
+            with open(tmpname, 'w') as F:
+                json.dump({
+                    'stamp': stamp,
+                    'sets': [(S.hpos, S.bpos, self._save_info(S.info)) for S in self._index],
+                }, F)
+            os.replace(tmpname, idxname)
+        except OSError as e:
+            # expected on read-only storage
+            _log.warning('unable to write index %s: %s', idxname, e)
+
+    @staticmethod
+    def _save_info(info: dict) -> dict:
+        info = info.copy()
+        info['dtype'] = info['dtype'].str
+        for k in ('respdir', 'refdir'):
+            info[k] = int(info[k])
+        return info
+
+    @staticmethod
+    def _load_info(info: dict) -> dict:
+        info['dtype'] = numpy.dtype(info['dtype'])
+        for k in ('respdir', 'refdir'):
+            info[k] = Dir(info[k])
+        return info
+
 def getargs():
     from argparse import ArgumentParser
     P = ArgumentParser()
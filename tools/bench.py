@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Benchmark decode, index, and read paths on synthetic files
+
+Inputs are generated deterministically from the size and layout options.
+Each benchmark runs in a fresh process, so that peak RSS is its own.
+Run from a source checkout with quartz importable, eg. PYTHONPATH=.
+
+    ./tools/bench.py --save base.json           # record baseline
+    ./tools/bench.py --compare base.json        # exit 1 on regression
+    ./tools/bench.py -k 'uff*' --msgid 0x4e41   # select benchmarks and layout
+"""
+
+import json
+import logging
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from fnmatch import fnmatch
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+import numpy
+
+import quartz
+from quartz import psc
+from quartz.quartz import Quartz
+from quartz.uff import UFF, write_uff
+from quartz.test import gen
+
+_log = logging.getLogger(__name__)
+
+# bump when benchmarks or inputs change, so stale baselines are not compared
+_bench_version = 2
+
+def generate(outdir: Path, packets=20000, chassis=2, msgid=0x4e42, nsamp=14, nsets=64, jfiles=4):
+    """Write synth.hdr, with one .dat file per chassis, .j files for the first
+    'jfiles' signals, and synth.uff with 'nsets' datasets.
+    """
+    outdir.mkdir(parents=True, exist_ok=True)
+    P = gen.make_packets(packets, nsamp=nsamp, msgid=msgid)
+    for chas in range(1, chassis+1):
+        gen.write_dat(outdir / f'chas{chas}.dat', P)
+    del P
+    gen.write_hdr(outdir / 'synth.hdr', {chas: [f'chas{chas}.dat'] for chas in range(1, chassis+1)})
+
+    jmap = {}
+    for n in range(jfiles):
+        name = f'CH1-{n+1}'
+        gen.write_j(outdir / f'{name}.j', gen.chan_value(n, numpy.arange(packets*nsamp)))
+        jmap[name] = f'{name}.j'
+    gen.write_hdr(outdir / 'synth-j.hdr', {1: ['chas1.dat']}, jfiles=jmap)
+
+    with Quartz(outdir / 'synth.hdr') as Q:
+        N = len(Q._index)
+        write_uff(outdir / 'synth.uff', (Q[n%N] for n in range(nsets)))
+
+# Each benchmark is a setup function, which is not timed, returning the function to time.
+# That returns a dict of work done: 'bytes', 'samples', and/or 'ops'
+
+def bench_read_dat(d: Path):
+    # maps, and validates headers.  Samples are not touched
+    def run():
+        with open(d / 'chas1.dat', 'rb') as F:
+            D = psc.read_dat(F)
+        return {'ops': len(D)}
+    return run
+
+def _packets(d: Path):
+    with open(d / 'chas1.dat', 'rb') as F:
+        return psc.read_dat(F)
+
+def bench_get_chan(d: Path):
+    D = _packets(d)
+    def run():
+        C = psc.get_chan(D, 3)
+        return {'bytes': C.size*3, 'samples': C.size}
+    return run
+
+def bench_get_chans(d: Path):
+    D = _packets(d)
+    def run():
+        C = psc.get_chans(D)
+        return {'bytes': C.size*3, 'samples': C.size}
+    return run
+
+def bench_uff_index(d: Path):
+    def run():
+        with UFF(d / 'synth.uff') as U:
+            n = len(U._index)
+        return {'bytes': (d / 'synth.uff').stat().st_size, 'ops': n}
+    return run
+
+def bench_uff_read(d: Path):
+    U = UFF(d / 'synth.uff')
+    def run():
+        nbytes = nsamp = 0
+        for idx in range(len(U._index)):
+            A = U._read_set(idx)
+            nbytes += A.nbytes
+            nsamp += len(A)
+        return {'bytes': nbytes, 'samples': nsamp}
+    return run
+
+def bench_quartz_read(d: Path):
+    def run():
+        nsamp = 0
+        with Quartz(d / 'synth.hdr') as Q:
+            for idx in range(len(Q._index)):
+                nsamp += len(Q._read_set(idx))
+        return {'bytes': nsamp*3, 'samples': nsamp}
+    return run
+
+def bench_quartz_read_sets(d: Path):
+    def run():
+        with Quartz(d / 'synth.hdr') as Q:
+            nsamp = sum(len(S) for S in Q.sets('*'))
+        return {'bytes': nsamp*3, 'samples': nsamp}
+    return run
+
+def bench_quartz_read_j(d: Path):
+    def run():
+        nsamp = 0
+        with Quartz(d / 'synth-j.hdr') as Q:
+            for idx in range(len(Q._index)):
+                if 'OutDataFile' in Q._json['Signals'][idx]:
+                    nsamp += len(Q._read_set(idx))
+        return {'bytes': nsamp*4, 'samples': nsamp}
+    return run
+
+def bench_lookup(d: Path):
+    U = UFF(d / 'synth.uff')
+    names = [S.info['id1'] for S in U._index]
+    U._lookup_set('*', first=False) # build ID table once
+    def run():
+        for _n in range(100):
+            for name in names:
+                U._lookup_set(name, first=False)
+            U._lookup_set('CH1-*', first=False)
+        return {'ops': 100*(len(names)+1)}
+    return run
+
+def _channel(d: Path):
+    with Quartz(d / 'synth.hdr') as Q:
+        return Q[0]
+
+def bench_slice(d: Path):
+    C = _channel(d)
+    T = C.abscissa_inc*len(C)
+    def run():
+        n = 0
+        for i in range(1000):
+            S = C.slice(T*i/2000, T*(i/2000 + 0.25))
+            n += len(S)
+        return {'bytes': n*C.itemsize, 'samples': n, 'ops': 1000}
+    return run
+
+def bench_decimate(d: Path):
+    C = _channel(d)
+    def run():
+        R = C.decimate(10)
+        return {'bytes': C.nbytes, 'samples': len(C), 'ops': len(R)}
+    return run
+
+def bench_abscissa(d: Path):
+    C = _channel(d)
+    def run():
+        C._abscissa = None # not cached
+        A = C.abscissa
+        return {'bytes': A.nbytes, 'samples': len(A)}
+    return run
+
+_benches = {name[6:]:fn for name, fn in globals().items() if name.startswith('bench_')}
+
+def _maxrss() -> float:
+    """Peak RSS of this process in MB
+    """
+    if resource is None:
+        return None
+    R = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return R/1e6 if sys.platform=='darwin' else R/1e3 # bytes vs. KB
+
+def _run1(name: str, d: str, repeat: int) -> dict:
+    """Run one benchmark, in a fresh process.  Best of 'repeat' runs
+    """
+    fn = _benches[name](Path(d))
+    rss0 = _maxrss() # after setup
+    best = None
+    for _n in range(repeat):
+        T0 = time.perf_counter()
+        W = fn()
+        dt = time.perf_counter() - T0
+        best = dt if best is None else min(best, dt)
+
+    R = {'seconds': best}
+    if 'bytes' in W:
+        R['MBps'] = W['bytes']/best/1e6
+    if 'samples' in W:
+        R['samples_per_s'] = W['samples']/best
+    if 'ops' in W:
+        R['ops_per_s'] = W['ops']/best
+    if rss0 is not None:
+        R['peak_rss_mb'] = _maxrss()
+        R['rss_growth_mb'] = R['peak_rss_mb'] - rss0
+    return R
+
+# rate used to judge regressions, in order of preference
+_rates = ('MBps', 'samples_per_s', 'ops_per_s')
+
+def compare(base: dict, cur: dict, tolerance=0.2) -> [str]:
+    """List regressions of results 'cur' relative to 'base'
+    """
+    if base.get('params')!=cur.get('params'):
+        _log.warning('Baseline parameters differ: %s', base.get('params'))
+    bad = []
+    for name, R in cur['results'].items():
+        B = base['results'].get(name)
+        if B is None:
+            continue
+        rate = next((K for K in _rates if K in R and K in B), None)
+        if rate is None:
+            print(f'{name:>20}: no rate in common with baseline, skipped')
+            continue
+        ratio = R[rate]/B[rate]
+        status = 'ok'
+        if ratio < 1-tolerance:
+            status = 'REGRESSION'
+            bad.append(name)
+        print(f'{name:>20}: {rate} {B[rate]:.4g} -> {R[rate]:.4g} ({ratio:.2f}x) {status}')
+    return bad
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser(description=__doc__.split('\n')[0])
+    P.add_argument('-k', '--key', action='append',
+                   help=f'Benchmark name pattern.  Default all of: {", ".join(_benches)}')
+    P.add_argument('-d', '--dir', type=Path,
+                   help='Directory for generated files, reused if present.  Default temporary')
+    P.add_argument('--packets', type=int, default=20000,
+                   help='Packets per chassis .dat file')
+    P.add_argument('--chassis', type=int, default=2)
+    P.add_argument('--msgid', type=lambda s:int(s, 0), choices=[0x4e41, 0x4e42], default=0x4e42,
+                   help='Packet layout')
+    P.add_argument('--nsamp', type=int, default=14,
+                   help='Samples per channel per packet')
+    P.add_argument('--nsets', type=int, default=64,
+                   help='Datasets in UFF file')
+    P.add_argument('--jfiles', type=int, default=4,
+                   help='Signals with .j files')
+    P.add_argument('-r', '--repeat', type=int, default=3)
+    P.add_argument('--save', type=Path,
+                   help='Write results as JSON baseline')
+    P.add_argument('--compare', type=Path,
+                   help='Compare with JSON baseline.  Exit 1 on regression')
+    P.add_argument('--tolerance', type=float, default=0.2,
+                   help='Allowed fractional slowdown before reporting a regression')
+    return P
+
+def main(args) -> int:
+    params = {
+        'version': _bench_version,
+        'packets': args.packets,
+        'chassis': args.chassis,
+        'msgid': args.msgid,
+        'nsamp': args.nsamp,
+        'nsets': args.nsets,
+        'jfiles': args.jfiles,
+    }
+    names = [N for N in _benches if args.key is None or any(fnmatch(N, K) for K in args.key)]
+
+    with TemporaryDirectory() as tmp:
+        d = args.dir or Path(tmp)
+        stamp = d / 'params.json'
+        if not stamp.is_file() or json.loads(stamp.read_text())!=params:
+            _log.info('Generating in %s', d)
+            generate(d, **{K:V for K, V in params.items() if K!='version'})
+            stamp.write_text(json.dumps(params))
+
+        results = {}
+        ctx = get_context('spawn')
+        for name in names:
+            with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                R = results[name] = pool.submit(_run1, name, str(d), args.repeat).result()
+            print(f'{name:>20}: ' + ' '.join(f'{K}={V:.4g}' for K, V in R.items()), flush=True)
+
+    cur = {
+        'params': params,
+        'host': {
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpus': os.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'quartz': getattr(quartz, '__version__', None),
+        },
+        'results': results,
+    }
+
+    ret = 0
+    if args.compare:
+        if compare(json.loads(args.compare.read_text()), cur, tolerance=args.tolerance):
+            ret = 1
+    if args.save:
+        args.save.write_text(json.dumps(cur, indent=2))
+    return ret
+
+if __name__=='__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(getargs().parse_args()))
@@ -1,32 +1,12 @@
 #!/usr/bin/env python3
 
-import struct
 import time
 import logging
 from pathlib import Path
-import numpy
 
-_log = logging.getLogger(__name__)
-
-_psc_body = struct.Struct('>HHIII')
+from quartz import psc
 
-_T = numpy.dtype([
-    ('ps', '>u2'),
-    ('msgid', '>u2'),
-    ('blen', '>u4'),
-    ('rsec', '>u4'),
-    ('rns', '>u4'),
-    ('sts', '>u4'),
-    ('chmask', '>u4'),
-    ('seq', '>u8'),
-    ('sec', '>u4'),
-    ('ns', '>u4'),
-    ('hihi', '>u4'),
-    ('hi', '>u4'),
-    ('lo', '>u4'),
-    ('lolo', '>u4'),
-    ('samp', 'u1', (14*3*32,)), # packed I24
-])
+_log = logging.getLogger(__name__)
 
 def getargs():
     from argparse import ArgumentParser
@@ -38,23 +18,20 @@ def getargs():
 
 def show(dat: Path):
     print(dat)
-    F = dat.open('rb')
-    body = F.read()
+    with dat.open('rb') as F:
+        I = psc.dat_info(F)
 
-    H = numpy.frombuffer(body, dtype=_T)
-    assert numpy.all(H['ps']==0x5053)
+    print('found', len(I['gaps']), 'skips of', I['packets']-1)
 
-    D = numpy.diff(H['seq'])
-
-    W, = numpy.where(D!=1)
-    print('found', len(W), 'skips of', len(D))
-
-    for w in W:
-        t = H['sec'][w] + H['ns'][w]*1e-9
+    for _w, before, after, t in I['gaps']:
         print('jump at', t, time.ctime(t), end=', ')
-        delt = H['seq'][w+1] - H['seq'][w]
-        print(delt, 'packets missed')
+        print(after - before - 1, 'packets missed')
 
+    if I['disorder']:
+        print('found', len(I['disorder']), 'out of order')
+    for _w, before, after, t in I['disorder']:
+        print('jump at', t, time.ctime(t), end=', ')
+        print('seq', before, '->', after)
 
 def main(args):
     for dat in args.dats:
@@ -1,48 +1,12 @@
 #!/usr/bin/env python3
 
-import struct
 import time
 import logging
 from pathlib import Path
-import numpy
 
-_log = logging.getLogger(__name__)
-
-_psc_body = struct.Struct('>HHIII')
-
-_body1 = numpy.dtype([
-    ('sts', '>u4'),
-    ('chmask', '>u4'),
-    ('seq', '>u8'),
-    ('sec', '>u4'),
-    ('ns', '>u4'),
-    #('samp', 'u1', (samp_per_packet*3,)), # packed I24
-])
+from quartz import psc
 
-_body2 = numpy.dtype([
-    ('sts', '>u4'),
-    ('chmask', '>u4'),
-    ('seq', '>u8'),
-    ('sec', '>u4'),
-    ('ns', '>u4'),
-    ('hihi', '>u4'),
-    ('hi', '>u4'),
-    ('lo', '>u4'),
-    ('lolo', '>u4'),
-    #('samp', 'u1', (samp_per_packet*3,)), # packed I24
-])
-_body = {
-    0x4e41: _body1,
-    0x4e42: _body2,
-}
-
-def nbits(V:int) -> int:
-    R=0
-    while V:
-        if V&1:
-            R+=1
-        V>>=1
-    return R
+_log = logging.getLogger(__name__)
 
 def getargs():
     from argparse import ArgumentParser
@@ -50,52 +14,28 @@ def getargs():
     P.add_argument('dats', type=Path,
                    nargs='+', default=[],
                    help='.dat file')
+    P.add_argument('-n', '--count', type=int, default=2,
+                   help='Number of packets to inspect.  Use -1 for all')
     return P
 
-def show(dat: Path):
+def show(dat: Path, count=2):
     print(dat)
-    F = dat.open('rb')
-    ps, msgid, msglen, rsec, rns = _psc_body.unpack(F.read(_psc_body.size))
-    assert ps==0x5053, ps
-    assert msgid in _body, msgid # TODO: skip unknown
-    _T = _body[msgid]
-
-    T0r = rsec*1000000000 + rns
-
-    body = F.read(msglen)
-    assert len(body)==msglen, msglen
-
-    H = numpy.frombuffer(body[:_T.itemsize], dtype=_T)
-    T0 = H["sec"][0]*1000000000 + H["ns"][0]
-    nchan = nbits(H['chmask'][0])
-    nsamp = (len(body) - _T.itemsize)/3
-    samp_per_chan = nsamp/nchan
-
-    ps, msgid2, msglen, rsec2, rns2 = _psc_body.unpack(F.read(_psc_body.size))
-    assert ps==0x5053, ps
-    assert msgid==msgid2 # TODO: support mixed
-
-    body = F.read(msglen)
-    assert len(body)==msglen, msglen
-
-    H1 = numpy.frombuffer(body[:_T.itemsize], dtype=_T)
-    T1 = H1["sec"][0]*1000000000 + H1["ns"][0]
-    # time between packets / samples per packet
-    dT = (T1-T0) / samp_per_chan # ns / sample
-    Fsamp = 1e9 / dT
+    with dat.open('rb') as F:
+        I = psc.dat_info(F, count=None if count<0 else count)
 
-    print(f'  msgid: 0x{msgid:04x}')
+    print(f'  msgid: 0x{I["msgid"]:04x}')
 
-    print(f'  T0: {time.ctime(H["sec"][0])} (0x{H["sec"][0]:08x} , 0x{H["ns"][0]:08x} )')
-    print(f'  Tr: {time.ctime(rsec)} Tr-T0: {(T0r-T0)/1e9} s')
+    print(f'  T0: {time.ctime(I["T0"])} ({I["T0"]:.9f})')
+    print(f'  Tr: {time.ctime(I["Tr0"])} Tr-T0: {I["Tr0"]-I["T0"]} s')
 
-    print(f'  #chan: {nchan} #samp/pkt: {nsamp} samp/chan: {samp_per_chan}')
+    print(f'  #chan: {I["nchan"]} #samp/pkt: {I["nchan"]*I["samp_per_chan"]} samp/chan: {I["samp_per_chan"]}')
 
-    print(f'  Fsamp: {Fsamp} Hz')
+    print(f'  Fsamp: {I["Fsamp"]} Hz')
+    print(f'  #pkt: {I["packets"]} gaps: {len(I["gaps"])} out of order: {len(I["disorder"])} segments: {I["segments"]}')
 
 def main(args):
     for dat in args.dats:
-        show(dat)
+        show(dat, args.count)
 
 if __name__=='__main__':
     logging.basicConfig(level=logging.DEBUG)
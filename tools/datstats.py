@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Print per-channel statistics of acquisitions, in one pass over each file
+"""
+
+import logging
+from pathlib import Path
+
+from quartz.stats import file_stats
+
+_log = logging.getLogger(__name__)
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser()
+    P.add_argument('files', type=Path, nargs='+',
+                   help='.hdr, .dat, .uff, or .h5 file')
+    P.add_argument('-k', '--key', default='*',
+                   help='Signal name pattern')
+    P.add_argument('--peak', type=float,
+                   help='Count samples with magnitude >= PEAK')
+    P.add_argument('-j', '--processes', type=int,
+                   help='Process files in parallel')
+    P.add_argument('--gaps', action='store_true',
+                   help='Tolerate missing .dat packets')
+    return P
+
+def main(args):
+    for fname, R in file_stats(args.files, processes=args.processes, key=args.key, peak=args.peak,
+                               gaps=args.gaps):
+        print('===', fname)
+        for S in R:
+            print(f'  {S.name}: #{S.count} min={S.min:g} max={S.max:g} mean={S.mean:g} rms={S.rms:g}'
+                  f' peaks={S.peaks} clipped={S.clipped}')
+
+if __name__=='__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    main(getargs().parse_args())
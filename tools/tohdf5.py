@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""Convert acquisition (.hdr) or UFF file to chunked HDF5
+"""
+
+import logging
+from pathlib import Path
+
+from quartz.hdf5 import export
+
+_log = logging.getLogger(__name__)
+
+def getargs():
+    from argparse import ArgumentParser
+    P = ArgumentParser()
+    P.add_argument('input', type=Path,
+                   help='.hdr, .dat, or .uff file')
+    P.add_argument('output', type=Path,
+                   help='.h5 file')
+    P.add_argument('-k', '--key', default='*',
+                   help='Signal name pattern')
+    P.add_argument('--chunks', type=int, default=1<<18,
+                   help='HDF5 chunk size in samples')
+    P.add_argument('-C', '--compression', choices=['gzip', 'lzf'],
+                   help='HDF5 compression filter')
+    P.add_argument('--gaps', action='store_true',
+                   help='Tolerate missing .dat packets')
+    return P
+
+def main(args):
+    print(args.input,'->',args.output)
+    n = export(args.input, args.output, key=args.key, chunks=args.chunks,
+               compression=args.compression,
+               progress=lambda done, total: print(f'{100*done/total:.1f} %', end='\r', flush=True),
+               gaps=args.gaps)
+    print()
+    print('wrote', n, 'signals')
+
+if __name__=='__main__':
+    logging.basicConfig(level=logging.DEBUG)
+    main(getargs().parse_args())